@@ -1,16 +1,145 @@
-from django.contrib import admin
-from .models import Classes, Booking
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.auth.admin import UserAdmin
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.http import HttpResponseRedirect
+from .models import Classes, Booking, Waitlist, SlotChange
+from .response_cache import bump_schedule_version
+
+class ClassAdminForm(forms.ModelForm):
+    # Version the class had when the page was opened, the edit is only written at that version
+    expected_version = forms.IntegerField(widget=forms.HiddenInput, required=False)
+
+    class Meta:
+        model = Classes
+        fields = "__all__"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk is not None:
+            self.fields['expected_version'].initial = self.instance.version
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if self.instance.pk is not None and cleaned_data.get('expected_version') != self.instance.version:
+            raise forms.ValidationError("The class changed while you were editing it, reload it and retry.")
+        return cleaned_data
+
+    def clean_total_slots(self):
+        # Same rules as ClassUpdateDeleteView, checked again by update_if_current when saving
+        total_slots = self.cleaned_data['total_slots']
+        instance = self.instance
+        if instance.pk is None or total_slots == instance.total_slots:
+            return total_slots
+        if instance.shard_count:
+            raise forms.ValidationError("Switch off slot sharding before changing total slots.")
+        if instance.available_slots + total_slots - instance.total_slots < 0:
+            raise forms.ValidationError("Total slots cannot be lower than the slots already booked.")
+        return total_slots
 
 @admin.register(Classes)
 class ClassAdmin(admin.ModelAdmin):
-    list_display = ["name", "class_type", "date_time", "instructor", "available_slots", "total_slots"]
-    list_filter = ["class_type", "date_time", "instructor"]
+    form = ClassAdminForm
+    list_display = ["name", "class_type", "date_time", "instructor", "available_slots", "total_slots", "shard_count"]
+    list_filter = ["class_type", "date_time", "instructor", "cancelled_at"]
     search_fields = ["name", "instructor"]
-    readonly_fields = ["created_at", "updated_at"]
+    # The booking counters and the version are only written by bookings and update_if_current
+    readonly_fields = ["available_slots", "version", "created_at", "updated_at", "shard_count", "cancelled_at"]
+    actions = ["cancel_classes"]
+
+    def get_readonly_fields(self, request, obj=None):
+        # A cancelled class stays closed, nothing can be edited back open
+        if obj is not None and obj.cancelled_at:
+            return [field.name for field in obj._meta.concrete_fields]
+        return super().get_readonly_fields(request, obj)
+
+    def get_search_results(self, request, queryset, search_term):
+        # Word prefix matches from the full-text index rather than icontains scans of both columns
+        if not search_term.strip():
+            return queryset, False
+        return queryset.search(search_term), False
+
+    def save_model(self, request, obj, form, change):
+        if not change:
+            with transaction.atomic():
+                super().save_model(request, obj, form, change)
+                SlotChange.record(obj.pk)
+            bump_schedule_version()
+            return
+        # Write only the edited fields at the version read for this save, never a full-row save that
+        # would overwrite slots booked concurrently
+        changes = {name: form.cleaned_data[name] for name in form.changed_data if name != 'expected_version'}
+        if not changes:
+            return
+        current = Classes.objects.get(pk=obj.pk)
+        if not current.update_if_current(form.cleaned_data['expected_version'], changes):
+            # Lost a race after the form was validated, response_change sends the user back to the form
+            request._class_edit_conflict = True
+            self.message_user(request, "The class changed while you were editing it, reload it and retry.", messages.ERROR)
+            return
+        bump_schedule_version()
+
+    def log_change(self, request, obj, message):
+        if getattr(request, '_class_edit_conflict', False):
+            return None
+        return super().log_change(request, obj, message)
+
+    def response_change(self, request, obj):
+        # Skip the "changed successfully" message and redirect when the edit was not written
+        if getattr(request, '_class_edit_conflict', False):
+            return HttpResponseRedirect(request.path)
+        return super().response_change(request, obj)
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            SlotChange.record(obj.pk)
+            super().delete_model(request, obj)
+        bump_schedule_version()
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            SlotChange.record(*queryset.values_list('pk', flat=True))
+            super().delete_queryset(request, queryset)
+        bump_schedule_version()
+
+    @admin.action(description="Cancel selected classes and all of their bookings")
+    def cancel_classes(self, request, queryset):
+        cancelled = sum(len(fitness_class.cancel_all_bookings()['user_ids']) for fitness_class in queryset)
+        self.message_user(request, f"Cancelled {queryset.count()} classes and {cancelled} bookings.")
+
+class ScheduleVersionAdminMixin:
+    """ Moves the schedule version after every admin save or delete, so cached lists and ETags follow the edit """
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        bump_schedule_version()
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        bump_schedule_version()
+
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+        bump_schedule_version()
 
 @admin.register(Booking)
-class BookingAdmin(admin.ModelAdmin):
+class BookingAdmin(ScheduleVersionAdminMixin, admin.ModelAdmin):
     list_display = ["user", "fitness_class", "status", "booked_at"]
     list_filter = ["status", "booked_at", "fitness_class__class_type"]
     search_fields = ["user__email", "fitness_class__name"]
-    readonly_fields = ["booked_at", "cancelled_at"]
\ No newline at end of file
+    readonly_fields = ["booked_at", "cancelled_at"]
+
+@admin.register(Waitlist)
+class WaitlistAdmin(ScheduleVersionAdminMixin, admin.ModelAdmin):
+    list_display = ["user", "fitness_class", "joined_at"]
+    list_filter = ["fitness_class__class_type"]
+    search_fields = ["user__email", "fitness_class__name"]
+    readonly_fields = ["joined_at"]
+
+# Bookings embed their user, so user edits move the version too
+admin.site.unregister(User)
+
+@admin.register(User)
+class ScheduledUserAdmin(ScheduleVersionAdminMixin, UserAdmin):
+    pass
@@ -4,3 +4,15 @@ from django.apps import AppConfig
 class BookingApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'booking_api'
+
+    def ready(self):
+        from django.core import checks
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_migrate
+        from .db import configure_sqlite, create_extra_indexes
+        from .response_cache import check_shared_cache
+        from .search import create_search_index
+        checks.register(check_shared_cache, checks.Tags.caches)
+        connection_created.connect(configure_sqlite, dispatch_uid='booking_api.configure_sqlite')
+        post_migrate.connect(create_extra_indexes, sender=self, dispatch_uid='booking_api.create_extra_indexes')
+        post_migrate.connect(create_search_index, sender=self, dispatch_uid='booking_api.create_search_index')
@@ -0,0 +1,27 @@
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from .middleware import activate_zone, preference_cache, preference_cache_key, timezone_setting
+from .models import UserPreference
+
+
+def stored_timezone(user):
+    """ The user's preferred timezone name, '' when there is none; cached, UserPreference.save() refreshes it """
+    cache = preference_cache()
+    key = preference_cache_key(user.pk)
+    tzname = cache.get(key)
+    if tzname is None:
+        tzname = UserPreference.objects.filter(user=user).values_list('timezone', flat=True).first() or ''
+        cache.set(key, tzname, timezone_setting('PREFERENCE_TTL'))
+    return tzname
+
+
+class TimezoneJWTAuthentication(JWTAuthentication):
+    """ JWTAuthentication that activates the user's stored timezone when the request sent no X-Timezone """
+
+    def authenticate(self, request):
+        result = super().authenticate(request)
+        if result is not None and not getattr(request, 'timezone_from_header', True):
+            tzname = stored_timezone(result[0])
+            if tzname:
+                activate_zone(tzname, f'the preference of user {result[0].pk}')
+        return result
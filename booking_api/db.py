@@ -0,0 +1,85 @@
+"""
+Database tuning.
+
+configure_sqlite applies SQLITE_PRAGMAS (WAL journal, busy_timeout, synchronous) to every new
+SQLite connection, and retry_on_db_lock retries a whole transaction with jittered backoff when
+SQLite still reports "database is locked".
+BEGIN IMMEDIATE is switched on with DATABASES['default']['OPTIONS']['transaction_mode'].
+create_extra_indexes adds indexes on tables owned by other apps after migrate.
+"""
+import random
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.db import OperationalError, connections, transaction
+
+import logging
+
+logger = logging.getLogger('booking_api')
+
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'busy_timeout': 5000,
+    'synchronous': 'NORMAL',
+}
+
+DEFAULT_RETRY = {
+    'ATTEMPTS': 5,
+    'BASE_DELAY': 0.02,
+    'MAX_DELAY': 0.5,
+}
+
+LOCK_ERRORS = ('database is locked', 'database table is locked', 'database is busy')
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """ connection_created receiver applying the configured PRAGMAs to SQLite connections """
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', DEFAULT_PRAGMAS)
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+
+
+def create_extra_indexes(sender, using='default', **kwargs):
+    """
+    post_migrate receiver for indexes on tables this app does not own.
+    BookingListView filters admins' queries on auth_user.email, which Django leaves unindexed.
+    """
+    connection = connections[using]
+    if connection.vendor not in ('sqlite', 'postgresql'):
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("CREATE INDEX IF NOT EXISTS booking_auth_user_email_idx ON auth_user (email)")
+
+
+def is_lock_error(exc):
+    return isinstance(exc, OperationalError) and any(message in str(exc).lower() for message in LOCK_ERRORS)
+
+
+def retry_on_db_lock(func):
+    """
+    Retry func when SQLite reports a lock error, sleeping a random (full jitter) exponential backoff.
+    Only the outermost transaction is retried, inside an atomic block the error is re-raised.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        options = {**DEFAULT_RETRY, **getattr(settings, 'SQLITE_LOCK_RETRY', {})}
+        attempt = 1
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as exc:
+                if (
+                    not is_lock_error(exc)
+                    or attempt >= options['ATTEMPTS']
+                    or transaction.get_connection().in_atomic_block
+                ):
+                    raise
+                delay = random.uniform(0, min(options['MAX_DELAY'], options['BASE_DELAY'] * 2 ** attempt))
+                logger.warning(f"{func.__qualname__} hit '{exc}', retry {attempt} in {delay * 1000:.0f}ms.")
+                time.sleep(delay)
+                attempt += 1
+    return wrapper
@@ -0,0 +1,164 @@
+"""
+Read-only fast path for the GET list endpoints.
+
+A (possibly sparse) ClassesSerializer or BookingSerializer instance describes the output; it is
+compiled once per request into a .values() column list and one plain reader function per field,
+so rows never go through model instances or DRF's per-field get_attribute/to_representation.
+The output must stay byte-identical to the DRF serializers (FastSerializerConformanceTestCase);
+a serializer with a field type not handled here raises UnsupportedField and the view falls back
+to DRF.
+"""
+from django.db.models import Sum
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
+
+from .models import ClassSlotShard
+from .serializers import ClassesSerializer
+
+PLAIN_FIELDS = (serializers.IntegerField, serializers.CharField, serializers.ChoiceField)
+
+
+class UnsupportedField(Exception):
+    pass
+
+
+class ReadContext:
+    """ Values shared by every row of one serialization """
+
+    def __init__(self):
+        self.now = timezone.now()
+        self.tz = timezone.get_current_timezone()
+        # Free slots of sharded classes, filled in one query after the rows are fetched
+        self.shard_totals = {}
+
+
+def column_reader(column):
+    return lambda row, context: row[column]
+
+
+def datetime_reader(field, column):
+    """ DRF DateTimeField.to_representation for values read from the database """
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+
+    def read(row, context):
+        value = row[column]
+        if not value:
+            return None
+        if output_format is None:
+            return value
+        value = value.astimezone(context.tz)
+        if output_format.lower() == ISO_8601:
+            value = value.isoformat()
+            if value.endswith('+00:00'):
+                value = value[:-6] + 'Z'
+            return value
+        return value.strftime(output_format)
+    return read
+
+
+def current_slots(row, prefix, context):
+    annotated = row.get(f'{prefix}current_slots')
+    if annotated is not None:
+        return annotated
+    if not row[f'{prefix}shard_count']:
+        return row[f'{prefix}available_slots']
+    return context.shard_totals.get(row[f'{prefix}id'], 0)
+
+
+def available_slots_reader(prefix):
+    return lambda row, context: current_slots(row, prefix, context)
+
+
+def is_available_reader(prefix):
+    # Classes.is_available, evaluated against one clock for the whole list when not annotated
+    def read(row, context):
+        annotated = row.get(f'{prefix}bookable')
+        if annotated is not None:
+            return annotated
+        return (
+            row[f'{prefix}date_time'] > context.now
+            and row[f'{prefix}cancelled_at'] is None
+            and current_slots(row, prefix, context) > 0
+        )
+    return read
+
+
+# Computed fields: (columns read, annotation read instead when the queryset has it, reader factory taking the column prefix)
+CUSTOM_READERS = {
+    (ClassesSerializer, 'available_slots'): (('id', 'available_slots', 'shard_count'), 'current_slots', available_slots_reader),
+    (ClassesSerializer, 'is_available'): (
+        ('id', 'date_time', 'available_slots', 'shard_count', 'cancelled_at'), 'bookable', is_available_reader
+    ),
+}
+
+
+class FastSerializer:
+    """ Compiled reader for one serializer layout, see the module docstring """
+
+    def __init__(self, serializer):
+        self.columns = set()
+        # Annotations the readers prefer, selected when the queryset has them
+        self.annotations = set()
+        # Column prefixes of classes whose sharded slot totals are needed
+        self.shard_prefixes = set()
+        self.readers = self.compile(serializer, '')
+
+    def compile(self, serializer, prefix):
+        readers = []
+        model_fields = {field.name for field in serializer.Meta.model._meta.concrete_fields}
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            custom = CUSTOM_READERS.get((type(serializer), name))
+            if custom:
+                columns, annotation, factory = custom
+                self.columns.update(f'{prefix}{column}' for column in columns)
+                self.annotations.add(f'{prefix}{annotation}')
+                self.shard_prefixes.add(prefix)
+                readers.append((name, factory(prefix)))
+                continue
+            column = f'{prefix}{field.source}'
+            if field.source not in model_fields:
+                # Properties and other computed sources need the model instance
+                raise UnsupportedField(f"{type(serializer).__name__}.{name}")
+            if isinstance(field, serializers.BaseSerializer):
+                nested = self.compile(field, f'{column}__')
+                readers.append((name, self.nested_reader(nested)))
+            elif isinstance(field, serializers.PrimaryKeyRelatedField):
+                # .values('user') reads the user_id column
+                self.columns.add(column)
+                readers.append((name, column_reader(column)))
+            elif isinstance(field, serializers.DateTimeField):
+                self.columns.add(column)
+                readers.append((name, datetime_reader(field, column)))
+            elif isinstance(field, PLAIN_FIELDS):
+                self.columns.add(column)
+                readers.append((name, column_reader(column)))
+            else:
+                raise UnsupportedField(f"{type(serializer).__name__}.{name}")
+        return readers
+
+    @staticmethod
+    def nested_reader(readers):
+        return lambda row, context: {name: read(row, context) for name, read in readers}
+
+    def values(self, queryset, extra_columns=()):
+        """ The .values() queryset to fetch, extra_columns are read by the caller (e.g. the paginator) """
+        annotations = self.annotations & set(queryset.query.annotations)
+        return queryset.values(*(self.columns | annotations | set(extra_columns)))
+
+    def to_representation(self, rows):
+        context = ReadContext()
+        sharded = {
+            row[f'{prefix}id'] for row in rows for prefix in self.shard_prefixes
+            if row[f'{prefix}shard_count'] and f'{prefix}current_slots' not in row
+        }
+        if sharded:
+            context.shard_totals = dict(
+                ClassSlotShard.objects.filter(fitness_class_id__in=sharded)
+                .values('fitness_class_id').annotate(total=Sum('available_slots'))
+                .values_list('fitness_class_id', 'total')
+            )
+        readers = self.readers
+        return [{name: read(row, context) for name, read in readers} for row in rows]
@@ -0,0 +1,207 @@
+"""
+Idempotency-Key support for booking POSTs.
+
+The first request for a (user, key) pair reserves the key before its view runs, with an
+insert that fails for everyone else, and its response is then stored for IDEMPOTENCY['TTL']
+seconds and replayed on retries, so a retried request never reaches the view (or the class row
+lock) again. A retry that arrives while the first request is still running gets 409. Stored
+records are never overwritten; only an expired one is removed, explicitly, before reserving.
+A reservation left by a request that died is given up after IDEMPOTENCY['PENDING_TTL'] seconds.
+"""
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+from django.http import Http404
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.response import Response
+
+import logging
+
+logger = logging.getLogger('booking_api')
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+DEFAULTS = {
+    'STORE': 'booking_api.idempotency.DatabaseIdempotencyStore',
+    'TTL': 24 * 60 * 60,
+    'PENDING_TTL': 60,
+    'CACHE_ALIAS': 'default',
+}
+
+
+def idempotency_setting(name):
+    return getattr(settings, 'IDEMPOTENCY', {}).get(name, DEFAULTS[name])
+
+
+class BaseIdempotencyStore:
+    """ Stores the first response for a user's idempotency key """
+
+    def __init__(self):
+        self.ttl = idempotency_setting('TTL')
+        self.pending_ttl = idempotency_setting('PENDING_TTL')
+
+    def get(self, user_id, key):
+        """ Return the stored {'path', 'status_code', 'body'} or None, status_code is None while pending """
+        raise NotImplementedError
+
+    def reserve(self, user_id, key, path):
+        """ Claim the key for a request about to run, returns None when claimed, else the live record """
+        raise NotImplementedError
+
+    def set(self, user_id, key, path, status_code, body):
+        """ Store the response of the request holding the reservation """
+        raise NotImplementedError
+
+    def release(self, user_id, key):
+        """ Drop an unfinished reservation so the request can be retried """
+        raise NotImplementedError
+
+    def sweep(self, batch_size=1000):
+        """ Delete expired keys, returns the number removed """
+        return 0
+
+
+class DatabaseIdempotencyStore(BaseIdempotencyStore):
+    """ Keeps responses in the IdempotencyKey table, expired rows are removed by sweep() """
+
+    def get(self, user_id, key):
+        from .models import IdempotencyKey
+        record = IdempotencyKey.objects.filter(
+            user_id=user_id, key=key, expires_at__gt=timezone.now()
+        ).values('request_path', 'status_code', 'response_body').first()
+        if record is None:
+            return None
+        return {'path': record['request_path'], 'status_code': record['status_code'], 'body': record['response_body']}
+
+    def reserve(self, user_id, key, path):
+        from .models import IdempotencyKey
+        now = timezone.now()
+        # Recycle an expired row that has not been swept yet, live rows are left alone
+        IdempotencyKey.objects.filter(user_id=user_id, key=key, expires_at__lte=now).delete()
+        try:
+            with transaction.atomic():
+                IdempotencyKey.objects.create(
+                    user_id=user_id,
+                    key=key,
+                    request_path=path,
+                    status_code=None,
+                    expires_at=now + timedelta(seconds=self.pending_ttl),
+                )
+            return None
+        except IntegrityError:
+            # Another request holds the key; if its row expired meanwhile, still treat it as in flight
+            return self.get(user_id, key) or {'path': path, 'status_code': None, 'body': None}
+
+    def set(self, user_id, key, path, status_code, body):
+        from .models import IdempotencyKey
+        # Only the pending reservation is filled in, a stored response is never replaced
+        IdempotencyKey.objects.filter(user_id=user_id, key=key, status_code__isnull=True).update(
+            status_code=status_code,
+            response_body=body,
+            expires_at=timezone.now() + timedelta(seconds=self.ttl),
+        )
+
+    def release(self, user_id, key):
+        from .models import IdempotencyKey
+        IdempotencyKey.objects.filter(user_id=user_id, key=key, status_code__isnull=True).delete()
+
+    def sweep(self, batch_size=1000):
+        from .models import IdempotencyKey
+        removed = 0
+        now = timezone.now()
+        while True:
+            # Delete by primary key in small batches to keep each write transaction short
+            ids = list(IdempotencyKey.objects.filter(expires_at__lte=now).values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return removed
+            removed += IdempotencyKey.objects.filter(id__in=ids).delete()[0]
+
+
+class CacheIdempotencyStore(BaseIdempotencyStore):
+    """ Keeps responses in a Django cache, expiry is handled by the cache timeout """
+
+    def __init__(self):
+        super().__init__()
+        self.cache = caches[idempotency_setting('CACHE_ALIAS')]
+
+    def cache_key(self, user_id, key):
+        return f"idempotency:{user_id}:{key}"
+
+    def get(self, user_id, key):
+        return self.cache.get(self.cache_key(user_id, key))
+
+    def reserve(self, user_id, key, path):
+        pending = {'path': path, 'status_code': None, 'body': None}
+        # add() only writes when the key is absent, so exactly one request claims it
+        if self.cache.add(self.cache_key(user_id, key), pending, timeout=self.pending_ttl):
+            return None
+        return self.get(user_id, key) or pending
+
+    def set(self, user_id, key, path, status_code, body):
+        record = {'path': path, 'status_code': status_code, 'body': body}
+        self.cache.set(self.cache_key(user_id, key), record, timeout=self.ttl)
+
+    def release(self, user_id, key):
+        self.cache.delete(self.cache_key(user_id, key))
+
+
+def get_idempotency_store():
+    return import_string(idempotency_setting('STORE'))()
+
+
+def idempotent(view_method):
+    """
+    Decorator for APIView handlers that honours the Idempotency-Key header.
+    Requests without the header, or from anonymous users, run unchanged.
+    """
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key or not request.user.is_authenticated:
+            return view_method(self, request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return Response(
+                {"error": f"{IDEMPOTENCY_HEADER} must be at most {MAX_KEY_LENGTH} characters."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        store = get_idempotency_store()
+        stored = store.reserve(request.user.pk, key, request.path)
+        if stored is not None:
+            if stored['path'] != request.path:
+                return Response(
+                    {"error": f"{IDEMPOTENCY_HEADER} was already used for a different request."},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY
+                )
+            if stored['status_code'] is None:
+                return Response(
+                    {"error": f"A request with this {IDEMPOTENCY_HEADER} is still being processed, retry shortly."},
+                    status=status.HTTP_409_CONFLICT,
+                    headers={'Retry-After': '1'}
+                )
+            logger.info(f"Replaying stored response for {IDEMPOTENCY_HEADER} {key} of user {request.user.username}.")
+            return Response(stored['body'], status=stored['status_code'], headers={'Idempotent-Replayed': 'true'})
+
+        try:
+            response = view_method(self, request, *args, **kwargs)
+        except (APIException, Http404) as exc:
+            # Turn client errors into responses here so they are stored like successes
+            response = self.handle_exception(exc)
+        except Exception:
+            store.release(request.user.pk, key)
+            raise
+
+        # Server errors are not stored so the client can retry them
+        if response.status_code < 500:
+            store.set(request.user.pk, key, request.path, response.status_code, response.data)
+        else:
+            store.release(request.user.pk, key)
+        return response
+    return wrapper
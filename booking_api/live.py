@@ -0,0 +1,280 @@
+"""
+In-process pub/sub of free slot counts behind the Server-Sent Events stream.
+
+SlotChange.record() publishes the changed class ids once the transaction commits. The broker
+reads their counts in one query, only for classes somebody is subscribed to, and hands them to
+each subscriber on its own event loop, so publishing from a sync worker thread is safe.
+A subscriber keeps only the newest count per class, a slow client never builds a backlog.
+
+Changes committed by other processes (other workers, release_expired_holds, ...) are not
+published here; while anyone is subscribed, one poller per process reads them from the
+SlotChange log every SLOT_STREAM['POLL_INTERVAL'] seconds.
+
+The stream is served by ClassSlotStreamView, and under fitnessAPI.asgi by SlotStreamApp, which
+answers the same path outside Django's handler: Django keeps a worker thread for every open
+request, the app keeps none, so an idle stream costs one Subscriber and its coroutine.
+"""
+import asyncio
+import threading
+from contextlib import suppress
+from urllib.parse import parse_qsl
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.urls import reverse
+from django.utils import timezone
+
+from .renderers import json_dumps
+
+import logging
+
+logger = logging.getLogger('booking_api')
+
+# booking_api.models publishes through this module, so models are imported where they are used
+
+DEFAULTS = {
+    'KEEPALIVE': 15,
+    'POLL_INTERVAL': 2,
+    'MAX_CLASSES': 100,
+}
+
+
+def slot_stream_setting(name):
+    return getattr(settings, 'SLOT_STREAM', {}).get(name, DEFAULTS[name])
+
+
+def current_slots(class_ids):
+    """ {class_id: free slots} for `class_ids`, None for classes that no longer exist or were cancelled """
+    from .models import Classes
+
+    slots = dict(Classes.objects.scheduled().with_current_slots().filter(id__in=class_ids).values_list('id', 'current_slots'))
+    return {pk: slots.get(pk) for pk in class_ids}
+
+
+class Subscriber:
+    """ One stream's subscription, woken on the event loop it was created on """
+
+    def __init__(self, class_ids):
+        self.class_ids = frozenset(class_ids)
+        self.loop = asyncio.get_running_loop()
+        self.changed = asyncio.Event()
+        self.pending = {}
+
+    def push(self, slots):
+        # Runs on self.loop, a newer count for a class replaces the unsent one
+        self.pending.update(slots)
+        self.changed.set()
+
+    async def wait(self, timeout):
+        """ Counts pushed since the last call, {} when nothing arrives within `timeout` seconds """
+        try:
+            await asyncio.wait_for(self.changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            return {}
+        self.changed.clear()
+        pending, self.pending = self.pending, {}
+        return pending
+
+
+class SlotBroker:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # class id -> subscribers of that class
+        self.subscribers = {}
+        self.poller = None
+        # Last SlotChange id the poller has seen, when it was read, and the ids read within the re-read window
+        self.seq = 0
+        self.read_at = timezone.now()
+        self.seen = set()
+
+    async def subscribe(self, subscriber):
+        with self.lock:
+            for pk in subscriber.class_ids:
+                self.subscribers.setdefault(pk, set()).add(subscriber)
+        if self.needs_poller(subscriber.loop):
+            from .models import SlotChange
+
+            # Read before the subscriber's snapshot, so nothing committed in between is missed
+            read_at = timezone.now()
+            seq = await sync_to_async(SlotChange.latest_seq)()
+            if self.needs_poller(subscriber.loop):
+                self.seq, self.read_at = seq, read_at
+                self.poller = asyncio.create_task(self.poll())
+
+    def needs_poller(self, loop):
+        return self.poller is None or self.poller.done() or self.poller.get_loop() is not loop
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            for pk in subscriber.class_ids:
+                subscribers = self.subscribers.get(pk)
+                if subscribers is None:
+                    continue
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self.subscribers[pk]
+            idle = not self.subscribers
+        if idle and self.poller is not None and not self.poller.done():
+            # Stop polling now rather than after the next interval
+            try:
+                self.poller.get_loop().call_soon_threadsafe(self.poller.cancel)
+            except RuntimeError:
+                pass
+
+    def subscriber_count(self):
+        with self.lock:
+            return len(set().union(*self.subscribers.values()))
+
+    def publish(self, class_ids):
+        """ Push the current counts of `class_ids` to their subscribers, called from sync code after commit """
+        with self.lock:
+            watched = [pk for pk in dict.fromkeys(class_ids) if pk in self.subscribers]
+        if not watched:
+            return
+        slots = current_slots(watched)
+        with self.lock:
+            updates = {}
+            for pk, count in slots.items():
+                for subscriber in self.subscribers.get(pk, ()):
+                    updates.setdefault(subscriber, {})[pk] = count
+        for subscriber, update in updates.items():
+            try:
+                subscriber.loop.call_soon_threadsafe(subscriber.push, update)
+            except RuntimeError:
+                # Its event loop is gone, so is the stream
+                self.unsubscribe(subscriber)
+
+    async def poll(self):
+        while self.subscribers:
+            await asyncio.sleep(slot_stream_setting('POLL_INTERVAL'))
+            try:
+                await sync_to_async(self.read_log)()
+            except Exception as e:
+                logger.warning(f"Slot stream poller could not read the change log: {e}")
+
+    def read_log(self):
+        from .models import SlotChange
+
+        read_at = timezone.now()
+        # Also re-reads the window below the last read for entries that committed late with a lower id
+        changes = list(SlotChange.changes_after(self.seq, self.read_at).order_by('id').values_list('id', 'fitness_class_id'))
+        fresh = [pk for seq, pk in changes if seq not in self.seen]
+        self.read_at = read_at
+        self.seen = {seq for seq, _ in changes}
+        if changes:
+            self.seq = max(self.seq, changes[-1][0])
+        if fresh:
+            self.publish(fresh)
+
+
+broker = SlotBroker()
+
+
+def publish_on_commit(class_ids):
+    """ Publish `class_ids` to the stream once the current transaction commits """
+    if broker.subscribers:
+        transaction.on_commit(lambda: broker.publish(class_ids))
+
+
+def parse_class_ids(value):
+    """ Class ids of ?classes=1,2,3, ValueError with the message for the client when missing, malformed or too many """
+    max_classes = slot_stream_setting('MAX_CLASSES')
+    try:
+        class_ids = list(dict.fromkeys(int(pk) for pk in value.split(',') if pk.strip()))
+    except ValueError:
+        class_ids = []
+    if not 0 < len(class_ids) <= max_classes:
+        raise ValueError(f"Send 1 to {max_classes} comma separated class ids.")
+    return class_ids
+
+
+def slots_event(slots):
+    return b'event: slots\ndata: ' + json_dumps(dict(sorted(slots.items()))) + b'\n\n'
+
+
+async def open_stream(class_ids):
+    """ Subscribe to `class_ids` and return the stream: a snapshot event, then changes and keepalives """
+    subscriber = Subscriber(class_ids)
+    await broker.subscribe(subscriber)
+    try:
+        # Read after subscribing, so a change committed in between is pushed rather than lost
+        snapshot = await sync_to_async(current_slots)(class_ids)
+    except Exception:
+        broker.unsubscribe(subscriber)
+        raise
+    return stream_events(subscriber, snapshot)
+
+
+async def stream_events(subscriber, snapshot):
+    sent = dict(snapshot)
+    try:
+        yield slots_event(snapshot)
+        while True:
+            slots = await subscriber.wait(slot_stream_setting('KEEPALIVE'))
+            if not slots:
+                yield b': keepalive\n\n'
+                continue
+            changed = {pk: count for pk, count in slots.items() if sent.get(pk, -1) != count}
+            if changed:
+                sent.update(changed)
+                yield slots_event(changed)
+    finally:
+        # Also runs when the server cancels the stream on a client disconnect
+        broker.unsubscribe(subscriber)
+
+
+STREAM_HEADERS = {
+    'Content-Type': 'text/event-stream',
+    'Cache-Control': 'no-cache',
+    # Keep proxies such as nginx from buffering the events
+    'X-Accel-Buffering': 'no',
+}
+
+
+class SlotStreamApp:
+    """ ASGI app serving GET <class-stream url> itself and passing every other request to `app` """
+
+    def __init__(self, app):
+        self.app = app
+        self.path = None
+
+    async def __call__(self, scope, receive, send):
+        if self.path is None:
+            self.path = reverse('class-stream')
+        if scope['type'] != 'http' or scope['path'] != self.path or scope['method'] != 'GET':
+            return await self.app(scope, receive, send)
+
+        query = dict(parse_qsl(scope['query_string'].decode('latin-1')))
+        try:
+            class_ids = parse_class_ids(query.get('classes', ''))
+        except ValueError as e:
+            return await self.respond(send, 400, {'Content-Type': 'application/json'}, json_dumps({'classes': [str(e)]}))
+
+        stream = await open_stream(class_ids)
+        await send({'type': 'http.response.start', 'status': 200, 'headers': self.encode_headers(STREAM_HEADERS)})
+        pump = asyncio.create_task(self.pump(stream, send))
+        try:
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+        finally:
+            pump.cancel()
+            with suppress(asyncio.CancelledError):
+                await pump
+
+    @staticmethod
+    async def pump(stream, send):
+        try:
+            async for chunk in stream:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        finally:
+            await stream.aclose()
+
+    @classmethod
+    async def respond(cls, send, status, headers, body):
+        await send({'type': 'http.response.start', 'status': status, 'headers': cls.encode_headers(headers)})
+        await send({'type': 'http.response.body', 'body': body})
+
+    @staticmethod
+    def encode_headers(headers):
+        return [(name.lower().encode(), value.encode()) for name, value in headers.items()]
@@ -0,0 +1,131 @@
+"""
+Helpers shared by the benchmark_* management commands.
+Files starting with an underscore are not picked up as commands by Django.
+
+Benchmarks run in a throwaway database set up like the test database (a temporary file on
+SQLite, so locking behaves as in production), never in the configured one.
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from booking_api.models import Classes
+
+BENCH_PREFIX = 'bench_'
+
+# Name of the throwaway database while a benchmark runs
+bench_database_name = None
+
+
+@contextmanager
+def bench_database():
+    """ Point the default connection at a freshly migrated throwaway database, dropped on exit """
+    global bench_database_name
+    directory = None
+    test_settings = connection.settings_dict.setdefault('TEST', {})
+    previous_test_name = test_settings.get('NAME')
+    if connection.vendor == 'sqlite':
+        directory = tempfile.mkdtemp(prefix='booking_bench_')
+        test_settings['NAME'] = os.path.join(directory, 'bench.sqlite3')
+    old_name = connection.settings_dict['NAME']
+    try:
+        bench_database_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            yield bench_database_name
+        finally:
+            bench_database_name = None
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+    finally:
+        test_settings['NAME'] = previous_test_name
+        if directory:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+class BenchmarkCommand(BaseCommand):
+    """ Base of the benchmark_* commands, handle() runs inside bench_database() """
+
+    def execute(self, *args, **options):
+        with bench_database():
+            return super().execute(*args, **options)
+
+
+def create_bench_users(count):
+    """ Bulk create throwaway users, skipping password hashing """
+    users = []
+    for i in range(count):
+        user = User(username=f"{BENCH_PREFIX}{i}", email=f"{BENCH_PREFIX}{i}@bench.local")
+        user.set_unusable_password()
+        users.append(user)
+    User.objects.bulk_create(users)
+    return list(User.objects.filter(username__startswith=BENCH_PREFIX).order_by('id'))
+
+
+def create_hot_class(slots, **kwargs):
+    """ Create one upcoming class that every benchmark thread competes for """
+    defaults = {
+        'name': f"{BENCH_PREFIX}hot_class",
+        'class_type': 'HIIT',
+        'instructor': 'Bench',
+        'duration_minutes': 30,
+        'date_time': timezone.now() + timedelta(days=1),
+        'total_slots': slots,
+        'available_slots': slots,
+    }
+    defaults.update(kwargs)
+    return Classes.objects.create(**defaults)
+
+
+def cleanup_bench_data():
+    """ Remove everything created by the benchmarks (bookings cascade), only ever in the throwaway database """
+    if bench_database_name is None or connection.settings_dict['NAME'] != bench_database_name:
+        raise RuntimeError("Benchmark data is only cleaned up inside bench_database().")
+    Classes.objects.filter(name__startswith=BENCH_PREFIX).delete()
+    User.objects.filter(username__startswith=BENCH_PREFIX).delete()
+
+
+def run_threads(worker, chunks):
+    """
+    Run worker(chunk, result) on one thread per chunk and return (elapsed seconds, merged results).
+    Each result is a dict of counters, every thread closes its own DB connection.
+    """
+    results = [dict() for _ in chunks]
+    start_event = threading.Event()
+
+    def target(chunk, result):
+        start_event.wait()
+        try:
+            worker(chunk, result)
+        finally:
+            connection.close()
+
+    threads = [
+        threading.Thread(target=target, args=(chunk, result))
+        for chunk, result in zip(chunks, results)
+    ]
+    for thread in threads:
+        thread.start()
+    started = time.perf_counter()
+    start_event.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    merged = {}
+    for result in results:
+        for key, value in result.items():
+            merged[key] = merged.get(key, 0) + value
+    return elapsed, merged
+
+
+def split(items, parts):
+    """ Split items into `parts` round-robin chunks """
+    return [items[i::parts] for i in range(parts)]
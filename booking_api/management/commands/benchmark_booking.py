@@ -0,0 +1,61 @@
+from django.db import OperationalError
+from django.test.utils import override_settings
+
+from booking_api.models import Booking, Classes
+from booking_api.serializers import BookingSerializer
+from ._bench import BenchmarkCommand, cleanup_bench_data, create_bench_users, create_hot_class, run_threads, split
+
+
+class Command(BenchmarkCommand):
+    help = "Benchmark concurrent bookings against one hot class for each booking engine."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--users', type=int, default=400)
+        parser.add_argument('--slots', type=int, default=200)
+        parser.add_argument('--engines', nargs='+', default=['locking', 'conditional'])
+
+    def handle(self, *args, **options):
+        cleanup_bench_data()
+        users = create_bench_users(options['users'])
+        try:
+            for engine in options['engines']:
+                self.run_engine(engine, users, options)
+        finally:
+            cleanup_bench_data()
+
+    def run_engine(self, engine, users, options):
+        hot_class = create_hot_class(options['slots'])
+
+        def worker(chunk, result):
+            for user in chunk:
+                serializer = BookingSerializer(data={'fitness_class_id': hot_class.id})
+                serializer.is_valid(raise_exception=True)
+                try:
+                    serializer.save(user=user)
+                    result['booked'] = result.get('booked', 0) + 1
+                except OperationalError:
+                    # SQLite "database is locked" and friends
+                    result['db_errors'] = result.get('db_errors', 0) + 1
+                except Exception:
+                    result['rejected'] = result.get('rejected', 0) + 1
+
+        with override_settings(BOOKING_ENGINE=engine):
+            elapsed, counts = run_threads(worker, split(users, options['threads']))
+
+        hot_class.refresh_from_db()
+        confirmed = Booking.objects.filter(fitness_class=hot_class, status='CONFIRMED').count()
+        oversold = confirmed - hot_class.total_slots
+        consistent = confirmed + hot_class.available_slots == hot_class.total_slots
+
+        self.stdout.write(
+            f"[{engine}] {counts.get('booked', 0)} booked, {counts.get('rejected', 0)} rejected, "
+            f"{counts.get('db_errors', 0)} db errors in {elapsed:.2f}s "
+            f"-> {counts.get('booked', 0) / elapsed:.1f} bookings/sec"
+        )
+        style = self.style.SUCCESS if oversold <= 0 and consistent else self.style.ERROR
+        self.stdout.write(style(
+            f"[{engine}] confirmed={confirmed} available={hot_class.available_slots} "
+            f"total={hot_class.total_slots} oversold={max(oversold, 0)} consistent={consistent}"
+        ))
+        Classes.objects.filter(pk=hot_class.pk).delete()
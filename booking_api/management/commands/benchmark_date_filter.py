@@ -0,0 +1,70 @@
+import random
+import time
+from datetime import datetime, time as datetime_time, timedelta
+from zoneinfo import ZoneInfo
+
+from django.db import connection
+from django.utils import timezone
+
+from booking_api.models import Classes
+from ._bench import BENCH_PREFIX, BenchmarkCommand, cleanup_bench_data
+
+
+class Command(BenchmarkCommand):
+    help = "Compare date_time__date against a local-day range filter on a year of classes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--per-day', type=int, default=24)
+        parser.add_argument('--days', type=int, default=365)
+        parser.add_argument('--queries', type=int, default=500)
+        parser.add_argument('--tz', default='Asia/Kolkata')
+
+    def handle(self, *args, **options):
+        cleanup_bench_data()
+        tz = ZoneInfo(options['tz'])
+        start = timezone.now() + timedelta(hours=1)
+        step = timedelta(days=1) / options['per_day']
+        Classes.objects.bulk_create([
+            Classes(
+                name=f"{BENCH_PREFIX}class_{i}",
+                class_type=random.choice(['YOGA', 'ZUMBA', 'HIIT']),
+                instructor='Bench',
+                duration_minutes=45,
+                date_time=start + i * step,
+                total_slots=20,
+                available_slots=20,
+            )
+            for i in range(options['days'] * options['per_day'])
+        ], batch_size=2000)
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE")
+
+        first_day = timezone.localtime(start, tz).date()
+        days = [first_day + timedelta(days=random.randrange(options['days'])) for _ in range(options['queries'])]
+        base = Classes.objects.filter(date_time__gt=timezone.now())
+
+        def by_date(day):
+            # The old filter: DATE() of the column in the query timezone, not sargable
+            with timezone.override(tz):
+                return base.filter(date_time__date=day)
+
+        def by_range(day):
+            midnight = datetime.combine(day, datetime_time.min, tzinfo=tz)
+            return base.filter(date_time__gte=midnight, date_time__lt=midnight + timedelta(days=1))
+
+        try:
+            results = {}
+            for name, build in (('date_time__date', by_date), ('local day range', by_range)):
+                queryset = build(days[0]).values_list('id', flat=True)
+                self.stdout.write(f"[{name}] plan: {queryset.explain()}")
+                started = time.perf_counter()
+                results[name] = [list(build(day).values_list('id', flat=True)) for day in days]
+                elapsed = time.perf_counter() - started
+                self.stdout.write(f"[{name}] {len(days)} queries in {elapsed:.2f}s ({1000 * elapsed / len(days):.2f} ms/query)")
+
+            same = results['date_time__date'] == results['local day range']
+            style = self.style.SUCCESS if same else self.style.ERROR
+            self.stdout.write(style(f"Same rows for every day: {same}"))
+        finally:
+            cleanup_bench_data()
@@ -0,0 +1,67 @@
+import time
+import tracemalloc
+from datetime import timedelta
+
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from booking_api.models import Booking, Classes
+from booking_api.views import BookingExportView
+from ._bench import BENCH_PREFIX, BenchmarkCommand, cleanup_bench_data, create_bench_users
+
+CLASSES = 100
+
+
+class Command(BenchmarkCommand):
+    help = "Stream the booking export at growing table sizes and report peak Python memory."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 40000])
+        parser.add_argument('--formats', nargs='+', default=['ndjson', 'csv'])
+
+    def handle(self, *args, **options):
+        sizes = sorted(options['sizes'])
+        cleanup_bench_data()
+        try:
+            # Every bench user books all bench classes, so N rows take N / CLASSES users
+            users = create_bench_users(-(-sizes[-1] // CLASSES))
+            admin = users[0]
+            admin.is_staff = True
+            admin.save(update_fields=['is_staff'])
+            start = timezone.now() + timedelta(days=1)
+            Classes.objects.bulk_create([
+                Classes(
+                    name=f"{BENCH_PREFIX}class_{i}", class_type='YOGA', instructor='Bench', duration_minutes=45,
+                    date_time=start + timedelta(hours=i), total_slots=len(users), available_slots=len(users),
+                )
+                for i in range(CLASSES)
+            ])
+            classes = list(Classes.objects.filter(name__startswith=BENCH_PREFIX))
+
+            booked = 0
+            for size in sizes:
+                Booking.objects.bulk_create([
+                    Booking(user=user, fitness_class=fitness_class, status='CONFIRMED')
+                    for user in users[booked // CLASSES:-(-size // CLASSES)]
+                    for fitness_class in classes
+                ], batch_size=5000)
+                booked = Booking.objects.filter(user__in=users).count()
+                for export_format in options['formats']:
+                    self.measure(admin, export_format, booked)
+        finally:
+            cleanup_bench_data()
+
+    def measure(self, admin, export_format, rows):
+        request = APIRequestFactory().get('/api/bookings/export/', {'format': export_format}, HTTP_HOST='localhost')
+        force_authenticate(request, user=admin)
+        tracemalloc.start()
+        started = time.perf_counter()
+        response = BookingExportView.as_view()(request)
+        total = sum(len(chunk) for chunk in response.streaming_content)
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.stdout.write(
+            f"[{export_format}] {rows} rows, {total / 1024 / 1024:.1f} MiB streamed in {elapsed:.2f}s, "
+            f"peak Python memory {peak / 1024 / 1024:.2f} MiB"
+        )
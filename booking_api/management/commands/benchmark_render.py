@@ -0,0 +1,79 @@
+import random
+import time
+from datetime import timedelta
+
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from booking_api.models import Booking, Classes
+from booking_api.renderers import ORJSONRenderer, orjson
+from booking_api.serializers import BookingSerializer, ClassesSerializer
+from ._bench import BENCH_PREFIX, BenchmarkCommand, cleanup_bench_data, create_bench_users
+
+
+class Command(BenchmarkCommand):
+    help = "Render /api/classes/ and /api/bookings/ payloads of N rows with stdlib json and orjson."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        if orjson is None:
+            self.stdout.write(self.style.WARNING("orjson is not installed, ORJSONRenderer falls back to json."))
+        rows = options['rows']
+        cleanup_bench_data()
+        try:
+            payloads = self.build_payloads(rows)
+            for name, data in payloads.items():
+                self.compare(name, data, options['repeat'])
+        finally:
+            cleanup_bench_data()
+
+    def build_payloads(self, rows):
+        start = timezone.now() + timedelta(hours=1)
+        Classes.objects.bulk_create([
+            Classes(
+                name=f"{BENCH_PREFIX}class_{i}",
+                class_type=random.choice(['YOGA', 'ZUMBA', 'HIIT']),
+                instructor='Bench',
+                duration_minutes=45,
+                date_time=start + timedelta(minutes=30 * i),
+                total_slots=20,
+                available_slots=20,
+            )
+            for i in range(rows)
+        ], batch_size=2000)
+        classes = list(Classes.objects.filter(name__startswith=BENCH_PREFIX).order_by('id'))
+
+        # Every user books a distinct run of classes, rows bookings in total
+        users = create_bench_users(max(1, rows // 100))
+        Booking.objects.bulk_create([
+            Booking(user=user, fitness_class=classes[(n * 100 + k) % len(classes)], status='CONFIRMED')
+            for n, user in enumerate(users)
+            for k in range(min(100, rows))
+        ][:rows], batch_size=2000)
+        bookings = Booking.objects.filter(user__in=users).select_related('user', 'fitness_class')
+
+        return {
+            '/api/classes/': {'next': None, 'results': ClassesSerializer(classes, many=True).data},
+            '/api/bookings/': {'next': None, 'results': BookingSerializer(bookings, many=True).data},
+        }
+
+    def compare(self, name, data, repeat):
+        timings = {}
+        output = {}
+        for renderer in (JSONRenderer(), ORJSONRenderer()):
+            label = type(renderer).__name__
+            started = time.perf_counter()
+            for _ in range(repeat):
+                output[label] = renderer.render(data, 'application/json')
+            timings[label] = (time.perf_counter() - started) / repeat
+            self.stdout.write(
+                f"[{name}] {label}: {1000 * timings[label]:.1f} ms for {len(data['results'])} rows "
+                f"({len(output[label]) / 1024:.0f} KiB)"
+            )
+        same = output['JSONRenderer'] == output['ORJSONRenderer']
+        style = self.style.SUCCESS if same else self.style.ERROR
+        speedup = timings['JSONRenderer'] / timings['ORJSONRenderer']
+        self.stdout.write(style(f"[{name}] identical output: {same}, speedup {speedup:.1f}x"))
@@ -0,0 +1,64 @@
+import random
+import time
+from datetime import timedelta
+
+from django.utils import timezone
+
+from booking_api.models import Classes
+from ._bench import BENCH_PREFIX, BenchmarkCommand, cleanup_bench_data
+
+ACTIVITIES = ['Yoga', 'Zumba', 'HIIT', 'Pilates', 'Spin', 'Boxing', 'Stretch', 'Barre', 'Core', 'Dance']
+STYLES = ['Morning', 'Power', 'Gentle', 'Evening', 'Express', 'Intense', 'Beginner', 'Advanced', 'Flow', 'Sunrise']
+FIRST_NAMES = ['Anna', 'Bob', 'Carla', 'Dev', 'Elena', 'Farid', 'Grace', 'Hugo', 'Ines', 'Jon', 'Kira', 'Liam']
+LAST_NAMES = ['Smith', 'Reyes', 'Khan', 'Novak', 'Okafor', 'Silva', 'Tanaka', 'Weber', 'Young', 'Zhang']
+
+
+class Command(BenchmarkCommand):
+    help = "Compare ?q= search on the FTS5 index with icontains filters over N classes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--queries', nargs='+', default=['yoga', 'pow yo', 'anna', 'zh', 'sunrise spin reyes'])
+
+    def handle(self, *args, **options):
+        cleanup_bench_data()
+        try:
+            self.create_classes(options['rows'])
+            for text in options['queries']:
+                self.compare(text, options['repeat'])
+        finally:
+            cleanup_bench_data()
+
+    def create_classes(self, rows):
+        start = timezone.now() + timedelta(hours=1)
+        Classes.objects.bulk_create([
+            Classes(
+                name=f"{BENCH_PREFIX}{random.choice(STYLES)} {random.choice(ACTIVITIES)} {i}",
+                class_type='YOGA',
+                instructor=f"{random.choice(FIRST_NAMES)} {random.choice(LAST_NAMES)}",
+                duration_minutes=45,
+                date_time=start + timedelta(minutes=10 * i),
+                total_slots=20,
+                available_slots=20,
+            )
+            for i in range(rows)
+        ], batch_size=5000)
+        self.stdout.write(f"Created {rows} classes.")
+
+    def compare(self, text, repeat):
+        now = timezone.now()
+        for backend in ('icontains', 'fts5'):
+            queryset = Classes.objects.filter(date_time__gt=now).search(text, backend=backend)
+            started = time.perf_counter()
+            for _ in range(repeat):
+                page = list(queryset.order_by('search_rank', 'id').values_list('id', flat=True)[:50])
+            page_ms = 1000 * (time.perf_counter() - started) / repeat
+            started = time.perf_counter()
+            for _ in range(repeat):
+                matches = queryset.count()
+            count_ms = 1000 * (time.perf_counter() - started) / repeat
+            self.stdout.write(
+                f"[q={text!r}] {backend:>9}: first page of {len(page)} in {page_ms:.1f} ms, "
+                f"count of {matches} matches in {count_ms:.1f} ms"
+            )
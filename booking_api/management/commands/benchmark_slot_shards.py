@@ -0,0 +1,60 @@
+from django.db import OperationalError
+from django.test.utils import override_settings
+
+from booking_api.models import Booking
+from booking_api.serializers import BookingSerializer
+from ._bench import BenchmarkCommand, cleanup_bench_data, create_bench_users, create_hot_class, run_threads, split
+
+
+class Command(BenchmarkCommand):
+    help = (
+        "Benchmark booking throughput of one hot class for different slot shard counts. "
+        "Sharding pays off on databases with row-level locks, SQLite still serializes every writer."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--users', type=int, default=400)
+        parser.add_argument('--slots', type=int, default=200)
+        parser.add_argument('--shards', type=int, nargs='+', default=[0, 1, 2, 4, 8])
+
+    def handle(self, *args, **options):
+        cleanup_bench_data()
+        users = create_bench_users(options['users'])
+        try:
+            for shards in options['shards']:
+                self.run_shards(shards, users, options)
+        finally:
+            cleanup_bench_data()
+
+    def run_shards(self, shards, users, options):
+        hot_class = create_hot_class(options['slots'])
+        hot_class.set_slot_shards(shards)
+
+        def worker(chunk, result):
+            for user in chunk:
+                serializer = BookingSerializer(data={'fitness_class_id': hot_class.id})
+                serializer.is_valid(raise_exception=True)
+                try:
+                    serializer.save(user=user)
+                    result['booked'] = result.get('booked', 0) + 1
+                except OperationalError:
+                    result['db_errors'] = result.get('db_errors', 0) + 1
+                except Exception:
+                    result['rejected'] = result.get('rejected', 0) + 1
+
+        # K=0 is the unsharded conditional UPDATE baseline
+        with override_settings(BOOKING_ENGINE='conditional'):
+            elapsed, counts = run_threads(worker, split(users, options['threads']))
+
+        hot_class.refresh_from_db()
+        confirmed = Booking.objects.filter(fitness_class=hot_class, status='CONFIRMED').count()
+        free = hot_class.current_available_slots
+        consistent = confirmed + free == hot_class.total_slots
+        style = self.style.SUCCESS if consistent else self.style.ERROR
+        self.stdout.write(style(
+            f"[K={shards}] {counts.get('booked', 0)} booked, {counts.get('rejected', 0)} rejected, "
+            f"{counts.get('db_errors', 0)} db errors in {elapsed:.2f}s "
+            f"-> {counts.get('booked', 0) / elapsed:.1f} bookings/sec, free={free} consistent={consistent}"
+        ))
+        hot_class.delete()
@@ -0,0 +1,88 @@
+from django.core.management.base import CommandError
+from django.db import OperationalError, connection, connections
+from django.test.utils import override_settings
+
+from booking_api.db import is_lock_error
+from booking_api.models import Booking
+from booking_api.serializers import BookingSerializer
+from ._bench import BenchmarkCommand, cleanup_bench_data, create_bench_users, create_hot_class, run_threads, split
+
+PROFILES = {
+    # Django's stock SQLite setup: rollback journal, deferred transactions, no retries
+    'stock': {
+        'transaction_mode': None,
+        'pragmas': {'journal_mode': 'DELETE', 'synchronous': 'FULL', 'busy_timeout': 5000},
+        'retry': {'ATTEMPTS': 1},
+    },
+    # The project settings: WAL, BEGIN IMMEDIATE and jittered retries
+    'tuned': {
+        'transaction_mode': 'IMMEDIATE',
+        'pragmas': {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'busy_timeout': 5000},
+        'retry': {'ATTEMPTS': 5},
+    },
+}
+
+
+class Command(BenchmarkCommand):
+    help = "Book and cancel from many threads under stock and tuned SQLite settings, reporting lock error rates."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--users', type=int, default=400)
+        parser.add_argument('--profiles', nargs='+', default=list(PROFILES), choices=list(PROFILES))
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError("This benchmark only applies to SQLite databases.")
+        cleanup_bench_data()
+        users = create_bench_users(options['users'])
+        db_options = connections.settings['default'].setdefault('OPTIONS', {})
+        original_mode = db_options.get('transaction_mode')
+        try:
+            for name in options['profiles']:
+                self.run_profile(name, PROFILES[name], users, options, db_options)
+        finally:
+            db_options['transaction_mode'] = original_mode
+            cleanup_bench_data()
+
+    def run_profile(self, name, profile, users, options, db_options):
+        hot_class = create_hot_class(len(users))
+        # Worker threads open fresh connections, which pick up these options and pragmas
+        db_options['transaction_mode'] = profile['transaction_mode']
+
+        def worker(chunk, result):
+            for user in chunk:
+                for action in ('book', 'cancel'):
+                    result['attempts'] = result.get('attempts', 0) + 1
+                    try:
+                        if action == 'book':
+                            serializer = BookingSerializer(data={'fitness_class_id': hot_class.id})
+                            serializer.is_valid(raise_exception=True)
+                            serializer.save(user=user)
+                        else:
+                            booking = Booking.objects.filter(user=user, fitness_class=hot_class, status='CONFIRMED').first()
+                            if booking:
+                                booking.cancel()
+                        result['ok'] = result.get('ok', 0) + 1
+                    except OperationalError as exc:
+                        key = 'lock_errors' if is_lock_error(exc) else 'db_errors'
+                        result[key] = result.get(key, 0) + 1
+                    except Exception:
+                        result['rejected'] = result.get('rejected', 0) + 1
+
+        with override_settings(SQLITE_PRAGMAS=profile['pragmas'], SQLITE_LOCK_RETRY=profile['retry']):
+            elapsed, counts = run_threads(worker, split(users, options['threads']))
+
+        hot_class.refresh_from_db()
+        confirmed = Booking.objects.filter(fitness_class=hot_class, status='CONFIRMED').count()
+        attempts = counts.get('attempts', 0)
+        lock_errors = counts.get('lock_errors', 0)
+        self.stdout.write(
+            f"[{name}] {attempts} operations in {elapsed:.2f}s ({counts.get('ok', 0) / elapsed:.1f} ok/sec), "
+            f"lock errors {lock_errors} ({100 * lock_errors / max(attempts, 1):.1f}%), "
+            f"other errors {counts.get('db_errors', 0) + counts.get('rejected', 0)}"
+        )
+        consistent = confirmed + hot_class.available_slots == hot_class.total_slots
+        style = self.style.SUCCESS if consistent else self.style.ERROR
+        self.stdout.write(style(f"[{name}] confirmed={confirmed} available={hot_class.available_slots} consistent={consistent}"))
+        hot_class.delete()
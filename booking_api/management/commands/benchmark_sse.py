@@ -0,0 +1,102 @@
+import asyncio
+import resource
+import threading
+import time
+import tracemalloc
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIHandler
+from django.db import transaction
+from django.urls import reverse
+
+from booking_api.live import SlotStreamApp, broker
+from booking_api.models import Classes
+from ._bench import BenchmarkCommand, cleanup_bench_data, create_hot_class
+
+
+class Connection:
+    """ One SSE client driven straight through an ASGI app, no sockets involved """
+
+    def __init__(self, app, class_id):
+        self.disconnected = asyncio.Event()
+        self.events = 0
+        self.received = asyncio.Event()
+        self.request_sent = False
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+            'path': reverse('class-stream'), 'root_path': '', 'query_string': f'classes={class_id}'.encode(),
+            'headers': [(b'host', b'localhost')], 'server': ('localhost', 80), 'client': ('127.0.0.1', 0),
+        }
+        self.task = asyncio.create_task(app(scope, self.receive, self.send))
+
+    async def receive(self):
+        if not self.request_sent:
+            self.request_sent = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await self.disconnected.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(self, message):
+        if message['type'] == 'http.response.body' and message.get('body', b'').startswith(b'event:'):
+            self.events += 1
+            self.received.set()
+
+    async def next_event(self):
+        await self.received.wait()
+        self.received.clear()
+
+
+class Command(BenchmarkCommand):
+    help = (
+        "Hold N idle slot streams open in one ASGI worker, then time the fan-out of one booking to all of them. "
+        "--django also runs them through Django's handler instead of SlotStreamApp."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subscribers', type=int, nargs='+', default=[1000, 5000])
+        parser.add_argument('--django', action='store_true', help="Compare with the plain Django ASGI handler")
+
+    def handle(self, *args, **options):
+        handlers = {'SlotStreamApp': lambda: SlotStreamApp(ASGIHandler())}
+        if options['django']:
+            handlers['ASGIHandler'] = ASGIHandler
+        cleanup_bench_data()
+        try:
+            fitness_class = create_hot_class(slots=1000)
+            for name, handler in handlers.items():
+                for count in options['subscribers']:
+                    self.label = f"[{name}, {count} streams]"
+                    asyncio.run(self.measure(handler(), fitness_class, count))
+        finally:
+            cleanup_bench_data()
+
+    async def measure(self, app, fitness_class, count):
+        threads = threading.active_count()
+        tracemalloc.start()
+        started = time.perf_counter()
+        connections = [Connection(app, fitness_class.pk) for _ in range(count)]
+        # The first event is the snapshot, the stream is then idle
+        await asyncio.gather(*(connection.next_event() for connection in connections))
+        opened = time.perf_counter() - started
+        memory, _ = tracemalloc.get_traced_memory()
+        self.stdout.write(
+            f"{self.label} opened in {opened:.2f}s, {broker.subscriber_count()} subscribed, "
+            f"{memory / count / 1024:.1f} KiB Python memory per idle stream, "
+            f"{threading.active_count() - threads} extra threads, max RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MiB"
+        )
+        tracemalloc.stop()
+
+        def book():
+            with transaction.atomic():
+                Classes.claim_slot(fitness_class.pk)
+
+        started = time.perf_counter()
+        await sync_to_async(book)()
+        await asyncio.gather(*(connection.next_event() for connection in connections))
+        self.stdout.write(f"{self.label} one booking pushed to every stream in {1000 * (time.perf_counter() - started):.1f} ms")
+
+        for connection in connections:
+            connection.disconnected.set()
+        await asyncio.gather(*(connection.task for connection in connections))
+        style = self.style.SUCCESS if broker.subscriber_count() == 0 else self.style.ERROR
+        self.stdout.write(style(f"{self.label} closed, {broker.subscriber_count()} still subscribed"))
@@ -0,0 +1,91 @@
+import contextlib
+import io
+import time
+
+from django.test import RequestFactory
+from django.utils import timezone
+from pytz import timezone as pytz_timezone
+from rest_framework.request import Request
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import AccessToken
+
+from booking_api.authentication import TimezoneJWTAuthentication
+from booking_api.middleware import TimezoneMiddleware, zone_cache
+from booking_api.models import UserPreference
+from ._bench import BenchmarkCommand, cleanup_bench_data, create_bench_users
+
+
+class PytzTimezoneMiddleware(TimezoneMiddleware):
+    """ The previous middleware: a pytz lookup on every request, print() on invalid names """
+
+    def activate(self, request):
+        tzname = request.headers.get('X-Timezone', 'Asia/Kolkata')
+        try:
+            timezone.activate(pytz_timezone(tzname))
+        except Exception:
+            print(f"Invalid timezone: {tzname}. Defaulting to 'Asia/Kolkata'.")
+            timezone.activate(pytz_timezone('Asia/Kolkata'))
+
+
+class Command(BenchmarkCommand):
+    help = (
+        "Time the per-request cost of TimezoneMiddleware against the previous pytz version for valid, "
+        "invalid and missing X-Timezone headers, and of applying a stored timezone preference."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=100000)
+        parser.add_argument('--auth-requests', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        factory = RequestFactory()
+        zones = ['UTC', 'Europe/Berlin', 'America/New_York', 'Asia/Tokyo', 'Australia/Sydney']
+        cases = {
+            'valid header': [factory.get('/', HTTP_X_TIMEZONE=zones[i % len(zones)]) for i in range(100)],
+            'invalid header': [factory.get('/', HTTP_X_TIMEZONE=f'Mars/Base{i % 10}') for i in range(100)],
+            'no header': [factory.get('/') for _ in range(100)],
+        }
+        count = options['requests']
+        for case, requests in cases.items():
+            timings = {}
+            for middleware in (PytzTimezoneMiddleware(lambda request: None), TimezoneMiddleware(lambda request: None)):
+                zone_cache.clear()
+                label = type(middleware).__name__
+                # Swallow the old middleware's prints, a terminal would only make it look slower
+                with contextlib.redirect_stdout(io.StringIO()):
+                    started = time.perf_counter()
+                    for i in range(count):
+                        middleware(requests[i % len(requests)])
+                    timings[label] = (time.perf_counter() - started) / count
+                self.stdout.write(f"[{case}] {label}: {1e6 * timings[label]:.2f} µs per request")
+            speedup = timings['PytzTimezoneMiddleware'] / timings['TimezoneMiddleware']
+            self.stdout.write(self.style.SUCCESS(f"[{case}] speedup {speedup:.1f}x"))
+        timezone.deactivate()
+
+        cleanup_bench_data()
+        try:
+            self.compare_authentication(factory, options['auth_requests'])
+        finally:
+            cleanup_bench_data()
+            timezone.deactivate()
+
+    def compare_authentication(self, factory, count):
+        user = create_bench_users(1)[0]
+        UserPreference.objects.create(user=user, timezone='Europe/Berlin')
+        token = str(AccessToken.for_user(user))
+        middleware = TimezoneMiddleware(lambda request: None)
+        timings = {}
+        for authentication in (JWTAuthentication(), TimezoneJWTAuthentication()):
+            label = type(authentication).__name__
+            started = time.perf_counter()
+            for _ in range(count):
+                request = factory.get('/', HTTP_AUTHORIZATION=f'Bearer {token}')
+                middleware(request)
+                authentication.authenticate(Request(request))
+            timings[label] = (time.perf_counter() - started) / count
+            self.stdout.write(f"[stored preference] {label}: {1e6 * timings[label]:.0f} µs per request")
+        overhead = timings['TimezoneJWTAuthentication'] - timings['JWTAuthentication']
+        self.stdout.write(self.style.SUCCESS(
+            f"[stored preference] {1e6 * overhead:.0f} µs added by the preference lookup, "
+            f"active zone {timezone.get_current_timezone_name()}"
+        ))
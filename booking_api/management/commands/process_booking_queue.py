@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from booking_api.models import BookingTicket
+
+
+class Command(BaseCommand):
+    help = "Grant or reject queued booking tickets, one transaction per class batch."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--loop', action='store_true', help="Keep draining the queue until interrupted")
+        parser.add_argument('--interval', type=float, default=1.0, help="Seconds to sleep when the queue is empty")
+
+    def handle(self, *args, **options):
+        while True:
+            granted, rejected = self.drain(options['batch_size'])
+            if granted or rejected:
+                self.stdout.write(self.style.SUCCESS(f"Granted {granted} and rejected {rejected} tickets."))
+            if not options['loop']:
+                return
+            if not (granted or rejected):
+                time.sleep(options['interval'])
+
+    def drain(self, batch_size):
+        total_granted = total_rejected = 0
+        class_ids = BookingTicket.objects.filter(status='PENDING').values_list('fitness_class_id', flat=True).distinct()
+        for class_id in list(class_ids):
+            while True:
+                granted, rejected = BookingTicket.process_class(class_id, batch_size)
+                total_granted += granted
+                total_rejected += rejected
+                if not (granted or rejected):
+                    break
+        return total_granted, total_rejected
@@ -0,0 +1,17 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from booking_api.models import SlotChange
+
+
+class Command(BaseCommand):
+    help = "Delete availability feed entries older than --hours, clients further behind get a full snapshot."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=float, default=24.0)
+
+    def handle(self, *args, **options):
+        removed = SlotChange.prune(timezone.now() - timedelta(hours=options['hours']))
+        self.stdout.write(self.style.SUCCESS(f"Removed {removed} availability feed entries."))
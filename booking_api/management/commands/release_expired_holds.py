@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from booking_api.models import Booking
+
+
+class Command(BaseCommand):
+    help = "Expire HELD bookings past their expires_at and give their slots back, in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--loop', action='store_true', help="Keep sweeping until interrupted")
+        parser.add_argument('--interval', type=float, default=30.0, help="Seconds between sweeps with --loop")
+
+    def handle(self, *args, **options):
+        while True:
+            released = Booking.release_expired_holds(batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f"Released {released} expired holds."))
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from booking_api.models import Classes
+
+
+class Command(BaseCommand):
+    help = "Split a class's free slots across K shard counters (0 folds them back), or reconcile shard totals."
+
+    def add_arguments(self, parser):
+        parser.add_argument('class_id', type=int, nargs='?')
+        parser.add_argument('--shards', type=int, default=0)
+        parser.add_argument('--reconcile', action='store_true', help="Write shard totals back into available_slots")
+
+    def handle(self, *args, **options):
+        if options['reconcile']:
+            updated = Classes.reconcile_slots()
+            self.stdout.write(self.style.SUCCESS(f"Reconciled {updated} sharded classes."))
+            return
+
+        if options['class_id'] is None:
+            raise CommandError("class_id is required unless --reconcile is given.")
+        if options['shards'] < 0:
+            raise CommandError("--shards must be 0 or more.")
+        try:
+            fitness_class = Classes.objects.get(pk=options['class_id'])
+        except Classes.DoesNotExist:
+            raise CommandError(f"Class with ID {options['class_id']} does not exist.")
+
+        fitness_class.set_slot_shards(options['shards'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Class {fitness_class.name} now uses {options['shards']} slot shards "
+            f"({fitness_class.available_slots} free slots)."
+        ))
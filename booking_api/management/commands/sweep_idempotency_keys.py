@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from booking_api.idempotency import get_idempotency_store
+
+
+class Command(BaseCommand):
+    help = "Delete expired idempotency keys in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        removed = get_idempotency_store().sweep(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Removed {removed} expired idempotency keys."))
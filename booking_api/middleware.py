@@ -1,16 +1,146 @@
+"""
+Per-request timezone from the X-Timezone header, or else the user's stored preference.
+
+Zone names resolve through a bounded LRU of ZoneInfo objects, and names that are not zones go
+to a separate bounded LRU, so a client repeating a bad header neither touches the tz database
+again nor evicts the good zones. Invalid names fall back to TIME_ZONE and are logged once
+every TIMEZONE_MIDDLEWARE['LOG_EVERY'] times.
+
+The middleware runs before DRF authenticates the request, so a stored preference is applied
+by TimezoneJWTAuthentication (booking_api.authentication) when the header was absent; the
+preferred names are cached per user so those requests usually skip the query.
+"""
+import itertools
+import threading
+from collections import OrderedDict
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
 from django.utils import timezone
-from pytz import timezone as pytz_timezone 
+
+import logging
+
+logger = logging.getLogger('booking_api')
+
+DEFAULTS = {
+    'CACHE_SIZE': 256,
+    'INVALID_CACHE_SIZE': 1024,
+    'LOG_EVERY': 100,
+    'CACHE_ALIAS': 'default',
+    'PREFERENCE_TTL': 300,
+}
+
+# Longer names are rejected without a lookup or a cache entry
+MAX_NAME_LENGTH = 64
+
+
+def timezone_setting(name):
+    return getattr(settings, 'TIMEZONE_MIDDLEWARE', {}).get(name, DEFAULTS[name])
+
+
+class ZoneCache:
+    """ Bounded LRUs of resolved zones and of names that are not zones """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.zones = OrderedDict()
+        self.invalid = OrderedDict()
+
+    def get(self, name):
+        """ The ZoneInfo named `name`, None when there is no such zone """
+        with self.lock:
+            zone = self.zones.get(name)
+            if zone is not None:
+                self.zones.move_to_end(name)
+                return zone
+            if name in self.invalid:
+                self.invalid.move_to_end(name)
+                return None
+        if len(name) > MAX_NAME_LENGTH:
+            return None
+        try:
+            zone = ZoneInfo(name)
+        except (ZoneInfoNotFoundError, ValueError, OSError):
+            zone = None
+        if zone is None:
+            self.store(self.invalid, name, True, timezone_setting('INVALID_CACHE_SIZE'))
+        else:
+            self.store(self.zones, name, zone, timezone_setting('CACHE_SIZE'))
+        return zone
+
+    def store(self, entries, name, value, size):
+        with self.lock:
+            entries[name] = value
+            while len(entries) > size:
+                entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.zones.clear()
+            self.invalid.clear()
+
+
+zone_cache = ZoneCache()
+
+
+def preference_cache():
+    return caches[timezone_setting('CACHE_ALIAS')]
+
+
+def preference_cache_key(user_id):
+    return f'booking_api:timezone:{user_id}'
+
+
+# Invalid names seen by this process, for sampled logging
+invalid_count = itertools.count()
+
+
+def activate_default():
+    # Cheaper than timezone.deactivate(), which probes the request-local first
+    timezone.activate(zone_cache.get(settings.TIME_ZONE))
+
+
+def activate_zone(name, source):
+    """ Activate the zone called `name`, the default timezone when it is not one; True when it was """
+    zone = zone_cache.get(name)
+    if zone is not None:
+        timezone.activate(zone)
+        return True
+    activate_default()
+    seen = next(invalid_count)
+    if seen % timezone_setting('LOG_EVERY') == 0:
+        logger.warning(f"Invalid timezone from {source}: {name!r}, using {settings.TIME_ZONE} ({seen + 1} invalid so far)")
+    return False
+
 
 class TimezoneMiddleware:
+    # Async capable so async views (the slot stream) keep the whole chain async under ASGI
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
-        tzname = request.headers.get('X-Timezone', 'Asia/Kolkata')
-        try:
-            timezone.activate(pytz_timezone(tzname))
-        except Exception:
-            print(f"Invalid timezone: {tzname}. Defaulting to 'Asia/Kolkata'.")
-            timezone.activate(pytz_timezone('Asia/Kolkata'))
-        
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        self.activate(request)
         return self.get_response(request)
+
+    async def __acall__(self, request):
+        self.activate(request)
+        return await self.get_response(request)
+
+    def activate(self, request):
+        # META rather than request.headers, which copies every header on first use
+        tzname = request.META.get('HTTP_X_TIMEZONE')
+        # Read by TimezoneJWTAuthentication, which only applies a stored preference without a header
+        request.timezone_from_header = bool(tzname)
+        if tzname:
+            activate_zone(tzname, 'X-Timezone')
+        else:
+            activate_default()
@@ -1,7 +1,78 @@
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.db import transaction
+from django.db.models import F, Sum, Count, Max, Case, When, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .db import retry_on_db_lock
+from .live import publish_on_commit
+from .middleware import preference_cache, preference_cache_key
+from .response_cache import bump_schedule_version
+from .search import FTS_TABLE, SearchTextField, has_search_index, match_expression, search_words
+
+import random
+
+
+class ClassesQuerySet(models.QuerySet):
+    def with_current_slots(self):
+        """ Annotate current_slots: available_slots, or the sum of the slot shards for sharded classes """
+        shard_total = (
+            ClassSlotShard.objects.filter(fitness_class=OuterRef('pk'))
+            .values('fitness_class')
+            .annotate(total=Sum('available_slots'))
+            .values('total')
+        )
+        return self.annotate(current_slots=Case(
+            When(shard_count=0, then=F('available_slots')),
+            default=Coalesce(Subquery(shard_total), 0),
+        ))
+
+    def scheduled(self):
+        """ Classes that have not been called off by cancel_all_bookings() """
+        return self.filter(cancelled_at__isnull=True)
+
+    def with_availability(self, now=None):
+        """ with_current_slots() plus bookable: Classes.is_available computed in SQL """
+        now = now or timezone.now()
+        return self.with_current_slots().annotate(bookable=Case(
+            When(date_time__gt=now, current_slots__gt=0, cancelled_at__isnull=True, then=models.Value(True)),
+            default=models.Value(False),
+            output_field=models.BooleanField(),
+        ))
+
+    def available(self, now=None):
+        """
+        Classes that can still be booked, filtered in SQL on a with_current_slots() queryset.
+        The slots condition repeats the one of class_available_idx so SQLite can use the partial index.
+        """
+        now = now or timezone.now()
+        return self.filter(
+            models.Q(available_slots__gt=0) | models.Q(shard_count__gt=0),
+            date_time__gt=now,
+            current_slots__gt=0,
+            cancelled_at__isnull=True,
+        )
+
+    def search(self, text, backend=None):
+        """
+        Classes whose name or instructor has a word starting with every word of `text`, annotated
+        with search_rank (lower is a better match). Uses the FTS5 index on SQLite, icontains
+        elsewhere, when the index is missing or with backend (default CLASS_SEARCH_BACKEND) 'icontains'.
+        """
+        words = search_words(text)
+        if not words:
+            return self.none().annotate(search_rank=models.Value(0.0, output_field=models.FloatField()))
+        backend = backend or getattr(settings, 'CLASS_SEARCH_BACKEND', 'fts5')
+        if backend == 'fts5' and has_search_index(self.db):
+            return self.filter(search__name__match=match_expression(words)).annotate(search_rank=F('search__rank'))
+        condition = models.Q()
+        for word in words:
+            condition &= models.Q(name__icontains=word) | models.Q(instructor__icontains=word)
+        return self.filter(condition).annotate(search_rank=models.Value(0.0, output_field=models.FloatField()))
+
 
 class Classes(models.Model):
     CHOICES_CLASS = (
@@ -16,11 +87,32 @@ class Classes(models.Model):
     date_time = models.DateTimeField()
     total_slots = models.PositiveIntegerField()
     available_slots = models.PositiveIntegerField()
+    # Number of ClassSlotShard rows holding the free slots, 0 means available_slots is authoritative
+    shard_count = models.PositiveSmallIntegerField(default=0)
+    # Bumped on every admin edit, exposed as the ETag of the class
+    version = models.PositiveIntegerField(default=1)
+    # Set by cancel_all_bookings(), a cancelled class is hidden and closed to bookings, waitlists and edits
+    cancelled_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ClassesQuerySet.as_manager()
+
     class Meta:
         ordering = ['date_time']
+        indexes = [
+            # Keyset pagination of the class list
+            models.Index(fields=['date_time', 'id'], name='class_keyset_idx'),
+            # ClassListView ?type= filter over upcoming classes
+            models.Index(fields=['class_type', 'date_time'], name='class_type_date_idx'),
+            # ?available=true, only classes with free slots. Sharded classes keep their free slots in
+            # the shards (available_slots is not authoritative), so they are always indexed
+            models.Index(
+                fields=['date_time', 'id'],
+                condition=models.Q(available_slots__gt=0) | models.Q(shard_count__gt=0),
+                name='class_available_idx',
+            ),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.pk and self.available_slots is None:
@@ -34,50 +126,583 @@ class Classes(models.Model):
     def is_upcomming(self):
         return self.date_time > timezone.now()
     
+    @property
+    def current_available_slots(self):
+        """ Free slots, reconciled from the shards for sharded classes """
+        if not self.shard_count:
+            return self.available_slots
+        if hasattr(self, 'current_slots'):
+            return self.current_slots
+        return self.slot_shards.aggregate(total=Sum('available_slots'))['total'] or 0
+
     @property
     def is_available(self):
-        return self.is_upcomming and self.available_slots > 0
+        if hasattr(self, 'bookable'):
+            # Annotated by ClassesQuerySet.with_availability()
+            return self.bookable
+        return self.is_upcomming and not self.cancelled_at and self.current_available_slots > 0
+
+    @classmethod
+    def claim_slot(cls, pk, user_id=None):
+        """
+        Take one slot from an upcoming class with a single guarded UPDATE.
+        Sharded classes take the slot from one of their shards instead.
+        Returns True if a slot was claimed, False if the class is full, past, cancelled or missing.
+        """
+        now = timezone.now()
+        claimed = cls.objects.scheduled().filter(pk=pk, shard_count=0, available_slots__gt=0, date_time__gt=now).update(
+            available_slots=F('available_slots') - 1,
+            updated_at=now,
+        )
+        if not claimed:
+            shard_count = (
+                cls.objects.scheduled().filter(pk=pk, shard_count__gt=0, date_time__gt=now)
+                .values_list('shard_count', flat=True).first()
+            )
+            if not shard_count or not ClassSlotShard.claim(pk, shard_count, user_id):
+                return False
+        SlotChange.record(pk)
+        return True
+
+    @classmethod
+    def release_slot(cls, pk, user_id=None):
+        """ Give one slot back to a class (or one of its shards) without locking the row """
+        released = cls.objects.filter(pk=pk, shard_count=0).update(
+            available_slots=F('available_slots') + 1,
+            updated_at=timezone.now(),
+        )
+        if not released:
+            shard_count = cls.objects.filter(pk=pk).values_list('shard_count', flat=True).first()
+            if not shard_count:
+                return
+            ClassSlotShard.release(pk, shard_count, user_id)
+        SlotChange.record(pk)
+
+    def set_slot_shards(self, shards):
+        """
+        Split the free slots of this class across `shards` counter rows, or fold them
+        back into available_slots when shards is 0.
+        """
+        with transaction.atomic():
+            fitness_class = Classes.objects.select_for_update().get(pk=self.pk)
+            total = fitness_class.current_available_slots
+            ClassSlotShard.objects.filter(fitness_class=fitness_class).delete()
+            base, extra = divmod(total, shards) if shards else (0, 0)
+            ClassSlotShard.objects.bulk_create([
+                ClassSlotShard(fitness_class=fitness_class, shard=shard, available_slots=base + (shard < extra))
+                for shard in range(shards)
+            ])
+            Classes.objects.filter(pk=self.pk).update(shard_count=shards, available_slots=total, updated_at=timezone.now())
+        self.shard_count = shards
+        self.available_slots = total
+
+    def update_if_current(self, version, changes):
+        """
+        Write only `changes` if the row is still at `version`, bumping the version.
+        A total_slots change moves available_slots by the same delta in SQL so concurrent
+        bookings are never overwritten. Cancelled classes are never updated.
+        Returns the number of rows updated (0 or 1).
+        """
+        now = timezone.now()
+        values = dict(changes, version=F('version') + 1, updated_at=now)
+        filters = models.Q(pk=self.pk, version=version, cancelled_at__isnull=True)
+        if 'total_slots' in changes:
+            delta = changes['total_slots'] - self.total_slots
+            values['available_slots'] = F('available_slots') + delta
+            if delta < 0:
+                filters &= models.Q(available_slots__gte=-delta)
+        with transaction.atomic():
+            updated = Classes.objects.filter(filters).update(**values)
+            if updated:
+                SlotChange.record(self.pk)
+        return updated
+
+    def cancel_all_bookings(self):
+        """
+        Call the class off: mark it cancelled, cancel every confirmed or held booking with one UPDATE,
+        and clear its waitlist and queued tickets, all in one transaction.
+        Returns the affected user ids so notifications can be sent in bulk.
+        """
+        with transaction.atomic():
+            now = timezone.now()
+            # Close the class first so no new booking can slip in behind the cancellation
+            Classes.objects.filter(pk=self.pk).update(
+                available_slots=0,
+                shard_count=0,
+                cancelled_at=Coalesce(F('cancelled_at'), models.Value(now)),
+                updated_at=now,
+            )
+            ClassSlotShard.objects.filter(fitness_class_id=self.pk).delete()
+            SlotChange.record(self.pk)
+
+            active = Booking.objects.filter(fitness_class_id=self.pk, status__in=Booking.ACTIVE_STATUSES)
+            user_ids = list(active.values_list('user_id', flat=True))
+            active.update(status='CANCELLED', cancelled_at=now, expires_at=None, updated_at=now)
+
+            waitlist = Waitlist.objects.filter(fitness_class_id=self.pk)
+            waitlisted_user_ids = list(waitlist.values_list('user_id', flat=True))
+            waitlist.delete()
+            BookingTicket.objects.filter(fitness_class_id=self.pk, status='PENDING').update(
+                status='REJECTED', reason="This class has been cancelled.", processed_at=now
+            )
+        bump_schedule_version()
+        self.available_slots = 0
+        self.shard_count = 0
+        self.cancelled_at = Classes.objects.filter(pk=self.pk).values_list('cancelled_at', flat=True).first()
+        return {'user_ids': user_ids, 'waitlisted_user_ids': waitlisted_user_ids}
+
+    @classmethod
+    def reconcile_slots(cls):
+        """ Write the shard totals back into available_slots of every sharded class """
+        return cls.objects.filter(shard_count__gt=0).with_current_slots().update(available_slots=F('current_slots'))
     
 class Booking(models.Model):
     CHOICES_STATUS = (
         ('CONFIRMED', 'Confirmed'),
         ('CANCELLED', 'Cancelled'),
-    )    
+        ('HELD', 'Held'),
+        ('EXPIRED', 'Expired'),
+    )
+    # Statuses that occupy a slot and block a second booking of the same class
+    ACTIVE_STATUSES = ('CONFIRMED', 'HELD')
     
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='user_bookings')
     fitness_class = models.ForeignKey(Classes, on_delete=models.CASCADE, related_name='class_bookings')
     status = models.CharField(max_length=20, choices=CHOICES_STATUS, default='CONFIRMED')
     booked_at = models.DateTimeField(auto_now_add=True)
     cancelled_at = models.DateTimeField(null=True, blank=True)
+    # Set while the booking is a HELD slot waiting to be confirmed
+    expires_at = models.DateTimeField(null=True, blank=True)
+    # Set by every bulk status change as well
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         constraints = [
             models.UniqueConstraint(
                 fields=['user', 'fitness_class'],
-                condition=models.Q(status='CONFIRMED'),
+                condition=models.Q(status__in=['CONFIRMED', 'HELD']),
                 name='unique_active_user_class_booking'
             )
         ]
         indexes = [
             models.Index(fields=['booked_at']),
             models.Index(fields=['status']),
+            # A user's bookings in list order, and their per-status counts
+            models.Index(fields=['user', 'booked_at'], name='booking_user_keyset_idx'),
+            models.Index(fields=['user', 'status'], name='booking_user_status_idx'),
+            # Bookings of a class by status (statistics, class cancellation)
+            models.Index(fields=['fitness_class', 'status'], name='booking_class_status_idx'),
+            # Only holds carry an expiry, keep the sweeper's index small
+            models.Index(fields=['expires_at'], condition=models.Q(status='HELD'), name='booking_hold_expiry_idx'),
         ]
     
     def __str__(self):
         return f"{self.user.email} - {self.fitness_class.name}"
     
+    @retry_on_db_lock
     def cancel(self):
+        if getattr(settings, 'BOOKING_ENGINE', 'locking') == 'conditional':
+            return self._cancel_conditional()
+        previous = (self.status, self.cancelled_at)
+        try:
+            return self._cancel_locking()
+        except Exception:
+            # Leave the instance as it was so a retry sees the booking still active
+            self.status, self.cancelled_at = previous
+            raise
+
+    def _cancel_locking(self):
         with transaction.atomic():
-            # Ensure the booking is confirmed before cancelling
-            if self.status != 'CONFIRMED':
+            # Ensure the booking is confirmed (or held) before cancelling
+            if self.status not in self.ACTIVE_STATUSES:
                 return False
             # Lock the Class, Update the booking status and available slots
             fitness_class = Classes.objects.select_for_update().get(pk=self.fitness_class.pk)
             self.status = 'CANCELLED'
             self.cancelled_at = timezone.now()
-            fitness_class.available_slots += 1
-            fitness_class.save()
             self.save()
+            # Hand the freed slot to the head of the waitlist, otherwise release it
+            if not Waitlist.promote_next(fitness_class):
+                if fitness_class.shard_count:
+                    Classes.release_slot(fitness_class.pk, self.user_id)
+                else:
+                    fitness_class.available_slots += 1
+                    fitness_class.save(update_fields=['available_slots', 'updated_at'])
+                    SlotChange.record(fitness_class.pk)
+        bump_schedule_version()
         return True
-    
 
+    def _cancel_conditional(self):
+        with transaction.atomic():
+            # Flip the status only if the booking is still active, so concurrent cancels release one slot
+            now = timezone.now()
+            cancelled = Booking.objects.filter(pk=self.pk, status__in=self.ACTIVE_STATUSES).update(
+                status='CANCELLED',
+                cancelled_at=now,
+                updated_at=now,
+            )
+            if not cancelled:
+                return False
+            if not Waitlist.promote_next(self.fitness_class):
+                Classes.release_slot(self.fitness_class_id, self.user_id)
+        self.status = 'CANCELLED'
+        self.cancelled_at = now
+        bump_schedule_version()
+        return True
+
+    def confirm(self):
+        """ Turn an unexpired hold into a confirmed booking, the slot was already taken when the hold was made """
+        now = timezone.now()
+        confirmed = Booking.objects.filter(pk=self.pk, status='HELD', expires_at__gt=now).update(
+            status='CONFIRMED',
+            expires_at=None,
+            updated_at=now,
+        )
+        if not confirmed:
+            return False
+        self.status = 'CONFIRMED'
+        self.expires_at = None
+        # Moves the booking list ETag
+        bump_schedule_version()
+        return True
+
+    @classmethod
+    def release_expired_holds(cls, batch_size=1000):
+        """
+        Expire holds past their expires_at in batches and give their slots back.
+        Freed slots go to the class waitlist first, like a cancellation; the rest are returned
+        with one UPDATE of the bookings and one grouped UPDATE of the class counters per batch.
+        Returns the number of holds released.
+        """
+        released = 0
+        while True:
+            with transaction.atomic():
+                now = timezone.now()
+                holds = list(
+                    cls.objects.select_for_update()
+                    .filter(status='HELD', expires_at__lte=now)
+                    .values_list('id', 'fitness_class_id')[:batch_size]
+                )
+                if not holds:
+                    return released
+                ids = [hold_id for hold_id, _ in holds]
+                cls.objects.filter(id__in=ids).update(status='EXPIRED', cancelled_at=now, updated_at=now)
+
+                # Hand one slot per expired hold to the head of the waitlist, only the rest are returned
+                returned = set(ids)
+                waitlisted = Waitlist.objects.filter(fitness_class_id__in={class_id for _, class_id in holds}).values('fitness_class_id')
+                for fitness_class in Classes.objects.select_for_update().filter(id__in=waitlisted):
+                    for hold_id, class_id in holds:
+                        if class_id != fitness_class.pk:
+                            continue
+                        if not Waitlist.promote_next(fitness_class):
+                            break
+                        returned.discard(hold_id)
+
+                expired_per_class = (
+                    cls.objects.filter(id__in=returned, fitness_class=OuterRef('pk'))
+                    .values('fitness_class')
+                    .annotate(expired=Count('id'))
+                    .values('expired')
+                )
+                class_ids = cls.objects.filter(id__in=returned).values('fitness_class')
+                Classes.objects.filter(id__in=class_ids, shard_count=0).update(
+                    available_slots=F('available_slots') + Subquery(expired_per_class),
+                    updated_at=now,
+                )
+                SlotChange.record(*Classes.objects.filter(id__in=class_ids, shard_count=0).values_list('id', flat=True))
+                # Sharded classes get their slots back shard by shard
+                for booking in cls.objects.filter(id__in=returned, fitness_class__shard_count__gt=0).only('fitness_class_id', 'user_id'):
+                    Classes.release_slot(booking.fitness_class_id, booking.user_id)
+                released += len(ids)
+            bump_schedule_version()
+
+
+class Waitlist(models.Model):
+    """ Users queued for a full class, promoted in FIFO (id) order when a booking is cancelled """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='user_waitlist')
+    fitness_class = models.ForeignKey(Classes, on_delete=models.CASCADE, related_name='class_waitlist')
+    joined_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'fitness_class'],
+                name='unique_user_class_waitlist'
+            )
+        ]
+        indexes = [
+            # Head of the queue for a class is a single index seek
+            models.Index(fields=['fitness_class', 'id'], name='waitlist_fifo_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.email} - {self.fitness_class.name} (waitlist)"
+
+    @property
+    def position(self):
+        return Waitlist.objects.filter(fitness_class_id=self.fitness_class_id, id__lte=self.id).count()
+
+    @classmethod
+    def promote_next(cls, fitness_class):
+        """
+        Turn the head of the class waitlist into a confirmed booking.
+        Must run inside the transaction that freed the slot, returns the new Booking or None.
+        """
+        if not fitness_class.is_upcomming or fitness_class.cancelled_at:
+            return None
+        while True:
+            head = cls.objects.select_for_update().filter(fitness_class_id=fitness_class.pk).order_by('id').first()
+            if head is None:
+                return None
+            head.delete()
+            # Skip waiters that already hold a confirmed booking for this class
+            if Booking.objects.filter(user_id=head.user_id, fitness_class_id=fitness_class.pk, status__in=Booking.ACTIVE_STATUSES).exists():
+                continue
+            return Booking.objects.create(
+                user_id=head.user_id,
+                fitness_class_id=fitness_class.pk,
+                status='CONFIRMED'
+            )
+
+
+class IdempotencyKey(models.Model):
+    """ First response to a request sent with an Idempotency-Key header, replayed on retries """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=255)
+    request_path = models.CharField(max_length=255)
+    # Null while the first request is still running
+    status_code = models.PositiveSmallIntegerField(null=True)
+    response_body = models.JSONField(encoder=DjangoJSONEncoder, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'key'],
+                name='unique_user_idempotency_key'
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} - {self.key}"
+
+
+class ClassSlotShard(models.Model):
+    """ One of the sub-counters a sharded class splits its free slots across """
+    fitness_class = models.ForeignKey(Classes, on_delete=models.CASCADE, related_name='slot_shards')
+    shard = models.PositiveSmallIntegerField()
+    available_slots = models.PositiveIntegerField()
+    # Sharded claims never touch the class row, this lets list validators see them
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['fitness_class', 'shard'],
+                name='unique_class_slot_shard'
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.fitness_class_id} - shard {self.shard}"
+
+    @staticmethod
+    def pick(shard_count, user_id=None):
+        # Hash users onto a shard so their retries land on the same row, random otherwise
+        if user_id is not None and getattr(settings, 'SLOT_SHARD_STRATEGY', 'hash') == 'hash':
+            return user_id % shard_count
+        return random.randrange(shard_count)
+
+    @classmethod
+    def claim(cls, fitness_class_id, shard_count, user_id=None):
+        """ Take a slot from the picked shard, falling back to the others when it is empty """
+        first = cls.pick(shard_count, user_id)
+        for offset in range(shard_count):
+            claimed = cls.objects.filter(
+                fitness_class_id=fitness_class_id,
+                shard=(first + offset) % shard_count,
+                available_slots__gt=0,
+            ).update(available_slots=F('available_slots') - 1, updated_at=timezone.now())
+            if claimed:
+                return True
+        return False
+
+    @classmethod
+    def release(cls, fitness_class_id, shard_count, user_id=None):
+        cls.objects.filter(
+            fitness_class_id=fitness_class_id,
+            shard=cls.pick(shard_count, user_id),
+        ).update(available_slots=F('available_slots') + 1, updated_at=timezone.now())
+
+
+class BookingTicket(models.Model):
+    """ Booking request accepted into the intake queue, granted or rejected in batches by process_booking_queue """
+    CHOICES_STATUS = (
+        ('PENDING', 'Pending'),
+        ('GRANTED', 'Granted'),
+        ('REJECTED', 'Rejected'),
+    )
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='booking_tickets')
+    fitness_class = models.ForeignKey(Classes, on_delete=models.CASCADE, related_name='booking_tickets')
+    status = models.CharField(max_length=20, choices=CHOICES_STATUS, default='PENDING')
+    booking = models.ForeignKey(Booking, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    reason = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Pending tickets of a class in arrival order
+            models.Index(fields=['fitness_class', 'status', 'id'], name='ticket_drain_idx'),
+        ]
+
+    def __str__(self):
+        return f"Ticket {self.pk} - {self.status}"
+
+    @classmethod
+    def process_class(cls, fitness_class_id, batch_size=500):
+        """
+        Grant the oldest pending tickets of a class while slots last, in one transaction.
+        Once the class is full every remaining pending ticket is rejected in bulk.
+        Returns (granted, rejected).
+        """
+        full_message = "This class is not available for booking."
+        with transaction.atomic():
+            fitness_class = Classes.objects.select_for_update().get(pk=fitness_class_id)
+            tickets = list(
+                cls.objects.filter(fitness_class_id=fitness_class_id, status='PENDING').order_by('id')[:batch_size]
+            )
+            if not tickets:
+                return 0, 0
+
+            now = timezone.now()
+            free = fitness_class.current_available_slots if fitness_class.is_available else 0
+            booked_users = set(
+                Booking.objects.filter(
+                    fitness_class_id=fitness_class_id,
+                    status__in=Booking.ACTIVE_STATUSES,
+                    user_id__in=[ticket.user_id for ticket in tickets],
+                ).values_list('user_id', flat=True)
+            )
+
+            granted, rejected = [], {}
+            for ticket in tickets:
+                if ticket.user_id in booked_users:
+                    rejected.setdefault("You have already booked this class.", []).append(ticket.id)
+                elif len(granted) < free:
+                    granted.append(ticket)
+                    booked_users.add(ticket.user_id)
+                else:
+                    rejected.setdefault(full_message, []).append(ticket.id)
+
+            # Sharded classes hand out their slots shard by shard
+            if fitness_class.shard_count:
+                granted = [ticket for ticket in granted if Classes.claim_slot(fitness_class_id, ticket.user_id)]
+            elif granted:
+                Classes.objects.filter(pk=fitness_class_id).update(
+                    available_slots=F('available_slots') - len(granted),
+                    updated_at=now,
+                )
+                SlotChange.record(fitness_class_id)
+
+            bookings = Booking.objects.bulk_create([
+                Booking(user_id=ticket.user_id, fitness_class_id=fitness_class_id, status='CONFIRMED')
+                for ticket in granted
+            ])
+            for ticket, booking in zip(granted, bookings):
+                ticket.status = 'GRANTED'
+                ticket.booking = booking
+                ticket.processed_at = now
+            cls.objects.bulk_update(granted, ['status', 'booking', 'processed_at'])
+
+            for reason, ticket_ids in rejected.items():
+                cls.objects.filter(id__in=ticket_ids).update(status='REJECTED', reason=reason, processed_at=now)
+            rejected_count = sum(len(ticket_ids) for ticket_ids in rejected.values())
+
+            # Nothing left to hand out, turn the rest of the queue away in one statement
+            if len(granted) >= free:
+                rejected_count += cls.objects.filter(fitness_class_id=fitness_class_id, status='PENDING').update(
+                    status='REJECTED', reason=full_message, processed_at=now
+                )
+        if granted:
+            bump_schedule_version()
+        return len(granted), rejected_count
+
+
+class ClassSearch(models.Model):
+    """ Row of the FTS5 index over Classes.name and instructor, created and kept in sync by booking_api.search """
+    fitness_class = models.OneToOneField(
+        Classes, on_delete=models.DO_NOTHING, primary_key=True, db_column='rowid', related_name='search'
+    )
+    name = SearchTextField()
+    instructor = SearchTextField()
+    # FTS5 hidden column, the bm25 score of the current MATCH
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = FTS_TABLE
+
+
+class SlotChange(models.Model):
+    """
+    Change log of the availability feed: one row per class whose free slots changed (or which was
+    created, edited or deleted), written in the same transaction as the change. The id is the
+    feed's sequence number.
+
+    Ids are handed out on insert but rows appear on commit, so on databases with concurrent writers
+    (PostgreSQL, MySQL) an entry can become visible after a higher id was already read. Readers
+    therefore also re-read the last SLOT_CHANGE_REREAD_WINDOW seconds before their previous read;
+    SQLite serializes writers, so there the window only re-sends a few classes.
+    """
+    # Not a foreign key, deleted classes stay in the log so clients learn to drop them
+    fitness_class_id = models.BigIntegerField()
+    changed_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.pk} - class {self.fitness_class_id}"
+
+    @classmethod
+    def record(cls, *fitness_class_ids):
+        fitness_class_ids = list(dict.fromkeys(fitness_class_ids))
+        cls.objects.bulk_create([cls(fitness_class_id=pk) for pk in fitness_class_ids])
+        # Live streams of this process hear about it on commit, other processes poll the log
+        publish_on_commit(fitness_class_ids)
+
+    @classmethod
+    def changes_after(cls, seq, read_at):
+        """
+        Entries after `seq`, plus the ones written shortly before `read_at` (when `seq` was read) that
+        may have committed after it. Re-reading a class is harmless, its current count is sent again.
+        """
+        window = timezone.timedelta(seconds=getattr(settings, 'SLOT_CHANGE_REREAD_WINDOW', 10))
+        return cls.objects.filter(models.Q(id__gt=seq) | models.Q(changed_at__gt=read_at - window))
+
+    @classmethod
+    def latest_seq(cls):
+        return cls.objects.aggregate(seq=Max('id'))['seq'] or 0
+
+    @classmethod
+    def prune(cls, before):
+        """ Delete entries older than `before`, always keeping the newest one so the sequence survives """
+        return cls.objects.filter(changed_at__lt=before, id__lt=cls.latest_seq()).delete()[0]
+
+
+class UserPreference(models.Model):
+    """ Per-user settings; timezone is used when a request sends no X-Timezone header """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='preference')
+    # IANA name such as 'Europe/Berlin', blank uses TIME_ZONE
+    timezone = models.CharField(max_length=64, blank=True)
+
+    def __str__(self):
+        return f"{self.user} - {self.timezone or 'default timezone'}"
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # TimezoneJWTAuthentication reads the cached name, drop it once the new one is visible
+        key = preference_cache_key(self.user_id)
+        transaction.on_commit(lambda: preference_cache().delete(key))
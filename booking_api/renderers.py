@@ -0,0 +1,135 @@
+"""
+orjson-backed JSON renderer and parser, and the NDJSON / CSV renderers of the streaming exports.
+
+orjson is optional: without it (or for input it cannot handle, e.g. an `indent` in the Accept
+header or integers wider than 64 bits) both classes fall back to DRF's stdlib json versions.
+Datetimes are encoded natively and everything else orjson does not know (Decimal, UUID, lazy
+strings, ...) goes through DRF's JSONEncoder, so the output matches JSONRenderer.
+"""
+import csv
+import json
+from datetime import datetime
+from itertools import islice
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+import logging
+
+logger = logging.getLogger('booking_api')
+
+
+class ORJSONRenderer(JSONRenderer):
+    """ JSONRenderer on orjson, the stdlib path is kept for indented output and orjson failures """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        renderer_context = renderer_context or {}
+        if self.get_indent(accepted_media_type, renderer_context):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # UTC datetimes end in 'Z' like DRF's encoder, dicts with int keys are allowed like json.dumps
+        option = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=option)
+        except TypeError as e:
+            logger.warning(f"orjson could not render the response, using json: {e}")
+            return super().render(data, accepted_media_type, renderer_context)
+        # Escaped by JSONRenderer too, they are line breaks in JavaScript
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+class ORJSONParser(JSONParser):
+    """ JSONParser on orjson, which only reads UTF-8 """
+    renderer_class = ORJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        if orjson is None or encoding.lower().replace('-', '') != 'utf8':
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError(f'JSON parse error - {exc}')
+
+
+def json_dumps(data):
+    """ Compact UTF-8 JSON bytes, orjson when available """
+    if orjson is not None:
+        try:
+            return orjson.dumps(data, default=JSONEncoder().default, option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            pass
+    return json.dumps(data, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def isoformat(value):
+    # Same form as DRF's encoder: ISO 8601 with 'Z' for UTC
+    value = value.isoformat()
+    return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+
+def chunked(rows, size):
+    rows = iter(rows)
+    while chunk := list(islice(rows, size)):
+        yield chunk
+
+
+class StreamingRenderer(BaseRenderer):
+    """
+    Base of the export renderers. stream(columns, rows) turns an iterator of value tuples into
+    byte chunks for a StreamingHttpResponse; render() handles ordinary (list of dicts) responses.
+    """
+    charset = 'utf-8'
+    # Rows encoded per yielded chunk
+    chunk_rows = 500
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        rows = data if isinstance(data, list) else [data]
+        columns = list(rows[0]) if rows else []
+        return b''.join(self.stream(columns, ([row.get(column) for column in columns] for row in rows)))
+
+    def stream(self, columns, rows):
+        raise NotImplementedError
+
+
+class NDJSONRenderer(StreamingRenderer):
+    """ One JSON object per line """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+    def stream(self, columns, rows):
+        for chunk in chunked(rows, self.chunk_rows):
+            yield b''.join(json_dumps(dict(zip(columns, row))) + b'\n' for row in chunk)
+
+
+class CSVRenderer(StreamingRenderer):
+    """ A header line then one line per row, datetimes in ISO 8601 """
+    media_type = 'text/csv'
+    format = 'csv'
+
+    class Echo:
+        # csv.writer target that hands each formatted line back instead of buffering it
+        def write(self, value):
+            return value
+
+    def stream(self, columns, rows):
+        writer = csv.writer(self.Echo())
+        yield writer.writerow(columns).encode()
+        for chunk in chunked(rows, self.chunk_rows):
+            yield ''.join(
+                writer.writerow([isoformat(value) if isinstance(value, datetime) else value for value in row])
+                for row in chunk
+            ).encode()
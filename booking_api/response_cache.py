@@ -0,0 +1,98 @@
+"""
+Versioned response cache for the public class list and weekly calendar.
+
+Cached pages are keyed on a global schedule version. Everything that changes the schedule or
+the free slots calls bump_schedule_version(), which increments the version once the transaction
+commits, so all older pages stop being read at once without scanning or deleting keys; they
+simply age out after CLASS_LIST_CACHE['TTL'] seconds.
+Only get/set/add are used, so any Django cache backend works (file, database, Redis, ...), as
+long as every process shares it: bumps made by other workers or by management commands never
+reach a per-process locmem cache, which then serves stale pages until the TTL; check_shared_cache
+warns about that configuration.
+"""
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+
+import logging
+
+logger = logging.getLogger('booking_api')
+
+SCHEDULE_VERSION_KEY = 'booking_api:schedule_version'
+
+DEFAULTS = {
+    'ENABLED': True,
+    'TTL': 60,
+    'CACHE_ALIAS': 'default',
+}
+
+
+def class_list_cache_setting(name):
+    return getattr(settings, 'CLASS_LIST_CACHE', {}).get(name, DEFAULTS[name])
+
+
+def get_cache():
+    return caches[class_list_cache_setting('CACHE_ALIAS')]
+
+
+def _initial_version():
+    # Seeded from the clock so a version lost to eviction or a cache restart does not
+    # come back at a number older pages are still stored under
+    return int(time.time() * 1000)
+
+
+def get_schedule_version():
+    cache = get_cache()
+    version = cache.get(SCHEDULE_VERSION_KEY)
+    if version is None:
+        cache.add(SCHEDULE_VERSION_KEY, _initial_version(), timeout=None)
+        version = cache.get(SCHEDULE_VERSION_KEY) or _initial_version()
+    return version
+
+
+def _bump():
+    cache = get_cache()
+    # incr() is a get and a set on the file and database backends as well. Moving to the clock
+    # (at least +1) means two racing bumps still write versions no page was cached under.
+    version = cache.get(SCHEDULE_VERSION_KEY) or 0
+    cache.set(SCHEDULE_VERSION_KEY, max(version + 1, _initial_version()), timeout=None)
+
+
+def bump_schedule_version():
+    """
+    Invalidate every cached class list page once the current transaction commits.
+    Bumping before the commit would let a concurrent reader cache the old rows under the new version.
+    """
+    transaction.on_commit(_bump)
+
+
+def check_shared_cache(app_configs, **kwargs):
+    """ System check: the schedule version only invalidates pages across processes in a shared cache """
+    backend = settings.CACHES.get(class_list_cache_setting('CACHE_ALIAS'), {}).get('BACKEND', '')
+    if class_list_cache_setting('ENABLED') and backend.endswith('LocMemCache'):
+        return [checks.Warning(
+            "CLASS_LIST_CACHE uses a local-memory cache, which is per process: schedule changes made by "
+            "other workers or management commands are not seen and stale class lists are served until the TTL.",
+            hint="Point CLASS_LIST_CACHE['CACHE_ALIAS'] at a file, database, Redis or Memcached cache.",
+            id='booking_api.W001',
+        )]
+    return []
+
+
+def class_list_cache_key(request):
+    """ Key on the absolute path (pagination links are absolute), query params, timezone and schedule version """
+    params = urlencode(sorted(request.query_params.lists()), doseq=True)
+    raw = '|'.join([request.build_absolute_uri(request.path), params, timezone.get_current_timezone_name()])
+    digest = hashlib.md5(raw.encode()).hexdigest()
+    return f'booking_api:classes:{get_schedule_version()}:{digest}'
+
+
+def calendar_cache_key(week):
+    """ Key on the ISO week, timezone and schedule version """
+    return f'booking_api:calendar:{get_schedule_version()}:{week}:{timezone.get_current_timezone_name()}'
@@ -0,0 +1,111 @@
+"""
+Full-text search over Classes.name and instructor.
+
+On SQLite the classes are indexed in booking_api_classes_fts, an FTS5 table using the classes
+table as external content. create_search_index (post_migrate) creates it with the triggers that
+keep it in sync, so every insert, delete and name/instructor update (bulk ones included) is
+indexed in the same statement. ClassesQuerySet.search() joins it through the unmanaged
+ClassSearch model; other databases, a database where the index could not be created (SQLite
+built without FTS5), or CLASS_SEARCH_BACKEND = 'icontains', fall back to icontains filters.
+"""
+import re
+
+from django.db import connections, models
+
+import logging
+
+logger = logging.getLogger('booking_api')
+
+FTS_TABLE = 'booking_api_classes_fts'
+
+# Most words of a query that are matched, the rest is ignored
+MAX_WORDS = 10
+
+FTS_SQL = [
+    # prefix='2 3' indexes short prefixes, so 'yo*' does not walk every term starting with 'yo'
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        name, instructor, content='booking_api_classes', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert AFTER INSERT ON booking_api_classes BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, instructor) VALUES (new.id, new.name, new.instructor);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete AFTER DELETE ON booking_api_classes BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, instructor) VALUES ('delete', old.id, old.name, old.instructor);
+    END""",
+    # Only name and instructor changes touch the index, slot counter updates do not
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update AFTER UPDATE OF name, instructor ON booking_api_classes BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, instructor) VALUES ('delete', old.id, old.name, old.instructor);
+        INSERT INTO {FTS_TABLE}(rowid, name, instructor) VALUES (new.id, new.name, new.instructor);
+    END""",
+    # A name match weighs twice an instructor match
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rank) VALUES ('rank', 'bm25(2.0, 1.0)')",
+]
+
+# The table and the triggers keeping it in sync, all needed for search results to be right
+FTS_OBJECTS = [FTS_TABLE, f'{FTS_TABLE}_insert', f'{FTS_TABLE}_delete', f'{FTS_TABLE}_update']
+
+# Aliases of the databases known to have the index. Only found indexes are remembered, a missing
+# one is looked up again on each search so an index created later (migrate in another process) is used
+indexed_databases = set()
+
+
+def create_search_index(sender, using='default', **kwargs):
+    """ post_migrate receiver creating the FTS5 table and its triggers, indexing existing classes once """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+        exists = cursor.fetchone() is not None
+        try:
+            for sql in FTS_SQL:
+                cursor.execute(sql)
+        except Exception as e:
+            logger.warning(f"Class search index not created, falling back to icontains: {e}")
+            indexed_databases.discard(using)
+            return
+        if not exists:
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    indexed_databases.add(using)
+
+
+def has_search_index(using):
+    """ True when the `using` database has the FTS5 index, looked up in sqlite_master until it is found """
+    if using in indexed_databases:
+        return True
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return False
+    placeholders = ', '.join(['%s'] * len(FTS_OBJECTS))
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT count(*) FROM sqlite_master WHERE name IN ({placeholders})", FTS_OBJECTS)
+        available = cursor.fetchone()[0] == len(FTS_OBJECTS)
+    if available:
+        indexed_databases.add(using)
+    return available
+
+
+def search_words(text):
+    return re.findall(r'\w+', text or '')[:MAX_WORDS]
+
+
+def match_expression(words):
+    """ FTS5 query matching rows that contain every word as a prefix: '"yo"* "ann"*' """
+    return ' '.join('"{}"*'.format(word.replace('"', '""')) for word in words)
+
+
+class Match(models.Lookup):
+    """ column__match=<fts5 query>, matched against the whole FTS table the column belongs to """
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        rhs, params = self.process_rhs(compiler, connection)
+        return f"{connection.ops.quote_name(self.lhs.alias)} MATCH {rhs}", params
+
+
+class SearchTextField(models.TextField):
+    """ Column of an FTS table """
+
+
+SearchTextField.register_lookup(Match)
@@ -1,7 +1,12 @@
-from .models import Classes, User, Booking
+from .models import Classes, User, Booking, Waitlist, BookingTicket, SlotChange, UserPreference
+from .middleware import zone_cache
+from .db import retry_on_db_lock
+from .response_cache import bump_schedule_version
 from rest_framework import serializers
+from django.conf import settings
 from django.utils import timezone
-from django.db import transaction
+from django.db import transaction, IntegrityError
+from django.db.models import F
 
 class UserSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True, required=True, min_length=8)
@@ -23,12 +28,68 @@ class UserSerializer(serializers.ModelSerializer):
         user.save()
         return user
 
-class ClassesSerializer(serializers.ModelSerializer):
+class UserPreferenceSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UserPreference
+        fields = ['timezone']
+
+    def validate_timezone(self, value):
+        # Blank clears the preference
+        if value and zone_cache.get(value) is None:
+            raise serializers.ValidationError(f"'{value}' is not an IANA timezone name such as 'Europe/Berlin'.")
+        return value
+
+class SparseFieldsetMixin:
+    """
+    Takes `fields` (names to render) and `expand` (relations to nest) keyword arguments.
+    Without either everything is rendered and every relation nested, as before; once a client
+    asks for a sparse fieldset, relations in expandable_fields not named in `expand` render as their pk.
+    """
+    expandable_fields = ()
+    # Model columns behind fields that are not plain model fields
+    column_sources = {}
+
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is None and expand is None:
+            return
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+        for name in self.expandable_fields:
+            if name in self.fields and name not in (expand or ()):
+                self.fields[name] = serializers.PrimaryKeyRelatedField(read_only=True)
+
+
+def model_columns(serializer, prefix=''):
+    """ Model fields a (possibly pruned) serializer reads, for queryset.only() """
+    names = {field.name for field in serializer.Meta.model._meta.concrete_fields}
+    column_sources = getattr(serializer, 'column_sources', {})
+    columns = set()
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        if isinstance(field, serializers.BaseSerializer):
+            columns |= model_columns(field, f'{prefix}{field.source}__')
+            continue
+        for source in column_sources.get(name, (field.source,)):
+            if source in names:
+                columns.add(f'{prefix}{source}')
+    return columns
+
+
+class ClassesSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     # Custom date_time field formatting and parsing
     date_time = serializers.DateTimeField(
         input_formats=['%d/%m/%Y %H:%M'],
         format='%d/%m/%Y %H:%M'
     )
+    # Reconciled across slot shards for sharded classes
+    available_slots = serializers.IntegerField(source='current_available_slots', read_only=True)
+    column_sources = {
+        'available_slots': ('available_slots', 'shard_count'),
+        'is_available': ('date_time', 'available_slots', 'shard_count', 'cancelled_at'),
+    }
     class Meta:
         model = Classes
         fields = [
@@ -66,19 +127,20 @@ class ClassesSerializer(serializers.ModelSerializer):
         
         return attrs
     
-class BookingSerializer(serializers.ModelSerializer):
+class BookingSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     # Nested user and class serializers for read-only representation
     user = UserSerializer(read_only=True)
     fitness_class = ClassesSerializer(read_only=True)
     fitness_class_id = serializers.IntegerField(write_only=True)
+    expandable_fields = ('user', 'fitness_class')
 
     class Meta:
         model = Booking
         fields = [
             'id', 'user', 'fitness_class', 'fitness_class_id',
-            'status', 'booked_at', 'cancelled_at'
+            'status', 'booked_at', 'cancelled_at', 'expires_at'
         ]
-        read_only_fields = ['id', 'user', 'booked_at', 'cancelled_at', 'status', 'fitness_class']
+        read_only_fields = ['id', 'user', 'booked_at', 'cancelled_at', 'status', 'fitness_class', 'expires_at']
 
     def validate(self, attrs):
         # Check for any extra fields not allowed in the serializer
@@ -94,14 +156,31 @@ class BookingSerializer(serializers.ModelSerializer):
         
         return attrs
         
+    @retry_on_db_lock
     def save(self, **kwargs):
         # Custom save logic for booking a class
-        fitness_class_id = self.validated_data.pop('fitness_class_id')
+        fitness_class_id = self.validated_data['fitness_class_id']
         user = kwargs.get('user')
 
         if not user:
             raise serializers.ValidationError("User must be provided to book a class.")
-        
+
+        # A HELD booking takes the slot now and expires unless it is confirmed in time
+        booking_fields = {'status': kwargs.get('status', 'CONFIRMED')}
+        if booking_fields['status'] == 'HELD':
+            hold_minutes = getattr(settings, 'BOOKING_HOLD_MINUTES', 10)
+            booking_fields['expires_at'] = timezone.now() + timezone.timedelta(minutes=hold_minutes)
+
+        engine = getattr(settings, 'BOOKING_ENGINE', 'locking')
+        # Sharded classes never lock the class row, whatever the engine
+        if engine == 'conditional' or Classes.objects.filter(id=fitness_class_id, shard_count__gt=0).exists():
+            self.instance = self._book_conditional(user, fitness_class_id, **booking_fields)
+        else:
+            self.instance = self._book_locking(user, fitness_class_id, **booking_fields)
+        bump_schedule_version()
+        return self.instance
+
+    def _book_locking(self, user, fitness_class_id, **booking_fields):
         with transaction.atomic():
             try:
                 # Lock the class row for update to prevent race conditions
@@ -113,21 +192,174 @@ class BookingSerializer(serializers.ModelSerializer):
             if not fitness_class.is_available:
                 raise serializers.ValidationError("This class is not available for booking.")
         
-            # Prevent duplicate confirmed bookings for the same user and class
-            if Booking.objects.filter(user=user, fitness_class=fitness_class, status='CONFIRMED').exists():
+            # Prevent duplicate confirmed (or held) bookings for the same user and class
+            if Booking.objects.filter(user=user, fitness_class=fitness_class, status__in=Booking.ACTIVE_STATUSES).exists():
                 raise serializers.ValidationError("You have already booked this class.")
             # Create the booking and decrement available slots
             booking = Booking.objects.create(
                 user=user,
                 fitness_class=fitness_class,
-                status='CONFIRMED'
+                **booking_fields
             )
             fitness_class.available_slots -= 1
-            fitness_class.save()
-            return booking 
+            # Only write the counter so concurrent admin edits are not overwritten
+            fitness_class.save(update_fields=['available_slots', 'updated_at'])
+            SlotChange.record(fitness_class.pk)
+            return booking
         
         raise serializers.ValidationError("Failed to book the class due to a database error.")
 
+    def _book_conditional(self, user, fitness_class_id, **booking_fields):
+        with transaction.atomic():
+            # Claim a slot with one guarded UPDATE instead of locking and re-saving the class row
+            if not Classes.claim_slot(fitness_class_id, user.pk):
+                if not Classes.objects.filter(id=fitness_class_id).exists():
+                    raise serializers.ValidationError("Class with this ID does not exists.")
+                raise serializers.ValidationError("This class is not available for booking.")
+            # The unique_active_user_class_booking constraint rejects duplicates,
+            # raising here rolls the slot claim back with the outer transaction
+            try:
+                with transaction.atomic():
+                    booking = Booking.objects.create(
+                        user=user,
+                        fitness_class_id=fitness_class_id,
+                        **booking_fields
+                    )
+            except IntegrityError:
+                raise serializers.ValidationError("You have already booked this class.")
+            return booking
+
+
+class BatchBookingSerializer(serializers.Serializer):
+    # Book the user into several classes in one transaction
+    fitness_class_ids = serializers.ListField(
+        child=serializers.IntegerField(), allow_empty=False, max_length=50
+    )
+    all_or_nothing = serializers.BooleanField(default=False)
+
+    def validate_fitness_class_ids(self, value):
+        # Drop repeated ids but keep the order the client sent
+        return list(dict.fromkeys(value))
 
+    def save(self, **kwargs):
+        fitness_class_ids = self.validated_data['fitness_class_ids']
+        all_or_nothing = self.validated_data['all_or_nothing']
+        user = kwargs.get('user')
 
+        if not user:
+            raise serializers.ValidationError("User must be provided to book a class.")
+
+        with transaction.atomic():
+            # Lock every class row in ascending id order so concurrent batches cannot deadlock
+            classes = {
+                fitness_class.id: fitness_class
+                for fitness_class in Classes.objects.select_for_update()
+                .filter(id__in=fitness_class_ids)
+                .order_by('id')
+            }
+            already_booked = set(
+                Booking.objects.filter(
+                    user=user, fitness_class_id__in=fitness_class_ids, status__in=Booking.ACTIVE_STATUSES
+                ).values_list('fitness_class_id', flat=True)
+            )
 
+            errors = {}
+            for fitness_class_id in fitness_class_ids:
+                fitness_class = classes.get(fitness_class_id)
+                if fitness_class is None:
+                    errors[fitness_class_id] = "Class with this ID does not exists."
+                elif not fitness_class.is_available:
+                    errors[fitness_class_id] = "This class is not available for booking."
+                elif fitness_class_id in already_booked:
+                    errors[fitness_class_id] = "You have already booked this class."
+
+            # Sharded classes take their slot from a shard, the rest share one UPDATE below
+            for class_id in fitness_class_ids:
+                if class_id not in errors and classes[class_id].shard_count:
+                    if not Classes.claim_slot(class_id, user.pk):
+                        errors[class_id] = "This class is not available for booking."
+
+            bookable = [class_id for class_id in fitness_class_ids if class_id not in errors]
+            if all_or_nothing and errors:
+                # Undo any shard claims along with everything else
+                transaction.set_rollback(True)
+                bookable = []
+
+            # One INSERT for the bookings and one UPDATE for the slot counters
+            bookings = Booking.objects.bulk_create([
+                Booking(user=user, fitness_class_id=class_id, status='CONFIRMED')
+                for class_id in bookable
+            ])
+            unsharded = [class_id for class_id in bookable if not classes[class_id].shard_count]
+            if unsharded:
+                Classes.objects.filter(id__in=unsharded).update(
+                    available_slots=F('available_slots') - 1,
+                    updated_at=timezone.now(),
+                )
+                SlotChange.record(*unsharded)
+
+        if bookings:
+            bump_schedule_version()
+        booking_ids = {booking.fitness_class_id: booking.id for booking in bookings}
+        results = []
+        for fitness_class_id in fitness_class_ids:
+            if fitness_class_id in booking_ids:
+                results.append({
+                    'fitness_class_id': fitness_class_id,
+                    'booked': True,
+                    'booking_id': booking_ids[fitness_class_id],
+                })
+            else:
+                results.append({
+                    'fitness_class_id': fitness_class_id,
+                    'booked': False,
+                    'error': errors.get(fitness_class_id, "Not booked because another class in the batch failed."),
+                })
+        return results
+
+
+class WaitlistSerializer(serializers.ModelSerializer):
+    fitness_class_id = serializers.IntegerField(read_only=True)
+    position = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Waitlist
+        fields = ['id', 'fitness_class_id', 'joined_at', 'position']
+        read_only_fields = ['id', 'fitness_class_id', 'joined_at', 'position']
+
+    def save(self, **kwargs):
+        # Queue the user for a full class
+        user = kwargs.get('user')
+        fitness_class_id = kwargs.get('fitness_class_id')
+
+        if not user:
+            raise serializers.ValidationError("User must be provided to join a waitlist.")
+
+        with transaction.atomic():
+            try:
+                # Lock the class so a slot cannot free up between the checks and the insert
+                fitness_class = Classes.objects.select_for_update().get(id=fitness_class_id)
+            except Classes.DoesNotExist:
+                raise serializers.ValidationError("Class with this ID does not exists.")
+
+            if not fitness_class.is_upcomming or fitness_class.cancelled_at:
+                raise serializers.ValidationError("This class is not available for booking.")
+            if fitness_class.current_available_slots > 0:
+                raise serializers.ValidationError("This class still has free slots, book it instead.")
+            if Booking.objects.filter(user=user, fitness_class=fitness_class, status__in=Booking.ACTIVE_STATUSES).exists():
+                raise serializers.ValidationError("You have already booked this class.")
+
+            self.instance, created = Waitlist.objects.get_or_create(user=user, fitness_class=fitness_class)
+            if not created:
+                raise serializers.ValidationError("You are already on the waitlist for this class.")
+            return self.instance
+
+
+class BookingTicketSerializer(serializers.ModelSerializer):
+    fitness_class_id = serializers.IntegerField(read_only=True)
+    booking_id = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = BookingTicket
+        fields = ['id', 'fitness_class_id', 'status', 'booking_id', 'reason', 'created_at', 'processed_at']
+        read_only_fields = fields
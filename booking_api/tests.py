@@ -1,20 +1,56 @@
+import asyncio
+import csv
+import importlib
+import itertools
 import json
-from datetime import datetime, timedelta
-from django.test import TestCase
+import os
+import re
+import shutil
+import sys
+import tempfile
+import uuid
+from decimal import Decimal
+from unittest import mock
+from io import StringIO
+from datetime import datetime, timedelta, timezone as dt_timezone
+from zoneinfo import ZoneInfo
+from asgiref.sync import async_to_sync, sync_to_async
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import OperationalError, connection, transaction
+from django.core.cache import cache
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import User
+from django.contrib.admin.models import LogEntry
 from django.urls import reverse
 from django.utils import timezone
+from django.utils.translation import gettext_lazy
 from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
+from rest_framework.renderers import JSONRenderer
 from rest_framework_simplejwt.tokens import RefreshToken
-from .models import Classes, Booking
+from .models import Classes, Booking, Waitlist, IdempotencyKey, ClassSlotShard, BookingTicket, SlotChange, UserPreference
+from .admin import ClassAdminForm
+from .db import retry_on_db_lock
+from .idempotency import CacheIdempotencyStore, DatabaseIdempotencyStore
+from .middleware import zone_cache
+from .live import SlotStreamApp, broker
+from .renderers import ORJSONRenderer
+from .search import FTS_TABLE, create_search_index, has_search_index
+from .response_cache import bump_schedule_version, check_shared_cache
 
+# The shipped file cache is the project's real one, tests clear their own instead
+TEST_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'booking_api_tests'}}
 
+
+@override_settings(CACHES=TEST_CACHES)
 class FitnessAPITestCase(APITestCase):
     """Base test case with common setup for fitness app tests"""
     
     def setUp(self):
         self.client = APIClient()
+        cache.clear()
         
         # Create test users
         self.admin_user = User.objects.create_user(
@@ -150,7 +186,7 @@ class ClassesTestCase(FitnessAPITestCase):
         response = self.client.get(url)
         
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 2)  # Only future classes
+        self.assertEqual(len(response.data['results']), 2)  # Only future classes
         
     def test_list_classes_unauthenticated(self):
         """Test listing classes without authentication"""
@@ -168,19 +204,106 @@ class ClassesTestCase(FitnessAPITestCase):
         response = self.client.get(url, {'type': 'YOGA'})
         
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['class_type'], 'YOGA')
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['class_type'], 'YOGA')
     
     def test_list_classes_filter_by_date(self):
         """Test filtering classes by date"""
         self.authenticate_user(self.regular_user)
         url = reverse('class-list')
-        date_str = (timezone.now() + timedelta(days=1)).strftime('%Y-%m-%d')
+        # Dates are local days of the requesting timezone (Asia/Kolkata by default)
+        date_str = timezone.localtime(self.future_class.date_time).strftime('%Y-%m-%d')
         
         response = self.client.get(url, {'date': date_str})
         
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertGreaterEqual(len(response.data), 1)
+        self.assertGreaterEqual(len(response.data['results']), 1)
+
+    def test_list_classes_date_is_local_day(self):
+        """Test ?date= covers the local day of the X-Timezone header"""
+        day = (timezone.now() + timedelta(days=3)).date()
+        # 20:00 UTC is 01:30 the next day in Asia/Kolkata
+        late_class = Classes.objects.create(
+            name='Late Spin', class_type='HIIT', instructor='Pat', duration_minutes=45,
+            date_time=datetime.combine(day, datetime.min.time(), tzinfo=dt_timezone.utc) + timedelta(hours=20),
+            total_slots=10
+        )
+        url = reverse('class-list')
+
+        def ids(params, tz):
+            response = self.client.get(url, params, HTTP_X_TIMEZONE=tz)
+            return [item['id'] for item in response.data['results']]
+
+        self.assertEqual(ids({'date': day.isoformat()}, 'UTC'), [late_class.id])
+        self.assertEqual(ids({'date': day.isoformat()}, 'Asia/Kolkata'), [])
+        self.assertEqual(ids({'date': (day + timedelta(days=1)).isoformat()}, 'Asia/Kolkata'), [late_class.id])
+
+    def test_list_classes_date_range(self):
+        """Test ?from= and ?to= are inclusive local days"""
+        url = reverse('class-list')
+        first_day = timezone.localtime(self.future_class.date_time).date()
+        later = Classes.objects.create(
+            name='Later Yoga', class_type='YOGA', instructor='Pat', duration_minutes=45,
+            date_time=self.future_class.date_time + timedelta(days=5), total_slots=10
+        )
+
+        response = self.client.get(url, {'from': first_day.isoformat(), 'to': first_day.isoformat()})
+        ids = [item['id'] for item in response.data['results']]
+        self.assertIn(self.future_class.id, ids)
+        self.assertNotIn(later.id, ids)
+        response = self.client.get(url, {'from': (first_day + timedelta(days=1)).isoformat()})
+        self.assertEqual([item['id'] for item in response.data['results']], [later.id])
+
+    def test_list_classes_malformed_date_rejected(self):
+        """Test a malformed date, from or to is a bad request rather than a dropped filter"""
+        for param in ['date', 'from', 'to']:
+            with self.subTest(param=param):
+                response = self.client.get(reverse('class-list'), {param: '15/01/2024'})
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+                self.assertIn(param, response.data)
+
+    def test_list_classes_range_at_calendar_ends(self):
+        """Test days at the ends of the calendar are clamped instead of overflowing or being dropped"""
+        url = reverse('class-list')
+        upcoming = [self.future_class.id, self.full_class.id]
+
+        # East of UTC, midnight of 0001-01-01 is before datetime.min in UTC
+        for zone in ['UTC', 'Pacific/Kiritimati', 'Pacific/Pago_Pago']:
+            for params, expected in [
+                ({'to': '9999-12-31'}, upcoming),
+                ({'from': '0001-01-01'}, upcoming),
+                ({'date': '0001-01-01'}, []),
+                ({'to': '0001-01-01'}, []),
+                ({'date': '9999-12-31'}, []),
+                ({'from': '9999-12-31'}, []),
+            ]:
+                with self.subTest(zone=zone, **params):
+                    response = self.client.get(url, params, HTTP_X_TIMEZONE=zone)
+                    self.assertEqual(response.status_code, status.HTTP_200_OK)
+                    self.assertEqual([item['id'] for item in response.data['results']], expected)
+
+    def test_list_classes_filter_available(self):
+        """Test ?available= splits upcoming classes by free slots, sharded ones by their shards"""
+        url = reverse('class-list')
+        sharded = Classes.objects.create(
+            name='Sharded Spin', class_type='HIIT', instructor='Pat', duration_minutes=45,
+            date_time=timezone.now() + timedelta(days=2), total_slots=4
+        )
+        sharded.set_slot_shards(2)
+        # available_slots of a sharded class is only a stale copy of the shard total
+        Classes.objects.filter(pk=sharded.pk).update(available_slots=0)
+
+        def ids(available):
+            response = self.client.get(url, {'available': available})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return {item['id']: item['is_available'] for item in response.data['results']}
+
+        self.assertEqual(ids('true'), {self.future_class.id: True, sharded.id: True})
+        self.assertEqual(ids('false'), {self.full_class.id: False})
+        self.assertEqual(len(ids('maybe')), 3)
+
+        ClassSlotShard.objects.filter(fitness_class=sharded).update(available_slots=0)
+        self.assertEqual(ids('1'), {self.future_class.id: True})
     
     def test_create_class_as_admin(self):
         """Test creating class as admin user"""
@@ -272,6 +395,208 @@ class ClassesTestCase(FitnessAPITestCase):
         self.assertFalse(Classes.objects.filter(pk=self.future_class.pk).exists())
 
 
+class ClassVersionTestCase(FitnessAPITestCase):
+    """Test ETag / If-Match optimistic concurrency on class edits"""
+
+    def setUp(self):
+        super().setUp()
+        self.authenticate_user(self.admin_user)
+        self.url = reverse('class-detail', kwargs={'pk': self.future_class.pk})
+
+    def test_get_returns_etag(self):
+        """Test the class detail carries its version as ETag"""
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['ETag'], '"1"')
+
+    def test_patch_with_current_etag(self):
+        """Test a matching If-Match updates the class and bumps the version"""
+        response = self.client.patch(self.url, {'name': 'Renamed Yoga'}, HTTP_IF_MATCH='"1"')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['ETag'], '"2"')
+        self.future_class.refresh_from_db()
+        self.assertEqual(self.future_class.name, 'Renamed Yoga')
+
+    def test_patch_with_stale_etag(self):
+        """Test a stale If-Match is rejected with 412"""
+        self.client.patch(self.url, {'name': 'First Edit'}, HTTP_IF_MATCH='"1"')
+
+        response = self.client.patch(self.url, {'name': 'Second Edit'}, HTTP_IF_MATCH='"1"')
+
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(response['ETag'], '"2"')
+        self.future_class.refresh_from_db()
+        self.assertEqual(self.future_class.name, 'First Edit')
+
+    def test_delete_with_stale_etag(self):
+        """Test a stale If-Match blocks deletion"""
+        response = self.client.delete(self.url, HTTP_IF_MATCH='"7"')
+
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertTrue(Classes.objects.filter(pk=self.future_class.pk).exists())
+
+    def test_total_slots_change_keeps_bookings(self):
+        """Test changing total slots shifts available slots without losing concurrent bookings"""
+        Classes.claim_slot(self.future_class.pk)
+
+        response = self.client.patch(self.url, {'total_slots': 12})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.future_class.refresh_from_db()
+        self.assertEqual(self.future_class.total_slots, 12)
+        self.assertEqual(self.future_class.available_slots, 11)
+
+    def test_total_slots_below_booked(self):
+        """Test total slots cannot drop below the booked slots"""
+        Classes.objects.filter(pk=self.future_class.pk).update(available_slots=2)
+
+        response = self.client.patch(self.url, {'total_slots': 5})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('total_slots', response.data)
+
+    def test_patch_with_malformed_etag(self):
+        """Test an If-Match that names no version is a bad request rather than a stale one"""
+        response = self.client.patch(self.url, {'name': 'Renamed Yoga'}, HTTP_IF_MATCH='"latest"')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.future_class.refresh_from_db()
+        self.assertEqual(self.future_class.name, 'Morning Yoga')
+
+    def test_patch_class_cancelled_mid_edit(self):
+        """Test an edit blocked by a cancellation landing after the read reports the cancellation"""
+        update_if_current = Classes.update_if_current
+
+        def cancel_then_update(instance, version, changes):
+            Classes.objects.filter(pk=instance.pk).update(cancelled_at=timezone.now())
+            return update_if_current(instance, version, changes)
+
+        with mock.patch.object(Classes, 'update_if_current', cancel_then_update):
+            response = self.client.patch(self.url, {'name': 'Renamed Yoga'}, HTTP_IF_MATCH='"1"')
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertIn('cancelled', response.data['error'])
+
+    def admin_change_form(self, **overrides):
+        local = timezone.localtime(self.future_class.date_time)
+        data = {
+            'name': self.future_class.name,
+            'class_type': self.future_class.class_type,
+            'instructor': self.future_class.instructor,
+            'duration_minutes': self.future_class.duration_minutes,
+            'date_time_0': local.strftime('%Y-%m-%d'),
+            'date_time_1': local.strftime('%H:%M:%S'),
+            'total_slots': self.future_class.total_slots,
+            'expected_version': self.future_class.version,
+        }
+        data.update(overrides)
+        return data
+
+    def test_admin_site_edit_keeps_bookings(self):
+        """Test the admin form writes only the changed fields and bumps the version"""
+        self.client.force_login(User.objects.create_superuser('root', 'root@test.com', 'rootpass123'))
+        clean_total_slots = ClassAdminForm.clean_total_slots
+
+        def book_then_clean(form):
+            # A booking lands after the admin loaded the row
+            Classes.claim_slot(self.future_class.pk)
+            return clean_total_slots(form)
+
+        with mock.patch.object(ClassAdminForm, 'clean_total_slots', book_then_clean):
+            response = self.client.post(
+                reverse('admin:booking_api_classes_change', args=[self.future_class.pk]),
+                self.admin_change_form(name='Renamed Yoga', total_slots=12)
+            )
+
+        self.assertEqual(response.status_code, 302)
+        self.future_class.refresh_from_db()
+        self.assertEqual(self.future_class.name, 'Renamed Yoga')
+        self.assertEqual((self.future_class.total_slots, self.future_class.available_slots), (12, 11))
+        self.assertEqual(self.future_class.version, 2)
+
+    def test_admin_site_edit_from_stale_page(self):
+        """Test an admin edit made from a page opened before another edit is refused with the form shown again"""
+        self.client.force_login(User.objects.create_superuser('root', 'root@test.com', 'rootpass123'))
+        url = reverse('admin:booking_api_classes_change', args=[self.future_class.pk])
+        self.assertContains(self.client.get(url), 'name="expected_version" value="1"')
+        stale = self.admin_change_form(name='Stale Yoga')
+        self.future_class.update_if_current(1, {'instructor': 'Someone Else'})
+
+        response = self.client.post(url, stale)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'The class changed while you were editing it')
+        self.assertNotContains(response, 'was changed successfully')
+        self.future_class.refresh_from_db()
+        self.assertEqual((self.future_class.name, self.future_class.version), ('Morning Yoga', 2))
+
+    def test_admin_site_edit_losing_race(self):
+        """Test an admin edit overtaken after validation is not reported as saved"""
+        self.client.force_login(User.objects.create_superuser('root', 'root@test.com', 'rootpass123'))
+        url = reverse('admin:booking_api_classes_change', args=[self.future_class.pk])
+
+        with mock.patch.object(Classes, 'update_if_current', return_value=0):
+            response = self.client.post(url, self.admin_change_form(name='Late Yoga'), follow=True)
+
+        self.assertRedirects(response, url)
+        self.assertContains(response, 'The class changed while you were editing it')
+        self.assertNotContains(response, 'was changed successfully')
+        self.assertFalse(LogEntry.objects.filter(object_id=str(self.future_class.pk)).exists())
+
+
+class ClassCancelTestCase(FitnessAPITestCase):
+    """Test calling off a whole class"""
+
+    def test_cancel_class_as_admin(self):
+        """Test all active bookings are cancelled and the affected users returned"""
+        Booking.objects.create(user=self.regular_user, fitness_class=self.future_class, status='CONFIRMED')
+        Booking.objects.create(user=self.regular_user2, fitness_class=self.future_class, status='HELD')
+        Booking.objects.create(user=self.admin_user, fitness_class=self.future_class, status='CANCELLED')
+        Waitlist.objects.create(user=self.admin_user, fitness_class=self.future_class)
+        self.authenticate_user(self.admin_user)
+
+        response = self.client.post(reverse('class-cancel', kwargs={'pk': self.future_class.pk}))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['cancelled_bookings'], 2)
+        self.assertEqual(sorted(response.data['user_ids']), [self.regular_user.id, self.regular_user2.id])
+        self.assertEqual(response.data['waitlisted_user_ids'], [self.admin_user.id])
+        self.assertFalse(Booking.objects.filter(fitness_class=self.future_class, status__in=['CONFIRMED', 'HELD']).exists())
+        self.assertFalse(Waitlist.objects.exists())
+        self.future_class.refresh_from_db()
+        self.assertEqual(self.future_class.available_slots, 0)
+        self.assertIsNotNone(self.future_class.cancelled_at)
+
+    def test_cancelled_class_is_closed(self):
+        """Test a cancelled class is hidden and cannot be booked, waitlisted or reopened"""
+        self.future_class.cancel_all_bookings()
+
+        self.authenticate_user(self.regular_user)
+        listed = [row['id'] for row in self.client.get(reverse('class-list')).data['results']]
+        self.assertNotIn(self.future_class.id, listed)
+        booking = self.client.post(reverse('booking-create'), {'fitness_class_id': self.future_class.id})
+        self.assertEqual(booking.status_code, status.HTTP_400_BAD_REQUEST)
+        waitlist = self.client.post(reverse('class-waitlist', kwargs={'pk': self.future_class.pk}))
+        self.assertEqual(waitlist.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Classes.claim_slot(self.future_class.id))
+
+        self.authenticate_user(self.admin_user)
+        update = self.client.patch(reverse('class-detail', kwargs={'pk': self.future_class.pk}), {'total_slots': 20})
+        self.assertEqual(update.status_code, status.HTTP_409_CONFLICT)
+        self.future_class.refresh_from_db()
+        self.assertEqual((self.future_class.total_slots, self.future_class.available_slots), (10, 0))
+
+    def test_cancel_class_as_regular_user(self):
+        """Test regular users cannot call off a class"""
+        self.authenticate_user(self.regular_user)
+
+        response = self.client.post(reverse('class-cancel', kwargs={'pk': self.future_class.pk}))
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
 class BookingTestCase(FitnessAPITestCase):
     """Test booking-related endpoints"""
     
@@ -356,8 +681,8 @@ class BookingTestCase(FitnessAPITestCase):
         response = self.client.get(url)
         
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)  # Only user's own booking
-        self.assertEqual(response.data[0]['id'], booking1.id)
+        self.assertEqual(len(response.data['results']), 1)  # Only user's own booking
+        self.assertEqual(response.data['results'][0]['id'], booking1.id)
     
     def test_list_bookings_admin_all(self):
         """Test admin listing all bookings"""
@@ -378,7 +703,7 @@ class BookingTestCase(FitnessAPITestCase):
         response = self.client.get(url)
         
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 2)  # Admin sees all bookings
+        self.assertEqual(len(response.data['results']), 2)  # Admin sees all bookings
     
     def test_list_bookings_admin_filter_by_email(self):
         """Test admin filtering bookings by email"""
@@ -399,8 +724,8 @@ class BookingTestCase(FitnessAPITestCase):
         response = self.client.get(url, {'email': 'user1@test.com'})
         
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['user']['email'], 'user1@test.com')
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['user']['email'], 'user1@test.com')
     
     def test_list_bookings_admin_filter_by_status(self):
         """Test admin filtering bookings by status"""
@@ -421,8 +746,8 @@ class BookingTestCase(FitnessAPITestCase):
         response = self.client.get(url, {'status': 'CONFIRMED'})
         
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['status'], 'CONFIRMED')
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['status'], 'CONFIRMED')
     
     def test_cancel_booking_owner(self):
         """Test user cancelling their own booking"""
@@ -489,124 +814,1922 @@ class BookingTestCase(FitnessAPITestCase):
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
 
-class StatisticsTestCase(FitnessAPITestCase):
-    """Test statistics endpoints"""
-    
-    def setUp(self):
-        super().setUp()
-        
-        # Create some test data for statistics
-        recent_time = timezone.now() - timedelta(days=15)
-        old_time = timezone.now() - timedelta(days=45)
-        
-        self.recent_class = Classes.objects.create(
-            name='Recent Class',
-            class_type='YOGA',
-            instructor='Test Instructor',
-            duration_minutes=60,
-            date_time=recent_time,
-            total_slots=10
-        )
-        
-        self.old_class = Classes.objects.create(
-            name='Old Class',
-            class_type='ZUMBA',
-            instructor='Test Instructor',
-            duration_minutes=45,
-            date_time=old_time,
-            total_slots=10
-        )
-        
-        # Create bookings
+@override_settings(BOOKING_ENGINE='conditional')
+class ConditionalBookingEngineTestCase(FitnessAPITestCase):
+    """Test the lock-free conditional UPDATE booking engine"""
+
+    def test_create_booking_success(self):
+        """Test booking claims a slot with the guarded update"""
+        self.authenticate_user(self.regular_user)
+        url = reverse('booking-create')
+
+        response = self.client.post(url, {'fitness_class_id': self.future_class.id})
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['fitness_class']['available_slots'], 9)
+        self.future_class.refresh_from_db()
+        self.assertEqual(self.future_class.available_slots, 9)
+
+    def test_create_booking_duplicate_restores_slot(self):
+        """Test duplicate booking is rejected by the constraint and the claimed slot rolled back"""
         Booking.objects.create(
             user=self.regular_user,
-            fitness_class=self.recent_class,
+            fitness_class=self.future_class,
             status='CONFIRMED'
         )
-        Booking.objects.create(
-            user=self.regular_user2,
-            fitness_class=self.recent_class,
-            status='CANCELLED'
+        self.authenticate_user(self.regular_user)
+        url = reverse('booking-create')
+
+        response = self.client.post(url, {'fitness_class_id': self.future_class.id})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.future_class.refresh_from_db()
+        self.assertEqual(self.future_class.available_slots, 10)
+
+    def test_create_booking_full_past_and_missing_class(self):
+        """Test full, past and nonexistent classes are rejected"""
+        self.authenticate_user(self.regular_user)
+        url = reverse('booking-create')
+
+        for class_id in [self.full_class.id, self.past_class.id, 99999]:
+            response = self.client.post(url, {'fitness_class_id': class_id})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.full_class.refresh_from_db()
+        self.assertEqual(self.full_class.available_slots, 0)
+
+    def test_cancel_booking_twice_releases_one_slot(self):
+        """Test cancelling restores exactly one slot"""
+        self.authenticate_user(self.regular_user)
+        self.client.post(reverse('booking-create'), {'fitness_class_id': self.future_class.id})
+        booking = Booking.objects.get(user=self.regular_user, fitness_class=self.future_class)
+        url = reverse('booking-cancel', kwargs={'pk': booking.pk})
+
+        first = self.client.post(url)
+        second = self.client.post(url)
+
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertEqual(second.status_code, status.HTTP_400_BAD_REQUEST)
+        self.future_class.refresh_from_db()
+        self.assertEqual(self.future_class.available_slots, 10)
+
+
+class BatchBookingTestCase(FitnessAPITestCase):
+    """Test booking several classes in one request"""
+
+    def setUp(self):
+        super().setUp()
+        self.second_class = Classes.objects.create(
+            name='Lunch HIIT',
+            class_type='HIIT',
+            instructor='Mike Johnson',
+            duration_minutes=30,
+            date_time=timezone.now() + timedelta(days=3),
+            total_slots=5
         )
+        self.url = reverse('booking-batch-create')
+
+    def test_batch_booking_partial_success(self):
+        """Test available classes are booked and failures reported per class"""
+        self.authenticate_user(self.regular_user)
+        data = {'fitness_class_ids': [self.second_class.id, self.full_class.id, self.future_class.id]}
+
+        response = self.client.post(self.url, data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['booked'], 2)
+        results = response.data['results']
+        self.assertEqual([r['fitness_class_id'] for r in results], data['fitness_class_ids'])
+        self.assertEqual([r['booked'] for r in results], [True, False, True])
+        self.assertIn('error', results[1])
+        self.future_class.refresh_from_db()
+        self.second_class.refresh_from_db()
+        self.assertEqual(self.future_class.available_slots, 9)
+        self.assertEqual(self.second_class.available_slots, 4)
+
+    def test_batch_booking_all_or_nothing(self):
+        """Test one failing class rolls back the whole batch"""
+        self.authenticate_user(self.regular_user)
+        data = {
+            'fitness_class_ids': [self.future_class.id, self.past_class.id],
+            'all_or_nothing': True,
+        }
+
+        response = self.client.post(self.url, data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['booked'], 0)
+        self.assertFalse(Booking.objects.filter(user=self.regular_user).exists())
+        self.future_class.refresh_from_db()
+        self.assertEqual(self.future_class.available_slots, 10)
+
+    def test_batch_booking_skips_existing_booking(self):
+        """Test classes the user already booked are reported, not double booked"""
         Booking.objects.create(
             user=self.regular_user,
-            fitness_class=self.old_class,
+            fitness_class=self.future_class,
             status='CONFIRMED'
         )
-    
-    def test_admin_statistics(self):
-        """Test admin statistics endpoint"""
-        self.authenticate_user(self.admin_user)
-        url = reverse('statistics')
-        
-        response = self.client.get(url)
-        
-        self.assertEqual(response.status_code, status.HTTP_200_OK)
-        
-        expected_keys = [
-            'total_classes',
-            'total_booking',
-            'confirmed_bookings',
-            'cancelled_bookings',
-            'popular_classes'
-        ]
-        
-        for key in expected_keys:
-            self.assertIn(key, response.data)
-        
-        # Should only include recent data (last 30 days)
-        self.assertGreaterEqual(response.data['total_classes'], 1)
-        self.assertIsInstance(response.data['popular_classes'], list)
-    
-    def test_admin_statistics_unauthorized(self):
-        """Test admin statistics as regular user"""
         self.authenticate_user(self.regular_user)
-        url = reverse('statistics')
-        
-        response = self.client.get(url)
-        
-        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
-    
-    def test_user_statistics(self):
-        """Test user statistics endpoint"""
-        # Create a future booking for upcoming classes count
-        future_booking = Booking.objects.create(
-            user=self.regular_user,
-            fitness_class=self.future_class,
-            status='CONFIRMED'
+        data = {'fitness_class_ids': [self.future_class.id, self.second_class.id, 99999]}
+
+        response = self.client.post(self.url, data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([r['booked'] for r in response.data['results']], [False, True, False])
+        self.assertEqual(
+            Booking.objects.filter(user=self.regular_user, fitness_class=self.future_class).count(), 1
         )
-        
+
+    def test_batch_booking_requires_ids(self):
+        """Test empty batch is rejected"""
         self.authenticate_user(self.regular_user)
-        url = reverse('user-statistics')
-        
-        response = self.client.get(url)
-        
-        self.assertEqual(response.status_code, status.HTTP_200_OK)
-        
-        expected_keys = [
-            'user',
-            'bookings',
-            'cancelled_bookings',
-            'upcoming_classes',
-            'upcoming_classes_details'
-        ]
-        
-        for key in expected_keys:
-            self.assertIn(key, response.data)
-        
-        # Verify user data
-        self.assertEqual(response.data['user']['email'], self.regular_user.email)
-        self.assertGreaterEqual(response.data['bookings'], 1)
-        self.assertGreaterEqual(response.data['upcoming_classes'], 1)
-        self.assertIsInstance(response.data['upcoming_classes_details'], list)
-    
-    def test_user_statistics_unauthenticated(self):
-        """Test user statistics without authentication"""
-        url = reverse('user-statistics')
-        
-        response = self.client.get(url)
-        
-        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        response = self.client.post(self.url, {'fitness_class_ids': []}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class WaitlistTestCase(FitnessAPITestCase):
+    """Test waitlist joins and promotion on cancellation"""
+
+    def setUp(self):
+        super().setUp()
+        # full_class has one slot, held by admin_user
+        self.full_booking = Booking.objects.create(
+            user=self.admin_user,
+            fitness_class=self.full_class,
+            status='CONFIRMED'
+        )
+
+    def join(self, user, fitness_class):
+        self.authenticate_user(user)
+        return self.client.post(reverse('class-waitlist', kwargs={'pk': fitness_class.pk}))
+
+    def test_join_waitlist_full_class(self):
+        """Test joining the waitlist of a full class"""
+        first = self.join(self.regular_user, self.full_class)
+        second = self.join(self.regular_user2, self.full_class)
+
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(first.data['position'], 1)
+        self.assertEqual(second.data['position'], 2)
+
+    def test_join_waitlist_rejected(self):
+        """Test joining twice, or joining a class with free slots, is rejected"""
+        self.join(self.regular_user, self.full_class)
+
+        duplicate = self.join(self.regular_user, self.full_class)
+        not_full = self.join(self.regular_user, self.future_class)
+
+        self.assertEqual(duplicate.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(not_full.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_leave_waitlist(self):
+        """Test leaving the waitlist"""
+        self.join(self.regular_user, self.full_class)
+        url = reverse('class-waitlist', kwargs={'pk': self.full_class.pk})
+
+        response = self.client.delete(url)
+
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(Waitlist.objects.exists())
+        self.assertEqual(self.client.delete(url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def assert_cancel_promotes_head(self):
+        self.join(self.regular_user, self.full_class)
+        self.join(self.regular_user2, self.full_class)
+
+        self.assertTrue(self.full_booking.cancel())
+
+        self.assertTrue(
+            Booking.objects.filter(user=self.regular_user, fitness_class=self.full_class, status='CONFIRMED').exists()
+        )
+        self.assertEqual(list(Waitlist.objects.values_list('user', flat=True)), [self.regular_user2.id])
+        self.full_class.refresh_from_db()
+        self.assertEqual(self.full_class.available_slots, 0)
+
+    def test_cancel_promotes_head_of_waitlist(self):
+        """Test the freed slot goes to the first waiter without being released"""
+        self.assert_cancel_promotes_head()
+
+    @override_settings(BOOKING_ENGINE='conditional')
+    def test_cancel_promotes_head_of_waitlist_conditional(self):
+        """Test promotion with the conditional booking engine"""
+        self.assert_cancel_promotes_head()
+
+
+class IdempotencyTestCase(FitnessAPITestCase):
+    """Test Idempotency-Key replay on booking and cancellation"""
+
+    def test_retried_booking_is_replayed(self):
+        """Test a retry with the same key returns the stored response without booking again"""
+        self.authenticate_user(self.regular_user)
+        url = reverse('booking-create')
+        data = {'fitness_class_id': self.future_class.id}
+
+        first = self.client.post(url, data, HTTP_IDEMPOTENCY_KEY='book-1')
+        retry = self.client.post(url, data, HTTP_IDEMPOTENCY_KEY='book-1')
+
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.future_class.refresh_from_db()
+        self.assertEqual(self.future_class.available_slots, 9)
+
+    def test_retried_cancel_is_replayed(self):
+        """Test a retried cancellation gets the original 200 instead of a 400"""
+        booking = Booking.objects.create(
+            user=self.regular_user,
+            fitness_class=self.future_class,
+            status='CONFIRMED'
+        )
+        self.authenticate_user(self.regular_user)
+        url = reverse('booking-cancel', kwargs={'pk': booking.pk})
+
+        first = self.client.post(url, HTTP_IDEMPOTENCY_KEY='cancel-1')
+        retry = self.client.post(url, HTTP_IDEMPOTENCY_KEY='cancel-1')
+
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertEqual(retry.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.post(url).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_key_reused_for_other_request(self):
+        """Test a key reused on a different endpoint is rejected"""
+        self.authenticate_user(self.regular_user)
+        self.client.post(reverse('booking-create'), {'fitness_class_id': self.future_class.id}, HTTP_IDEMPOTENCY_KEY='k')
+        booking = Booking.objects.get(user=self.regular_user)
+
+        response = self.client.post(reverse('booking-cancel', kwargs={'pk': booking.pk}), HTTP_IDEMPOTENCY_KEY='k')
+
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    @override_settings(IDEMPOTENCY={'STORE': 'booking_api.idempotency.CacheIdempotencyStore', 'TTL': 60})
+    def test_cache_store(self):
+        """Test replay with the Django cache store"""
+        self.authenticate_user(self.regular_user)
+        url = reverse('booking-create')
+        data = {'fitness_class_id': self.future_class.id}
+
+        first = self.client.post(url, data, HTTP_IDEMPOTENCY_KEY='cache-book-1')
+        retry = self.client.post(url, data, HTTP_IDEMPOTENCY_KEY='cache-book-1')
+
+        self.assertEqual(retry.json(), first.json())
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(Booking.objects.filter(user=self.regular_user).count(), 1)
+
+    def test_key_in_flight_is_conflict(self):
+        """Test a retry while the first request still holds the key gets 409 and leaves the reservation alone"""
+        IdempotencyKey.objects.create(
+            user=self.regular_user, key='busy', request_path=reverse('booking-create'), status_code=None,
+            expires_at=timezone.now() + timedelta(minutes=1)
+        )
+        self.authenticate_user(self.regular_user)
+
+        response = self.client.post(reverse('booking-create'), {'fitness_class_id': self.future_class.id}, HTTP_IDEMPOTENCY_KEY='busy')
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertFalse(Booking.objects.filter(user=self.regular_user).exists())
+        self.assertIsNone(IdempotencyKey.objects.get(key='busy').status_code)
+
+    def test_stored_response_is_not_overwritten(self):
+        """Test a late set() for a key that already has a response keeps the first one"""
+        self.authenticate_user(self.regular_user)
+        self.client.post(reverse('booking-create'), {'fitness_class_id': self.future_class.id}, HTTP_IDEMPOTENCY_KEY='once')
+
+        DatabaseIdempotencyStore().set(self.regular_user.pk, 'once', reverse('booking-create'), 400, {'error': 'late'})
+
+        self.assertEqual(IdempotencyKey.objects.get(key='once').status_code, status.HTTP_201_CREATED)
+
+    def test_expired_key_is_recycled(self):
+        """Test an expired, unswept key is replaced by the next request using it"""
+        IdempotencyKey.objects.create(
+            user=self.regular_user, key='old', request_path=reverse('booking-create'), status_code=400,
+            response_body={}, expires_at=timezone.now() - timedelta(minutes=1)
+        )
+        self.authenticate_user(self.regular_user)
+
+        response = self.client.post(reverse('booking-create'), {'fitness_class_id': self.future_class.id}, HTTP_IDEMPOTENCY_KEY='old')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(IdempotencyKey.objects.get(key='old').status_code, status.HTTP_201_CREATED)
+
+    def test_failed_request_releases_key(self):
+        """Test an unhandled error drops the reservation so the client can retry"""
+        self.authenticate_user(self.regular_user)
+        url = reverse('booking-create')
+        data = {'fitness_class_id': self.future_class.id}
+
+        with mock.patch('booking_api.views.BookingSerializer.save', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.client.post(url, data, HTTP_IDEMPOTENCY_KEY='retry-me')
+        self.assertFalse(IdempotencyKey.objects.filter(key='retry-me').exists())
+
+        self.assertEqual(self.client.post(url, data, HTTP_IDEMPOTENCY_KEY='retry-me').status_code, status.HTTP_201_CREATED)
+
+    @override_settings(IDEMPOTENCY={'STORE': 'booking_api.idempotency.CacheIdempotencyStore', 'TTL': 60})
+    def test_cache_store_key_in_flight_is_conflict(self):
+        """Test the cache store also rejects a retry while the key is reserved"""
+        store = CacheIdempotencyStore()
+        self.assertIsNone(store.reserve(self.regular_user.pk, 'busy', reverse('booking-create')))
+        self.authenticate_user(self.regular_user)
+
+        response = self.client.post(reverse('booking-create'), {'fitness_class_id': self.future_class.id}, HTTP_IDEMPOTENCY_KEY='busy')
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+    def test_sweep_expired_keys(self):
+        """Test the sweeper removes only expired keys"""
+        now = timezone.now()
+        for i in range(5):
+            IdempotencyKey.objects.create(
+                user=self.regular_user, key=f'old-{i}', request_path='/', status_code=200,
+                response_body={}, expires_at=now - timedelta(minutes=1)
+            )
+        IdempotencyKey.objects.create(
+            user=self.regular_user, key='fresh', request_path='/', status_code=200,
+            response_body={}, expires_at=now + timedelta(hours=1)
+        )
+
+        call_command('sweep_idempotency_keys', batch_size=2, stdout=StringIO())
+
+        self.assertEqual(list(IdempotencyKey.objects.values_list('key', flat=True)), ['fresh'])
+
+
+class SlotShardTestCase(FitnessAPITestCase):
+    """Test sharded slot counters"""
+
+    def setUp(self):
+        super().setUp()
+        self.future_class.set_slot_shards(3)
+
+    def shard_slots(self):
+        return list(
+            ClassSlotShard.objects.filter(fitness_class=self.future_class)
+            .order_by('shard').values_list('available_slots', flat=True)
+        )
+
+    def test_set_slot_shards_splits_capacity(self):
+        """Test free slots are split across the shards"""
+        self.assertEqual(self.shard_slots(), [4, 3, 3])
+        self.future_class.set_slot_shards(0)
+        self.future_class.refresh_from_db()
+        self.assertEqual(self.future_class.shard_count, 0)
+        self.assertEqual(self.future_class.available_slots, 10)
+        self.assertEqual(self.shard_slots(), [])
+
+    def test_booking_takes_slot_from_shard(self):
+        """Test booking a sharded class decrements a shard and the list shows the reconciled total"""
+        self.authenticate_user(self.regular_user)
+
+        response = self.client.post(reverse('booking-create'), {'fitness_class_id': self.future_class.id})
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(sum(self.shard_slots()), 9)
+        classes = self.client.get(reverse('class-list'), {'type': 'YOGA'}).data['results']
+        self.assertEqual(classes[0]['available_slots'], 9)
+
+    def test_claim_falls_back_to_other_shards(self):
+        """Test an empty shard falls back to the others until the class is full"""
+        ClassSlotShard.objects.filter(fitness_class=self.future_class).update(available_slots=0)
+        ClassSlotShard.objects.filter(fitness_class=self.future_class, shard=2).update(available_slots=1)
+
+        self.assertTrue(Classes.claim_slot(self.future_class.id, user_id=0))
+        self.assertFalse(Classes.claim_slot(self.future_class.id, user_id=0))
+
+    def test_cancel_releases_slot_to_shard(self):
+        """Test cancelling a sharded booking gives the slot back to a shard"""
+        booking = Booking.objects.create(
+            user=self.regular_user,
+            fitness_class=self.future_class,
+            status='CONFIRMED'
+        )
+        Classes.claim_slot(self.future_class.id, self.regular_user.id)
+
+        self.assertTrue(booking.cancel())
+
+        self.assertEqual(sum(self.shard_slots()), 10)
+        Classes.reconcile_slots()
+        self.future_class.refresh_from_db()
+        self.assertEqual(self.future_class.available_slots, 10)
+
+
+@override_settings(BOOKING_INTAKE='queued')
+class BookingQueueTestCase(FitnessAPITestCase):
+    """Test queued booking intake and batch processing"""
+
+    def setUp(self):
+        super().setUp()
+        self.small_class = Classes.objects.create(
+            name='Small Zumba',
+            class_type='ZUMBA',
+            instructor='Jane Smith',
+            duration_minutes=45,
+            date_time=timezone.now() + timedelta(days=2),
+            total_slots=1
+        )
+
+    def enqueue(self, user, fitness_class):
+        self.authenticate_user(user)
+        return self.client.post(reverse('booking-create'), {'fitness_class_id': fitness_class.id})
+
+    def test_booking_is_queued(self):
+        """Test queued intake answers 202 with a pending ticket and books nothing yet"""
+        response = self.enqueue(self.regular_user, self.future_class)
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['status'], 'PENDING')
+        self.assertEqual(response['Location'], reverse('booking-ticket', kwargs={'pk': response.data['id']}))
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertFalse(Booking.objects.exists())
+
+    def test_queue_rejects_past_class(self):
+        """Test a past class is turned away before queueing"""
+        response = self.enqueue(self.regular_user, self.past_class)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(BookingTicket.objects.exists())
+
+    def test_process_grants_first_tickets_and_rejects_rest(self):
+        """Test the oldest tickets get the slots and the rest are rejected in bulk"""
+        first = self.enqueue(self.regular_user, self.small_class).data['id']
+        second = self.enqueue(self.regular_user2, self.small_class).data['id']
+        third = self.enqueue(self.admin_user, self.small_class).data['id']
+
+        granted, rejected = BookingTicket.process_class(self.small_class.id, batch_size=2)
+
+        self.assertEqual((granted, rejected), (1, 2))
+        self.assertEqual(BookingTicket.objects.get(pk=first).status, 'GRANTED')
+        self.assertEqual(BookingTicket.objects.get(pk=second).status, 'REJECTED')
+        self.assertEqual(BookingTicket.objects.get(pk=third).status, 'REJECTED')
+        self.small_class.refresh_from_db()
+        self.assertEqual(self.small_class.available_slots, 0)
+        self.assertTrue(Booking.objects.filter(user=self.regular_user, fitness_class=self.small_class).exists())
+
+    def test_process_rejects_duplicate_user(self):
+        """Test a user queued twice is booked once"""
+        self.enqueue(self.regular_user, self.future_class)
+        self.enqueue(self.regular_user, self.future_class)
+
+        call_command('process_booking_queue', stdout=StringIO())
+
+        self.assertEqual(Booking.objects.filter(user=self.regular_user).count(), 1)
+        self.assertEqual(
+            sorted(BookingTicket.objects.values_list('status', flat=True)), ['GRANTED', 'REJECTED']
+        )
+        self.future_class.refresh_from_db()
+        self.assertEqual(self.future_class.available_slots, 9)
+
+    def test_ticket_status(self):
+        """Test the owner can read the ticket and other users cannot"""
+        ticket_id = self.enqueue(self.regular_user, self.future_class).data['id']
+        url = reverse('booking-ticket', kwargs={'pk': ticket_id})
+
+        pending = self.client.get(url)
+        self.assertEqual(pending.data['status'], 'PENDING')
+        self.assertEqual(pending['Retry-After'], '1')
+
+        BookingTicket.process_class(self.future_class.id)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], 'GRANTED')
+        self.assertIsNotNone(response.data['booking_id'])
+        self.assertFalse(response.has_header('Retry-After'))
+
+        self.authenticate_user(self.regular_user2)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
+
+class BookingHoldTestCase(FitnessAPITestCase):
+    """Test two-phase bookings with HELD slots"""
+
+    def hold(self, user, fitness_class):
+        self.authenticate_user(user)
+        return self.client.post(reverse('booking-hold'), {'fitness_class_id': fitness_class.id})
+
+    def test_hold_takes_slot(self):
+        """Test a hold decrements the slots and carries an expiry"""
+        response = self.hold(self.regular_user, self.future_class)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['status'], 'HELD')
+        self.assertIsNotNone(response.data['expires_at'])
+        self.future_class.refresh_from_db()
+        self.assertEqual(self.future_class.available_slots, 9)
+        # The hold blocks a second booking of the same class
+        second = self.client.post(reverse('booking-create'), {'fitness_class_id': self.future_class.id})
+        self.assertEqual(second.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_confirm_hold(self):
+        """Test confirming a hold keeps the slot taken"""
+        booking_id = self.hold(self.regular_user, self.future_class).data['id']
+
+        response = self.client.post(reverse('booking-confirm', kwargs={'pk': booking_id}))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], 'CONFIRMED')
+        self.assertIsNone(response.data['expires_at'])
+        self.future_class.refresh_from_db()
+        self.assertEqual(self.future_class.available_slots, 9)
+
+    def test_confirm_expired_hold(self):
+        """Test an expired hold cannot be confirmed"""
+        booking_id = self.hold(self.regular_user, self.future_class).data['id']
+        Booking.objects.filter(pk=booking_id).update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        response = self.client.post(reverse('booking-confirm', kwargs={'pk': booking_id}))
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_release_expired_holds(self):
+        """Test the sweeper expires old holds and restores slots per class"""
+        second_class = Classes.objects.create(
+            name='Lunch HIIT',
+            class_type='HIIT',
+            instructor='Mike Johnson',
+            duration_minutes=30,
+            date_time=timezone.now() + timedelta(days=3),
+            total_slots=5
+        )
+        expired = [
+            self.hold(self.regular_user, self.future_class).data['id'],
+            self.hold(self.regular_user2, self.future_class).data['id'],
+            self.hold(self.regular_user, second_class).data['id'],
+        ]
+        live = self.hold(self.admin_user, self.future_class).data['id']
+        Booking.objects.filter(pk__in=expired).update(expires_at=timezone.now() - timedelta(minutes=1))
+
+        call_command('release_expired_holds', batch_size=2, stdout=StringIO())
+
+        self.assertEqual(Booking.objects.filter(status='EXPIRED').count(), 3)
+        self.assertEqual(Booking.objects.get(pk=live).status, 'HELD')
+        self.future_class.refresh_from_db()
+        second_class.refresh_from_db()
+        self.assertEqual(self.future_class.available_slots, 9)
+        self.assertEqual(second_class.available_slots, 5)
+
+    def test_expired_hold_promotes_waitlist(self):
+        """Test a slot freed by an expired hold goes to the waitlist before the counter"""
+        self.future_class.total_slots = 2
+        self.future_class.available_slots = 2
+        self.future_class.save()
+        expired = [
+            self.hold(self.regular_user, self.future_class).data['id'],
+            self.hold(self.regular_user2, self.future_class).data['id'],
+        ]
+        Waitlist.objects.create(user=self.admin_user, fitness_class=self.future_class)
+        Booking.objects.filter(pk__in=expired).update(expires_at=timezone.now() - timedelta(minutes=1))
+
+        Booking.release_expired_holds()
+
+        self.assertTrue(Booking.objects.filter(user=self.admin_user, fitness_class=self.future_class, status='CONFIRMED').exists())
+        self.assertFalse(Waitlist.objects.exists())
+        self.future_class.refresh_from_db()
+        self.assertEqual(self.future_class.available_slots, 1)
+
+
+@override_settings(CACHES=TEST_CACHES, SQLITE_LOCK_RETRY={'ATTEMPTS': 3, 'BASE_DELAY': 0, 'MAX_DELAY': 0})
+class SQLiteTuningTestCase(TransactionTestCase):
+    """Test SQLite connection pragmas and the lock retry decorator"""
+
+    def make_flaky(self, errors):
+        calls = []
+
+        @retry_on_db_lock
+        def flaky():
+            calls.append(1)
+            if len(calls) <= len(errors):
+                raise errors[len(calls) - 1]
+            return 'done'
+        return flaky, calls
+
+    def test_pragmas_applied(self):
+        """Test busy_timeout is set on new connections"""
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA busy_timeout")
+            self.assertEqual(cursor.fetchone()[0], 5000)
+
+    def test_retries_lock_errors(self):
+        """Test lock errors are retried until the call succeeds"""
+        flaky, calls = self.make_flaky([OperationalError('database is locked')] * 2)
+
+        self.assertEqual(flaky(), 'done')
+        self.assertEqual(len(calls), 3)
+
+    def test_gives_up_after_attempts(self):
+        """Test the error surfaces once the attempts are used up"""
+        flaky, calls = self.make_flaky([OperationalError('database is locked')] * 3)
+
+        with self.assertRaises(OperationalError):
+            flaky()
+        self.assertEqual(len(calls), 3)
+
+    def test_other_errors_not_retried(self):
+        """Test non-lock errors are raised straight away"""
+        flaky, calls = self.make_flaky([OperationalError('no such table: x')])
+
+        with self.assertRaises(OperationalError):
+            flaky()
+        self.assertEqual(len(calls), 1)
+
+    def test_not_retried_inside_atomic(self):
+        """Test a nested call is not retried, the outer transaction is already broken"""
+        flaky, calls = self.make_flaky([OperationalError('database is locked')])
+
+        with self.assertRaises(OperationalError):
+            with transaction.atomic():
+                flaky()
+        self.assertEqual(len(calls), 1)
+
+
+class KeysetPaginationTestCase(FitnessAPITestCase):
+    """Test cursor pagination of the class and booking lists"""
+
+    def setUp(self):
+        super().setUp()
+        start = timezone.now() + timedelta(days=5)
+        # Several classes share a start time so the id tie-break is exercised
+        for i in range(7):
+            Classes.objects.create(
+                name=f'Spin {i}',
+                class_type='HIIT',
+                instructor='Pat',
+                duration_minutes=45,
+                date_time=start + timedelta(hours=i // 3),
+                total_slots=10
+            )
+
+    def collect(self, url, params):
+        ids, pages = [], 0
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('count', response.data)
+            ids += [item['id'] for item in response.data['results']]
+            url, params, pages = response.data['next'], None, pages + 1
+        return ids, pages
+
+    def test_classes_paged_in_order(self):
+        """Test walking the cursors returns every upcoming class once, in (date_time, id) order"""
+        ids, pages = self.collect(reverse('class-list'), {'page_size': 3})
+
+        expected = list(
+            Classes.objects.filter(date_time__gt=timezone.now())
+            .order_by('date_time', 'id').values_list('id', flat=True)
+        )
+        self.assertEqual(ids, expected)
+        self.assertEqual(pages, 3)
+
+    def test_bookings_paged_in_order(self):
+        """Test bookings are paged on (booked_at, id)"""
+        for fitness_class in Classes.objects.filter(name__startswith='Spin'):
+            Booking.objects.create(user=self.regular_user, fitness_class=fitness_class, status='CONFIRMED')
+        self.authenticate_user(self.regular_user)
+
+        ids, pages = self.collect(reverse('booking-list'), {'page_size': 2})
+
+        self.assertEqual(ids, list(Booking.objects.order_by('booked_at', 'id').values_list('id', flat=True)))
+        self.assertEqual(pages, 4)
+
+    def test_invalid_cursor(self):
+        """Test a tampered cursor is rejected"""
+        response = self.client.get(reverse('class-list'), {'cursor': 'not-a-cursor'})
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ClassListCacheTestCase(FitnessAPITestCase):
+    """Test the versioned response cache of the class list"""
+
+    def setUp(self):
+        super().setUp()
+        self.url = reverse('class-list')
+
+    def slots(self, response):
+        return next(item['available_slots'] for item in response.data['results'] if item['id'] == self.future_class.id)
+
+    def test_repeated_list_served_from_cache(self):
+        """Test a repeated query does not touch the database"""
+        first = self.client.get(self.url)
+
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url)
+        self.assertEqual(second.data, first.data)
+
+    def test_key_varies_by_params_and_timezone(self):
+        """Test filters and the client timezone get their own cache entries"""
+        self.client.get(self.url)
+
+        response = self.client.get(self.url, {'type': 'ZUMBA'})
+        self.assertEqual(response.data['results'], [])
+        kolkata = self.client.get(self.url)
+        utc = self.client.get(self.url, HTTP_X_TIMEZONE='UTC')
+        self.assertNotEqual(utc.data['results'][0]['date_time'], kolkata.data['results'][0]['date_time'])
+
+    def test_booking_and_cancel_invalidate(self):
+        """Test booking and cancelling bump the schedule version on commit"""
+        self.assertEqual(self.slots(self.client.get(self.url)), 10)
+        self.authenticate_user(self.regular_user)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('booking-create'), {'fitness_class_id': self.future_class.id})
+        self.assertEqual(self.slots(self.client.get(self.url)), 9)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('booking-cancel', kwargs={'pk': response.data['id']}))
+        self.assertEqual(self.slots(self.client.get(self.url)), 10)
+
+    def test_class_changes_invalidate(self):
+        """Test admin create, update and delete bump the schedule version"""
+        self.client.get(self.url)
+        self.authenticate_user(self.admin_user)
+        detail = reverse('class-detail', kwargs={'pk': self.future_class.pk})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(detail, {'name': 'Renamed'})
+        names = [item['name'] for item in self.client.get(self.url).data['results']]
+        self.assertIn('Renamed', names)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(detail)
+        ids = [item['id'] for item in self.client.get(self.url).data['results']]
+        self.assertNotIn(self.future_class.id, ids)
+
+    def test_no_bump_before_commit(self):
+        """Test the version only moves once the booking transaction commits"""
+        self.client.get(self.url)
+        self.authenticate_user(self.regular_user)
+
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            self.client.post(reverse('booking-create'), {'fitness_class_id': self.future_class.id})
+            self.assertEqual(self.slots(self.client.get(self.url)), 10)
+        self.assertEqual(len(callbacks), 1)
+
+    def test_file_and_database_backends(self):
+        """Test the cache works on the file and database backends"""
+        directory = tempfile.mkdtemp(prefix='booking_api_test_cache_')
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        backends = {
+            'file': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory},
+            'db': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'booking_api_test_cache'},
+        }
+        call_command('createcachetable', 'booking_api_test_cache', stdout=StringIO())
+        self.authenticate_user(self.regular_user)
+        for name, backend in backends.items():
+            with self.subTest(backend=name), override_settings(CACHES={'default': backend}):
+                cache.clear()
+                self.assertEqual(self.slots(self.client.get(self.url)), 10)
+                with CaptureQueriesContext(connection) as context:
+                    self.client.get(self.url)
+                self.assertFalse([query for query in context.captured_queries if 'booking_api_classes' in query['sql']])
+
+                with self.captureOnCommitCallbacks(execute=True):
+                    response = self.client.post(reverse('booking-create'), {'fitness_class_id': self.future_class.id})
+                self.assertEqual(self.slots(self.client.get(self.url)), 9)
+                Booking.objects.get(pk=response.data['id']).cancel()
+                cache.clear()
+
+    def test_check_warns_about_local_memory_cache(self):
+        """Test manage.py check flags a per-process cache, a file cache passes"""
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': '/unused'}}):
+            self.assertEqual(check_shared_cache(None), [])
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            self.assertEqual([warning.id for warning in check_shared_cache(None)], ['booking_api.W001'])
+            with override_settings(CLASS_LIST_CACHE={'ENABLED': False}):
+                self.assertEqual(check_shared_cache(None), [])
+
+
+class SparseFieldsTestCase(FitnessAPITestCase):
+    """Test ?fields= and ?expand= on the class and booking lists"""
+
+    def setUp(self):
+        super().setUp()
+        Booking.objects.create(user=self.regular_user, fitness_class=self.future_class, status='CONFIRMED')
+        self.authenticate_user(self.regular_user)
+
+    def page_query(self, url, params):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # The last query reads the page itself
+        return response, context.captured_queries[-1]['sql']
+
+    def test_class_fields(self):
+        """Test only the asked fields are rendered and read"""
+        response, sql = self.page_query(reverse('class-list'), {'fields': 'id,available_slots'})
+
+        for item in response.data['results']:
+            self.assertEqual(set(item), {'id', 'available_slots'})
+        self.assertNotIn('"instructor"', sql)
+        self.assertNotIn('"created_at"', sql)
+
+    def test_booking_default_unchanged(self):
+        """Test bookings still nest user and class without the params"""
+        response = self.client.get(reverse('booking-list'))
+
+        booking = response.data['results'][0]
+        self.assertEqual(booking['user']['username'], 'user1')
+        self.assertEqual(booking['fitness_class']['name'], 'Morning Yoga')
+
+    def test_booking_unexpanded_relations(self):
+        """Test relations render as pk without a join once a fieldset is asked for"""
+        response, sql = self.page_query(reverse('booking-list'), {'fields': 'id,user,fitness_class'})
+
+        self.assertEqual(response.data['results'][0], {
+            'id': response.data['results'][0]['id'],
+            'user': self.regular_user.id,
+            'fitness_class': self.future_class.id,
+        })
+        self.assertNotIn('JOIN', sql)
+
+    def test_booking_expand(self):
+        """Test ?expand= nests only the named relation"""
+        response, sql = self.page_query(reverse('booking-list'), {'expand': 'fitness_class'})
+
+        booking = response.data['results'][0]
+        self.assertEqual(booking['user'], self.regular_user.id)
+        self.assertEqual(booking['fitness_class']['id'], self.future_class.id)
+        self.assertNotIn('"auth_user"', sql)
+
+    def test_unknown_fields_ignored(self):
+        """Test unknown names are ignored"""
+        response = self.client.get(reverse('class-list'), {'fields': 'id,nope'})
+
+        self.assertEqual(set(response.data['results'][0]), {'id'})
+
+    def test_sparse_pages(self):
+        """Test the cursor keeps the fieldset without per-row queries"""
+        response = self.client.get(reverse('class-list'), {'fields': 'name', 'page_size': 1})
+        self.assertEqual(list(response.data['results'][0]), ['name'])
+
+        with self.assertNumQueries(3):
+            response = self.client.get(response.data['next'])
+        self.assertEqual(list(response.data['results'][0]), ['name'])
+
+
+@override_settings(CLASS_LIST_CACHE={'ENABLED': False})
+class FastSerializerConformanceTestCase(FitnessAPITestCase):
+    """Test the fast read path renders byte-identical lists to the DRF serializers"""
+
+    def setUp(self):
+        super().setUp()
+        self.regular_user.first_name, self.regular_user.last_name = 'Ada', 'Lovelace'
+        self.regular_user.save()
+        sharded = Classes.objects.create(
+            name='Sharded Spin', class_type='HIIT', instructor='Pat', duration_minutes=45,
+            date_time=timezone.now() + timedelta(days=2), total_slots=12
+        )
+        sharded.set_slot_shards(3)
+        Booking.objects.create(user=self.regular_user, fitness_class=self.future_class, status='CONFIRMED')
+        Booking.objects.create(user=self.regular_user, fitness_class=sharded, status='HELD', expires_at=timezone.now() + timedelta(minutes=5))
+        Booking.objects.create(user=self.regular_user, fitness_class=self.past_class, status='CANCELLED', cancelled_at=timezone.now())
+        Booking.objects.create(user=self.regular_user, fitness_class=self.full_class, status='CONFIRMED')
+
+    def assert_same_output(self, url, params=None, tz='Asia/Kolkata'):
+        with self.settings(FAST_READ_SERIALIZERS=False):
+            expected = self.client.get(url, params, HTTP_X_TIMEZONE=tz)
+        response = self.client.get(url, params, HTTP_X_TIMEZONE=tz)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.content, expected.content)
+
+    def test_class_list(self):
+        """Test the class list, sharded and full classes included, in two timezones"""
+        for tz in ('Asia/Kolkata', 'UTC'):
+            self.assert_same_output(reverse('class-list'), tz=tz)
+        self.assert_same_output(reverse('class-list'), {'fields': 'id,available_slots,is_available'})
+        self.assert_same_output(reverse('class-list'), {'page_size': 1})
+        self.assert_same_output(reverse('class-list'), {'available': 'true', 'fields': 'id,is_available'})
+
+    def test_booking_list(self):
+        """Test the booking list with nested user and class, and sparse variants"""
+        self.authenticate_user(self.regular_user)
+        url = reverse('booking-list')
+        for tz in ('Asia/Kolkata', 'UTC'):
+            self.assert_same_output(url, tz=tz)
+        self.assert_same_output(url, {'expand': 'fitness_class'})
+        self.assert_same_output(url, {'fields': 'id,user,status,expires_at'})
+
+        self.authenticate_user(self.admin_user)
+        self.assert_same_output(url, {'status': 'confirmed', 'page_size': 1})
+
+    def test_fast_path_avoids_model_instances(self):
+        """Test rows are fetched with .values() and sharded totals in one extra query"""
+        self.authenticate_user(self.regular_user)
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(reverse('booking-list'))
+        shard_queries = [query for query in context.captured_queries if 'booking_api_classslotshard' in query['sql'] and 'SUM' in query['sql']]
+        self.assertEqual(len(shard_queries), 1)
+
+
+@override_settings(CLASS_LIST_CACHE={'ENABLED': False})
+class ConditionalListTestCase(FitnessAPITestCase):
+    """Test ETag / Last-Modified conditional GETs of the class and booking lists"""
+
+    def setUp(self):
+        super().setUp()
+        self.classes_url = reverse('class-list')
+        self.bookings_url = reverse('booking-list')
+
+    def test_class_list_not_modified(self):
+        """Test a matching If-None-Match gets an empty 304 after only the validator query"""
+        response = self.client.get(self.classes_url)
+        self.assertIn('Last-Modified', response)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.classes_url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+        self.assertIn('ETag', response)
+
+    def test_class_list_if_modified_since(self):
+        """Test If-Modified-Since is answered from the newest updated_at"""
+        last_modified = self.client.get(self.classes_url)['Last-Modified']
+
+        response = self.client.get(self.classes_url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.client.get(self.classes_url, HTTP_IF_MODIFIED_SINCE='Mon, 01 Jan 2001 00:00:00 GMT')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_class_list_etag_changes(self):
+        """Test bookings, sharded bookings and filters change the class list ETag"""
+        etag = self.client.get(self.classes_url)['ETag']
+        self.assertNotEqual(self.client.get(self.classes_url, {'type': 'HIIT'})['ETag'], etag)
+
+        self.authenticate_user(self.regular_user)
+        self.client.post(reverse('booking-create'), {'fitness_class_id': self.future_class.id})
+        response = self.client.get(self.classes_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.future_class.set_slot_shards(3)
+        etag = self.client.get(self.classes_url)['ETag']
+        self.authenticate_user(self.regular_user2)
+        self.client.post(reverse('booking-create'), {'fitness_class_id': self.future_class.id})
+        response = self.client.get(self.classes_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_class_list_if_modified_since_sees_removals(self):
+        """Test a deleted or started class moves Last-Modified although MAX(updated_at) stays put"""
+        Classes.objects.update(updated_at=timezone.now() - timedelta(days=1))
+        SlotChange.objects.update(changed_at=timezone.now() - timedelta(days=1))
+        last_modified = self.client.get(self.classes_url)['Last-Modified']
+        self.assertEqual(self.client.get(self.classes_url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.authenticate_user(self.admin_user)
+        self.client.delete(reverse('class-detail', kwargs={'pk': self.full_class.pk}))
+        response = self.client.get(self.classes_url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        SlotChange.objects.update(changed_at=timezone.now() - timedelta(days=1))
+        last_modified = self.client.get(self.classes_url)['Last-Modified']
+        Classes.objects.filter(pk=self.future_class.pk).update(date_time=timezone.now())
+        response = self.client.get(self.classes_url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], [])
+
+    def test_booking_list_not_modified_until_cancel(self):
+        """Test the booking list validator follows the user's bookings"""
+        booking = Booking.objects.create(user=self.regular_user, fitness_class=self.future_class, status='CONFIRMED')
+        self.authenticate_user(self.regular_user)
+        etag = self.client.get(self.bookings_url)['ETag']
+
+        response = self.client.get(self.bookings_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # The schedule version moves once the cancellation commits
+        with self.settings(BOOKING_ENGINE='conditional'), self.captureOnCommitCallbacks(execute=True):
+            booking.cancel()
+        response = self.client.get(self.bookings_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_booking_list_follows_admin_edits(self):
+        """Test booking and user edits made in the admin dashboard change the booking list ETag"""
+        booking = Booking.objects.create(user=self.regular_user, fitness_class=self.future_class, status='CONFIRMED')
+        admin_client = Client()
+        admin_client.force_login(User.objects.create_superuser('root', 'root@test.com', 'rootpass123'))
+        self.authenticate_user(self.regular_user)
+        etag = self.client.get(self.bookings_url)['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            admin_client.post(reverse('admin:booking_api_booking_change', args=[booking.pk]), {
+                'user': self.regular_user.pk, 'fitness_class': self.future_class.pk, 'status': 'CANCELLED',
+            })
+        self.assertEqual(Booking.objects.get(pk=booking.pk).status, 'CANCELLED')
+        response = self.client.get(self.bookings_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        etag = response['ETag']
+        joined = timezone.localtime(self.regular_user.date_joined)
+        with self.captureOnCommitCallbacks(execute=True):
+            admin_client.post(reverse('admin:auth_user_change', args=[self.regular_user.pk]), {
+                'username': self.regular_user.username, 'email': 'renamed@test.com', 'is_active': 'on',
+                'date_joined_0': joined.strftime('%Y-%m-%d'), 'date_joined_1': joined.strftime('%H:%M:%S'),
+            })
+        self.regular_user.refresh_from_db()
+        self.assertEqual(self.regular_user.email, 'renamed@test.com')
+        response = self.client.get(self.bookings_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        etag = response['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            admin_client.post(reverse('admin:booking_api_booking_delete', args=[booking.pk]), {'post': 'yes'})
+        self.assertFalse(Booking.objects.exists())
+        self.assertEqual(self.client.get(self.bookings_url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+    def test_booking_list_validator_reads_no_bookings(self):
+        """Test the booking list ETag comes from counters, not an aggregate over the bookings"""
+        hold = Booking.objects.create(
+            user=self.regular_user, fitness_class=self.future_class, status='HELD', expires_at=timezone.now() + timedelta(minutes=5)
+        )
+        self.authenticate_user(self.regular_user)
+        response = self.client.get(self.bookings_url)
+        self.assertNotIn('Last-Modified', response)
+        etag = response['ETag']
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.bookings_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertFalse([query for query in context.captured_queries if 'booking_api_booking' in query['sql']])
+        self.assertNotEqual(self.client.get(self.bookings_url, {'page_size': 1})['ETag'], etag)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            hold.confirm()
+        response = self.client.get(self.bookings_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # Another user's booking changes the slots of the embedded class
+        etag = response['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Booking.objects.create(user=self.regular_user2, fitness_class=self.future_class, status='CONFIRMED')
+            Classes.claim_slot(self.future_class.pk)
+            bump_schedule_version()
+        self.assertEqual(self.client.get(self.bookings_url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+        # A class starting flips is_available of the embedded class
+        etag = self.client.get(self.bookings_url)['ETag']
+        Classes.objects.filter(pk=self.future_class.pk).update(date_time=timezone.now())
+        self.assertEqual(self.client.get(self.bookings_url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+    def test_cached_class_list_not_modified(self):
+        """Test a cached page answers If-None-Match without touching the database"""
+        with self.settings(CLASS_LIST_CACHE={'ENABLED': True}):
+            etag = self.client.get(self.classes_url)['ETag']
+            with self.assertNumQueries(0):
+                response = self.client.get(self.classes_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+
+class ORJSONRendererTestCase(FitnessAPITestCase):
+    """Test the orjson renderer and parser match DRF's stdlib json ones"""
+
+    def test_same_bytes_as_json_renderer(self):
+        """Test datetimes, Decimals, UUIDs, lazy strings and JS line breaks render identically"""
+        data = {
+            'utc': datetime(2024, 1, 15, 6, 30, tzinfo=dt_timezone.utc),
+            'local': timezone.localtime(timezone.now()),
+            'price': Decimal('12.50'),
+            'uuid': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+            'label': gettext_lazy('Booking'),
+            'text': 'caf\u00e9 \u2028 line',
+            1: [None, True, 1.5],
+        }
+
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_fallbacks(self):
+        """Test indented output and a missing orjson use the stdlib renderer"""
+        data = {'id': 1}
+        indented = ORJSONRenderer().render(data, 'application/json; indent=4')
+        self.assertEqual(indented, JSONRenderer().render(data, 'application/json; indent=4'))
+
+        with mock.patch('booking_api.renderers.orjson', None):
+            self.assertEqual(ORJSONRenderer().render(data), b'{"id":1}')
+
+    def test_json_requests(self):
+        """Test JSON bodies are parsed and malformed ones rejected"""
+        self.authenticate_user(self.regular_user)
+        url = reverse('booking-create')
+
+        response = self.client.post(url, {'fitness_class_id': self.future_class.id}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.client.post(url, '{"fitness_class_id": ', content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def load_production_settings(self, secret_key=None):
+        """ Import settings_production afresh with DJANGO_SECRET_KEY set to `secret_key`, or unset """
+        environ = {name: value for name, value in os.environ.items() if name != 'DJANGO_SECRET_KEY'}
+        if secret_key:
+            environ['DJANGO_SECRET_KEY'] = secret_key
+        sys.modules.pop('fitnessAPI.settings_production', None)
+        with mock.patch.dict(os.environ, environ, clear=True):
+            return importlib.import_module('fitnessAPI.settings_production')
+
+    def test_production_profile_is_json_only(self):
+        """Test settings_production drops the browsable API"""
+        settings_production = self.load_production_settings('production-secret')
+
+        self.assertEqual(settings_production.SECRET_KEY, 'production-secret')
+        self.assertFalse(settings_production.DEBUG)
+        self.assertEqual(settings_production.REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'], ['booking_api.renderers.ORJSONRenderer'])
+        self.assertEqual(settings_production.REST_FRAMEWORK['DEFAULT_PARSER_CLASSES'], ['booking_api.renderers.ORJSONParser'])
+        self.assertEqual(
+            settings_production.REST_FRAMEWORK['DEFAULT_AUTHENTICATION_CLASSES'],
+            ['booking_api.authentication.TimezoneJWTAuthentication']
+        )
+
+    def test_production_profile_requires_secret_key(self):
+        """Test settings_production refuses to fall back to the development secret key"""
+        with self.assertRaises(ImproperlyConfigured):
+            self.load_production_settings()
+
+
+class BookingExportTestCase(FitnessAPITestCase):
+    """Test the streaming NDJSON / CSV booking export"""
+
+    def setUp(self):
+        super().setUp()
+        self.url = reverse('booking-export')
+        Booking.objects.create(user=self.regular_user, fitness_class=self.future_class, status='CONFIRMED')
+        Booking.objects.create(user=self.regular_user2, fitness_class=self.future_class, status='CANCELLED', cancelled_at=timezone.now())
+        Booking.objects.create(user=self.regular_user2, fitness_class=self.past_class, status='CONFIRMED')
+        self.authenticate_user(self.admin_user)
+
+    def export(self, params=None, **extra):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.url, params, **extra)
+            self.assertTrue(response.streaming)
+            content = b''.join(response.streaming_content).decode()
+        booking_queries = [query for query in context.captured_queries if 'booking_api_booking' in query['sql']]
+        self.assertEqual(len(booking_queries), 1)
+        return response, content
+
+    def test_ndjson_export(self):
+        """Test one JSON object per booking, NDJSON being the default"""
+        response, content = self.export()
+
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([row['id'] for row in rows], list(Booking.objects.order_by('id').values_list('id', flat=True)))
+        self.assertEqual(rows[0]['user__email'], 'user1@test.com')
+        self.assertTrue(rows[1]['cancelled_at'].endswith('Z'))
+
+    def test_csv_export_with_filters(self):
+        """Test the CSV export honours the email and status filters"""
+        response, content = self.export({'format': 'csv', 'email': 'user2@test.com', 'status': 'confirmed'})
+
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('bookings.csv', response['Content-Disposition'])
+        rows = list(csv.reader(StringIO(content)))
+        self.assertEqual(rows[0][:3], ['id', 'user_id', 'user__username'])
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[1][2], 'user2')
+        self.assertEqual(rows[1][-1], '')
+
+    def test_accept_header_picks_format(self):
+        """Test Accept: text/csv works without ?format="""
+        response, content = self.export(HTTP_ACCEPT='text/csv')
+
+        self.assertTrue(content.startswith('id,user_id'))
+
+    def test_errors(self):
+        """Test non-admins and unknown formats get JSON errors"""
+        response = self.client.get(self.url, {'format': 'xml'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        self.authenticate_user(self.regular_user)
+        response = self.client.get(self.url, {'format': 'csv'})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertIn('detail', response.json())
+
+
+# SQLite commits in id order, without the re-read window the deltas are exact
+@override_settings(SLOT_CHANGE_REREAD_WINDOW=0)
+class AvailabilityFeedTestCase(FitnessAPITestCase):
+    """Test the compact availability feed and its delta sync"""
+
+    def setUp(self):
+        super().setUp()
+        self.url = reverse('class-availability')
+        # As if the classes had been created through the API
+        SlotChange.record(self.future_class.pk, self.past_class.pk, self.full_class.pk)
+
+    def feed(self, since=None):
+        response = self.client.get(self.url, {'since': since} if since is not None else None)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json()
+
+    def book(self, user, fitness_class):
+        self.authenticate_user(user)
+        response = self.client.post(reverse('booking-create'), {'fitness_class_id': fitness_class.id})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data['id']
+
+    def test_full_snapshot(self):
+        """Test the feed maps every upcoming class to its free slots"""
+        data = self.feed()
+
+        self.assertTrue(data['full'])
+        self.assertEqual(data['classes'], {str(self.future_class.id): 10, str(self.full_class.id): 0})
+        self.assertEqual(data['seq'], SlotChange.latest_seq())
+
+    def test_delta_after_booking_and_cancel(self):
+        """Test bookings and cancellations under both engines show up in the delta"""
+        seq = self.feed()['seq']
+        for engine in ['locking', 'conditional']:
+            with self.settings(BOOKING_ENGINE=engine):
+                booking_id = self.book(self.regular_user, self.future_class)
+                data = self.feed(seq)
+                self.assertFalse(data['full'])
+                self.assertEqual(data['classes'], {str(self.future_class.id): 9})
+                self.assertGreater(data['seq'], seq)
+                seq = data['seq']
+
+                self.client.post(reverse('booking-cancel', kwargs={'pk': booking_id}))
+                data = self.feed(seq)
+                self.assertEqual(data['classes'], {str(self.future_class.id): 10})
+                seq = data['seq']
+
+        self.assertEqual(self.feed(seq)['classes'], {})
+
+    def test_late_commit_below_since_is_reread(self):
+        """Test an entry that becomes visible below an already read seq is still sent within the window"""
+        other = Classes.objects.create(
+            name='Late Spin', class_type='HIIT', instructor='Pat', duration_minutes=30,
+            date_time=timezone.now() + timedelta(days=2), total_slots=4
+        )
+        SlotChange.record(other.pk)
+        late_id, late_changed_at = SlotChange.objects.values_list('id', 'changed_at').latest('id')
+        SlotChange.objects.filter(id=late_id).delete()
+        SlotChange.record(self.future_class.pk)
+        seq = self.feed()['seq']
+        # The transaction holding the lower id commits only now
+        SlotChange.objects.create(id=late_id, fitness_class_id=other.pk)
+        SlotChange.objects.filter(id=late_id).update(changed_at=late_changed_at)
+
+        self.assertNotIn(str(other.id), self.feed(seq)['classes'])
+        with self.settings(SLOT_CHANGE_REREAD_WINDOW=10):
+            self.assertEqual(self.feed(seq)['classes'][str(other.id)], 4)
+
+    def test_change_log_rolls_back_with_the_booking(self):
+        """Test a failed booking leaves no change behind"""
+        seq = self.feed()['seq']
+        self.authenticate_user(self.regular_user)
+        with self.settings(BOOKING_ENGINE='conditional'):
+            self.book(self.regular_user, self.future_class)
+            seq = self.feed(seq)['seq']
+            response = self.client.post(reverse('booking-create'), {'fitness_class_id': self.future_class.id})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(SlotChange.latest_seq(), seq)
+
+    def test_delta_covers_removed_and_started_classes(self):
+        """Test deleted and started classes come back as null"""
+        seq = self.feed()['seq']
+        self.authenticate_user(self.admin_user)
+        self.client.delete(reverse('class-detail', kwargs={'pk': self.full_class.id}))
+        Classes.objects.filter(pk=self.future_class.pk).update(date_time=timezone.now())
+
+        data = self.feed(seq)
+        self.assertEqual(data['classes'], {str(self.future_class.id): None, str(self.full_class.id): None})
+
+    def test_batch_holds_and_class_cancel_are_logged(self):
+        """Test batch bookings, expired holds and cancelled classes are logged"""
+        other = Classes.objects.create(
+            name='Spin', class_type='HIIT', instructor='Ann', duration_minutes=30,
+            date_time=timezone.now() + timedelta(days=2), total_slots=5
+        )
+        seq = self.feed()['seq']
+        self.authenticate_user(self.regular_user)
+        self.client.post(reverse('booking-batch-create'), {'fitness_class_ids': [self.future_class.id, other.id]}, format='json')
+        data = self.feed(seq)
+        self.assertEqual(data['classes'], {str(self.future_class.id): 9, str(other.id): 4})
+
+        Booking.objects.create(
+            user=self.regular_user2, fitness_class=other, status='HELD', expires_at=timezone.now() - timedelta(minutes=1)
+        )
+        Classes.objects.filter(pk=other.pk).update(available_slots=3)
+        Booking.release_expired_holds()
+        data = self.feed(data['seq'])
+        self.assertEqual(data['classes'], {str(other.id): 4})
+
+        self.future_class.cancel_all_bookings()
+        self.assertEqual(self.feed(data['seq'])['classes'], {str(self.future_class.id): None})
+
+    def test_unknown_since_gets_full_snapshot(self):
+        """Test malformed, unknown and pruned sequence numbers get a full snapshot"""
+        self.book(self.regular_user, self.future_class)
+        seq = self.feed()['seq']
+        self.book(self.regular_user2, self.future_class)
+
+        self.assertTrue(self.feed('abc')['full'])
+        self.assertTrue(self.feed(seq + 100)['full'])
+
+        SlotChange.objects.update(changed_at=timezone.now() - timedelta(days=2))
+        call_command('prune_slot_changes', stdout=StringIO())
+        self.assertEqual(SlotChange.objects.count(), 1)
+        data = self.feed(seq)
+        self.assertTrue(data['full'])
+        self.assertEqual(data['classes'][str(self.future_class.id)], 8)
+
+
+class SlotStreamTestCase(FitnessAPITestCase):
+    """Test the Server-Sent Events slot stream"""
+
+    async def open_stream(self, *class_ids):
+        response = await self.async_client.get(reverse('class-stream'), {'classes': ','.join(map(str, class_ids))})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        return response, aiter(response.streaming_content)
+
+    async def next_chunk(self, stream):
+        return await asyncio.wait_for(anext(stream), 5)
+
+    async def next_event(self, stream):
+        event, data = (await self.next_chunk(stream)).decode().strip().split('\n')
+        self.assertEqual(event, 'event: slots')
+        return json.loads(data.removeprefix('data: '))
+
+    async def disconnect(self, stream):
+        # Like the ASGI handler on a client disconnect: cancel the stream while it waits for changes
+        read = asyncio.ensure_future(anext(stream))
+        await asyncio.sleep(0.01)
+        read.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await read
+
+    def book(self, fitness_class):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(Classes.claim_slot(fitness_class.pk, self.regular_user.pk))
+
+    async def test_stream_pushes_committed_changes(self):
+        """Test the stream starts with a snapshot and pushes bookings once they commit"""
+        response, stream = await self.open_stream(self.future_class.id, self.full_class.id)
+        self.assertEqual(await self.next_event(stream), {str(self.future_class.id): 10, str(self.full_class.id): 0})
+
+        await sync_to_async(self.book)(self.future_class)
+        self.assertEqual(await self.next_event(stream), {str(self.future_class.id): 9})
+
+        await sync_to_async(self.future_class.cancel_all_bookings)()
+        self.assertEqual(await self.next_event(stream), {str(self.future_class.id): None})
+        await self.disconnect(stream)
+        self.assertEqual(broker.subscriber_count(), 0)
+
+    @override_settings(SLOT_STREAM={'POLL_INTERVAL': 0.05, 'KEEPALIVE': 0.2})
+    async def test_stream_polls_changes_from_other_processes(self):
+        """Test changes logged without an in-process publish arrive through the poller, idle streams get keepalives"""
+        response, stream = await self.open_stream(self.future_class.id)
+        await self.next_event(stream)
+
+        def book_elsewhere():
+            Classes.objects.filter(pk=self.future_class.pk).update(available_slots=4)
+            SlotChange.objects.create(fitness_class_id=self.future_class.pk)
+        await sync_to_async(book_elsewhere)()
+
+        self.assertEqual(await self.next_event(stream), {str(self.future_class.id): 4})
+        self.assertEqual(await self.next_chunk(stream), b': keepalive\n\n')
+        await self.disconnect(stream)
+
+    def test_stream_errors(self):
+        """Test bad class lists are rejected and WSGI requests get 501"""
+        url = reverse('class-stream')
+        for classes in ['', 'abc', ','.join(str(pk) for pk in range(1, 102))]:
+            response = async_to_sync(self.async_client.get)(url, {'classes': classes})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(url, {'classes': '1'}).status_code, status.HTTP_501_NOT_IMPLEMENTED)
+
+    async def test_asgi_app_serves_stream_without_django(self):
+        """Test SlotStreamApp streams until the client disconnects and passes other paths on"""
+        messages, disconnect = asyncio.Queue(), asyncio.Event()
+        inner = mock.AsyncMock()
+        app = SlotStreamApp(inner)
+
+        async def receive():
+            if not hasattr(receive, 'sent'):
+                receive.sent = True
+                return {'type': 'http.request', 'body': b''}
+            await disconnect.wait()
+            return {'type': 'http.disconnect'}
+
+        def call(path, query):
+            scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': query.encode()}
+            return asyncio.create_task(app(scope, receive, messages.put))
+
+        served = call(reverse('class-stream'), f'classes={self.future_class.id}')
+        start = await asyncio.wait_for(messages.get(), 5)
+        self.assertEqual(start['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream'), start['headers'])
+        body = await asyncio.wait_for(messages.get(), 5)
+        self.assertEqual(body['body'], b'event: slots\ndata: {"%d":10}\n\n' % self.future_class.id)
+
+        disconnect.set()
+        await asyncio.wait_for(served, 5)
+        self.assertEqual(broker.subscriber_count(), 0)
+
+        await call(reverse('class-stream'), 'classes=x')
+        self.assertEqual((await messages.get())['status'], 400)
+        await call(reverse('class-list'), '')
+        inner.assert_awaited_once()
+
+
+class ClassSearchTestCase(FitnessAPITestCase):
+    """Test ?q= full-text search on the class list"""
+
+    def setUp(self):
+        super().setUp()
+        self.url = reverse('class-list')
+        start = timezone.now() + timedelta(days=3)
+        self.power_yoga = Classes.objects.create(
+            name='Power Yoga', class_type='YOGA', instructor='Bob Stone', duration_minutes=45, date_time=start, total_slots=8
+        )
+        self.stretch = Classes.objects.create(
+            name='Stretch', class_type='YOGA', instructor='Yolanda Reyes', duration_minutes=45,
+            date_time=start - timedelta(hours=1), total_slots=8
+        )
+
+    def search(self, q, **params):
+        response = self.client.get(self.url, {'q': q, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response
+
+    def result_ids(self, q):
+        return [row['id'] for row in self.search(q).data['results']]
+
+    def test_prefix_search_ranked(self):
+        """Test word prefixes match names and instructors, name matches rank first"""
+        ids = self.result_ids('yo')
+
+        self.assertCountEqual(ids, [self.future_class.id, self.power_yoga.id, self.stretch.id])
+        self.assertEqual(ids[-1], self.stretch.id)
+        self.assertEqual(self.result_ids('morn YOG'), [self.future_class.id])
+        self.assertEqual(self.result_ids('bob st'), [self.power_yoga.id])
+        self.assertEqual(self.result_ids('oga'), [])
+        self.assertEqual(self.result_ids('"*)'), [])
+
+    def test_index_follows_writes(self):
+        """Test renames, bulk updates and deletes are reflected by the index"""
+        self.authenticate_user(self.admin_user)
+        self.client.patch(reverse('class-detail', kwargs={'pk': self.stretch.id}), {'name': 'Sunset Pilates'})
+        Classes.objects.filter(pk=self.power_yoga.pk).update(instructor='Nina Pilatos')
+        self.future_class.delete()
+
+        self.assertCountEqual(self.result_ids('pila'), [self.stretch.id, self.power_yoga.id])
+        self.assertEqual(self.result_ids('yo'), [self.power_yoga.id, self.stretch.id])
+
+    def test_search_pages_and_filters(self):
+        """Test search results page by rank and combine with the other filters"""
+        ids = []
+        response = self.search('yo', page_size=1)
+        while True:
+            ids.extend(row['id'] for row in response.data['results'])
+            if not response.data['next']:
+                break
+            response = self.client.get(response.data['next'])
+        self.assertEqual(ids, self.result_ids('yo'))
+
+        sparse = self.search('yo', fields='id', type='YOGA').data['results']
+        self.assertEqual([row['id'] for row in sparse], ids)
+        self.assertEqual(self.search('yo', type='ZUMBA').data['results'], [])
+
+    @override_settings(CLASS_SEARCH_BACKEND='icontains')
+    def test_icontains_backend(self):
+        """Test the icontains fallback finds the same classes"""
+        self.assertCountEqual(self.result_ids('yo'), [self.future_class.id, self.power_yoga.id, self.stretch.id])
+        self.assertEqual(self.result_ids('morn yog'), [self.future_class.id])
+
+    def test_missing_index_falls_back_to_icontains(self):
+        """Test search uses icontains while the FTS5 index is missing and picks the index up once created"""
+        with mock.patch('booking_api.search.indexed_databases', set()):
+            with connection.cursor() as cursor:
+                cursor.execute(f"DROP TRIGGER {FTS_TABLE}_update")
+            with mock.patch('booking_api.search.FTS_SQL', ['CREATE VIRTUAL TABLE broken_fts USING no_such_module(name)']):
+                create_search_index(sender=None)
+            self.assertFalse(has_search_index('default'))
+            self.assertCountEqual(self.result_ids('oga'), [self.future_class.id, self.power_yoga.id])
+
+            # The missing index was not remembered, so it is used as soon as it exists
+            create_search_index(sender=None)
+            self.assertTrue(has_search_index('default'))
+            self.assertEqual(self.result_ids('ga'), [])
+
+    def test_admin_search(self):
+        """Test the admin class search uses the same matching"""
+        self.client.force_login(User.objects.create_superuser('root', 'root@test.com', 'rootpass123'))
+        response = self.client.get(reverse('admin:booking_api_classes_changelist'), {'q': 'yola'})
+
+        self.assertEqual(list(response.context['cl'].queryset), [self.stretch])
+
+
+class ClassCalendarTestCase(FitnessAPITestCase):
+    """Test the weekly calendar grouped by local day"""
+
+    def setUp(self):
+        super().setUp()
+        self.url = reverse('class-calendar')
+        # Monday of a week that none of the fixture classes fall in
+        today = timezone.localdate() + timedelta(days=14)
+        self.monday = today - timedelta(days=today.weekday())
+        year, week, _ = self.monday.isocalendar()
+        self.week = f'{year}-W{week:02d}'
+        self.morning = self.create_class('Monday Spin', 0, 9, total_slots=10)
+        self.evening = self.create_class('Monday Pilates', 0, 18, total_slots=5)
+        # 20:30 UTC on Monday
+        self.night = self.create_class('Night Run', 1, 2, total_slots=8)
+
+    def create_class(self, name, day, hour, **fields):
+        local = datetime.combine(self.monday + timedelta(days=day), datetime.min.time())
+        return Classes.objects.create(
+            name=name, class_type='YOGA', instructor='Ann Lee', duration_minutes=45,
+            date_time=timezone.make_aware(local + timedelta(hours=hour)), **fields
+        )
+
+    def calendar(self, **extra):
+        response = self.client.get(self.url, {'week': self.week}, **extra)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_days_and_totals(self):
+        """Test classes are bucketed by local day with capacity and free slot totals"""
+        Classes.claim_slot(self.morning.id)
+        data = self.calendar()
+
+        self.assertEqual(data['week'], self.week)
+        self.assertEqual(data['timezone'], 'Asia/Kolkata')
+        self.assertEqual([day['date'] for day in data['days']], [(self.monday + timedelta(days=n)).isoformat() for n in range(7)])
+        monday, tuesday = data['days'][:2]
+        self.assertEqual([row['id'] for row in monday['classes']], [self.morning.id, self.evening.id])
+        self.assertEqual((monday['total_slots'], monday['available_slots']), (15, 14))
+        self.assertEqual(monday['classes'][0]['available_slots'], 9)
+        self.assertEqual([row['id'] for row in tuesday['classes']], [self.night.id])
+        self.assertEqual((tuesday['total_slots'], tuesday['available_slots']), (8, 8))
+        for day in data['days'][2:]:
+            self.assertEqual((day['classes'], day['total_slots'], day['available_slots']), ([], 0, 0))
+
+    def test_timezone_moves_classes_between_days(self):
+        """Test the X-Timezone header decides which day a class belongs to"""
+        data = self.calendar(HTTP_X_TIMEZONE='UTC')
+
+        self.assertEqual(data['timezone'], 'UTC')
+        monday, tuesday = data['days'][:2]
+        self.assertEqual([row['id'] for row in monday['classes']], [self.morning.id, self.evening.id, self.night.id])
+        self.assertEqual(monday['total_slots'], 23)
+        self.assertEqual(tuesday['classes'], [])
+        self.assertTrue(monday['classes'][-1]['date_time'].endswith('Z'))
+
+    def test_started_classes_offer_no_slots(self):
+        """Test started and full classes are not available and add no free slots"""
+        Classes.objects.filter(pk=self.past_class.pk).update(date_time=timezone.now())
+        data = self.client.get(self.url).data
+
+        rows = {row['id']: (row, day) for day in data['days'] for row in day['classes']}
+        row, day = rows[self.past_class.id]
+        self.assertFalse(row['is_available'])
+        self.assertEqual(day['available_slots'], sum(r['available_slots'] for r in day['classes'] if r['is_available']))
+        if self.full_class.id in rows:
+            self.assertFalse(rows[self.full_class.id][0]['is_available'])
+
+    def test_default_and_invalid_week(self):
+        """Test the current week is the default and malformed weeks are rejected"""
+        year, week, _ = timezone.localdate().isocalendar()
+        self.assertEqual(self.client.get(self.url).data['week'], f'{year}-W{week:02d}')
+
+        for week in ['2025-27', '2025-W54', '2025-W00', 'W27', '2025-W27x', '9999-W52', '0001-W01']:
+            with self.subTest(week=week):
+                response = self.client.get(self.url, {'week': week})
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+                self.assertIn('week', response.data)
+
+    def test_one_query_then_cached(self):
+        """Test the calendar is one query, cached until the schedule changes"""
+        with self.assertNumQueries(1):
+            first = self.calendar()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.calendar(), first)
+        self.assertNotEqual(self.calendar(HTTP_X_TIMEZONE='UTC'), first)
+
+        self.authenticate_user(self.regular_user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('booking-create'), {'fitness_class_id': self.morning.id})
+        self.assertEqual(self.calendar()['days'][0]['available_slots'], 14)
+
+
+class TimezoneTestCase(FitnessAPITestCase):
+    """Test the X-Timezone header, the zone caches and stored timezone preferences"""
+
+    def setUp(self):
+        super().setUp()
+        zone_cache.clear()
+        self.url = reverse('class-list')
+        self.preferences = reverse('user-preferences')
+
+    def class_time(self, **extra):
+        response = self.client.get(self.url, {'fields': 'id,date_time'}, **extra)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return next(item['date_time'] for item in response.data['results'] if item['id'] == self.future_class.id)
+
+    def test_invalid_header_falls_back_and_logs_sampled(self):
+        """Test an invalid zone uses TIME_ZONE, is looked up once and logged one in LOG_EVERY times"""
+        default = self.class_time()
+        self.assertNotEqual(self.class_time(HTTP_X_TIMEZONE='UTC'), default)
+
+        with mock.patch('booking_api.middleware.invalid_count', itertools.count()), \
+                mock.patch('booking_api.middleware.ZoneInfo', wraps=ZoneInfo) as lookup, \
+                override_settings(TIMEZONE_MIDDLEWARE={'LOG_EVERY': 2}), \
+                self.assertLogs('booking_api', 'WARNING') as logs:
+            for _ in range(3):
+                self.assertEqual(self.class_time(HTTP_X_TIMEZONE='Mars/Olympus'), default)
+        self.assertEqual(lookup.call_count, 1)
+        self.assertEqual(len([line for line in logs.output if 'Mars/Olympus' in line]), 2)
+
+    @override_settings(TIMEZONE_MIDDLEWARE={'CACHE_SIZE': 2, 'INVALID_CACHE_SIZE': 2})
+    def test_zone_caches_are_bounded(self):
+        """Test both caches keep only the most recently used names"""
+        for name in ['UTC', 'Europe/Berlin', 'UTC', 'Asia/Tokyo', 'Bad/One', 'Bad/Two', 'Bad/Three']:
+            zone_cache.get(name)
+
+        self.assertEqual(list(zone_cache.zones), ['UTC', 'Asia/Tokyo'])
+        self.assertEqual(list(zone_cache.invalid), ['Bad/Two', 'Bad/Three'])
+        self.assertIsNone(zone_cache.get('x' * 200))
+        self.assertEqual(len(zone_cache.invalid), 2)
+
+    def test_stored_preference(self):
+        """Test a stored timezone applies without a header and the header still wins"""
+        utc = self.class_time(HTTP_X_TIMEZONE='UTC')
+        kolkata = self.class_time(HTTP_X_TIMEZONE='Asia/Kolkata')
+        self.authenticate_user(self.regular_user)
+        self.assertEqual(self.client.get(self.preferences).data, {'timezone': ''})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(self.preferences, {'timezone': 'UTC'})
+        self.assertEqual(response.data, {'timezone': 'UTC'})
+        self.assertEqual(self.class_time(), utc)
+        self.assertEqual(self.class_time(HTTP_X_TIMEZONE='Asia/Kolkata'), kolkata)
+
+        response = self.client.patch(self.preferences, {'timezone': 'Mars/Olympus'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(self.preferences, {'timezone': ''})
+        self.assertEqual(self.class_time(), kolkata)
+
+    def test_stored_preference_is_cached(self):
+        """Test the preference is read once, and again after it is saved"""
+        UserPreference.objects.create(user=self.regular_user, timezone='UTC')
+        self.authenticate_user(self.regular_user)
+        self.class_time()
+
+        with CaptureQueriesContext(connection) as context:
+            self.class_time(type='YOGA')
+        self.assertFalse([query for query in context.captured_queries if 'booking_api_userpreference' in query['sql']])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(self.preferences, {'timezone': 'Asia/Kolkata'})
+        self.assertEqual(self.class_time(), self.class_time(HTTP_X_TIMEZONE='Asia/Kolkata'))
+
+    def test_preferences_need_authentication(self):
+        """Test anonymous clients cannot read or store preferences"""
+        self.assertEqual(self.client.get(self.preferences).status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class QueryPlanTestCase(FitnessAPITestCase):
+    """Test the hot endpoint queries are served by indexes on a large dataset"""
+
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        types = [choice for choice, _ in Classes.CHOICES_CLASS]
+        Classes.objects.bulk_create([
+            Classes(
+                name=f'Seeded {i}',
+                class_type=types[i % len(types)],
+                instructor=f'Instructor {i % 40}',
+                duration_minutes=45,
+                date_time=now + timedelta(hours=i - 500),
+                total_slots=30,
+                available_slots=30
+            )
+            for i in range(2000)
+        ])
+        users = [User(username=f'seeded{i}', email=f'seeded{i}@test.com') for i in range(200)]
+        User.objects.bulk_create(users)
+        class_ids = list(Classes.objects.values_list('id', flat=True))
+        user_ids = list(User.objects.filter(username__startswith='seeded').values_list('id', flat=True))
+        Booking.objects.bulk_create([
+            Booking(
+                user_id=user_id,
+                fitness_class_id=class_ids[(n * 37 + k * 41) % len(class_ids)],
+                status='CONFIRMED' if k % 3 else 'CANCELLED'
+            )
+            for n, user_id in enumerate(user_ids)
+            for k in range(50)
+        ])
+        cls.seeded_user = User.objects.get(username='seeded7')
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def full_scans(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+            plan = [row[-1] for row in cursor.fetchall()]
+        # "SCAN <table>" without an index is a full table scan, index walks and searches are fine,
+        # so are full-text lookups ("SCAN <fts table> VIRTUAL TABLE INDEX 0:M...") and window function
+        # results ("SCAN (subquery-N)"), which only hold the rows already found
+        return [
+            line for line in plan
+            if re.match(r'SCAN (?!CONSTANT ROW|\()', line) and 'USING' not in line and 'VIRTUAL TABLE' not in line
+        ]
+
+    def assert_no_full_scans(self, method, url, data=None, **extra):
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(self.client, method)(url, data, **extra)
+        self.assertLess(response.status_code, 500)
+        for query in context.captured_queries:
+            sql = query['sql']
+            if not sql.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+                continue
+            self.assertEqual(self.full_scans(sql), [], f"Full table scan in: {sql}")
+        return response
+
+    def test_class_list_queries(self):
+        """Test the class list, its filters and deep pages use indexes"""
+        url = reverse('class-list')
+        first = self.assert_no_full_scans('get', url, {'page_size': 20})
+        self.assert_no_full_scans('get', first.data['next'])
+        self.assert_no_full_scans('get', url, {'type': 'HIIT'})
+        self.assert_no_full_scans('get', url, {'date': timezone.localdate().isoformat()})
+        self.assert_no_full_scans('get', url, {'q': 'instructor 7'})
+
+    def test_available_filter_uses_partial_index(self):
+        """Test ?available=true is served by the partial index of classes with free slots"""
+        Classes.objects.filter(pk__in=Classes.objects.order_by('id').values_list('id', flat=True)[::2]).update(available_slots=0)
+        with CaptureQueriesContext(connection) as context:
+            response = self.assert_no_full_scans('get', reverse('class-list'), {'available': 'true'})
+        self.assertTrue(response.data['results'])
+        self.assertTrue(all(item['is_available'] for item in response.data['results']))
+        # The page query, the other one is the ETag validator
+        sql = next(query['sql'] for query in context.captured_queries if query['sql'].startswith('SELECT') and 'LIMIT' in query['sql'])
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+            self.assertIn('class_available_idx', ' '.join(row[-1] for row in cursor.fetchall()))
+
+    def test_class_calendar_queries(self):
+        """Test the weekly calendar uses the date index"""
+        self.assertTrue(any(day['classes'] for day in self.assert_no_full_scans('get', reverse('class-calendar')).data['days']))
+
+    @override_settings(SLOT_CHANGE_REREAD_WINDOW=0)
+    def test_availability_feed_queries(self):
+        """Test the availability snapshot and delta use indexes"""
+        url = reverse('class-availability')
+        SlotChange.record(*Classes.objects.values_list('id', flat=True)[:50])
+        seq = self.assert_no_full_scans('get', url).data['seq']
+        SlotChange.record(*Classes.objects.values_list('id', flat=True)[100:110])
+        self.assertEqual(len(self.assert_no_full_scans('get', url, {'since': seq}).data['classes']), 10)
+
+    def test_booking_list_queries(self):
+        """Test user and admin booking listings use indexes"""
+        url = reverse('booking-list')
+        self.authenticate_user(self.seeded_user)
+        self.assert_no_full_scans('get', url)
+
+        self.authenticate_user(self.admin_user)
+        self.assert_no_full_scans('get', url, {'email': self.seeded_user.email})
+        self.assert_no_full_scans('get', url, {'email': self.seeded_user.email, 'status': 'confirmed'})
+
+    def test_booking_write_queries(self):
+        """Test booking and cancelling use indexes under both engines"""
+        upcoming = Classes.objects.filter(date_time__gt=timezone.now()).order_by('id')
+        self.authenticate_user(self.regular_user)
+        for engine, fitness_class in zip(['locking', 'conditional'], upcoming[:2]):
+            with self.settings(BOOKING_ENGINE=engine):
+                response = self.assert_no_full_scans('post', reverse('booking-create'), {'fitness_class_id': fitness_class.id})
+                self.assert_no_full_scans('post', reverse('booking-cancel', kwargs={'pk': response.data['id']}))
+
+    def test_statistics_queries(self):
+        """Test the statistics endpoints use indexes"""
+        self.authenticate_user(self.seeded_user)
+        self.assert_no_full_scans('get', reverse('user-statistics'))
+        self.authenticate_user(self.admin_user)
+        self.assert_no_full_scans('get', reverse('statistics'))
+
+
+class StatisticsTestCase(FitnessAPITestCase):
+    """Test statistics endpoints"""
+    
+    def setUp(self):
+        super().setUp()
+        
+        # Create some test data for statistics
+        recent_time = timezone.now() - timedelta(days=15)
+        old_time = timezone.now() - timedelta(days=45)
+        
+        self.recent_class = Classes.objects.create(
+            name='Recent Class',
+            class_type='YOGA',
+            instructor='Test Instructor',
+            duration_minutes=60,
+            date_time=recent_time,
+            total_slots=10
+        )
+        
+        self.old_class = Classes.objects.create(
+            name='Old Class',
+            class_type='ZUMBA',
+            instructor='Test Instructor',
+            duration_minutes=45,
+            date_time=old_time,
+            total_slots=10
+        )
+        
+        # Create bookings
+        Booking.objects.create(
+            user=self.regular_user,
+            fitness_class=self.recent_class,
+            status='CONFIRMED'
+        )
+        Booking.objects.create(
+            user=self.regular_user2,
+            fitness_class=self.recent_class,
+            status='CANCELLED'
+        )
+        Booking.objects.create(
+            user=self.regular_user,
+            fitness_class=self.old_class,
+            status='CONFIRMED'
+        )
+    
+    def test_admin_statistics(self):
+        """Test admin statistics endpoint"""
+        self.authenticate_user(self.admin_user)
+        url = reverse('statistics')
+        
+        response = self.client.get(url)
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        
+        expected_keys = [
+            'total_classes',
+            'total_booking',
+            'confirmed_bookings',
+            'cancelled_bookings',
+            'popular_classes'
+        ]
+        
+        for key in expected_keys:
+            self.assertIn(key, response.data)
+        
+        # Should only include recent data (last 30 days)
+        self.assertGreaterEqual(response.data['total_classes'], 1)
+        self.assertIsInstance(response.data['popular_classes'], list)
+    
+    def test_admin_statistics_unauthorized(self):
+        """Test admin statistics as regular user"""
+        self.authenticate_user(self.regular_user)
+        url = reverse('statistics')
+        
+        response = self.client.get(url)
+        
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+    
+    def test_user_statistics(self):
+        """Test user statistics endpoint"""
+        # Create a future booking for upcoming classes count
+        future_booking = Booking.objects.create(
+            user=self.regular_user,
+            fitness_class=self.future_class,
+            status='CONFIRMED'
+        )
+        
+        self.authenticate_user(self.regular_user)
+        url = reverse('user-statistics')
+        
+        response = self.client.get(url)
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        
+        expected_keys = [
+            'user',
+            'bookings',
+            'cancelled_bookings',
+            'upcoming_classes',
+            'upcoming_classes_details'
+        ]
+        
+        for key in expected_keys:
+            self.assertIn(key, response.data)
+        
+        # Verify user data
+        self.assertEqual(response.data['user']['email'], self.regular_user.email)
+        self.assertGreaterEqual(response.data['bookings'], 1)
+        self.assertGreaterEqual(response.data['upcoming_classes'], 1)
+        self.assertIsInstance(response.data['upcoming_classes_details'], list)
+    
+    def test_user_statistics_unauthenticated(self):
+        """Test user statistics without authentication"""
+        url = reverse('user-statistics')
+        
+        response = self.client.get(url)
+        
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
 
 
 class EdgeCaseTestCase(FitnessAPITestCase):
@@ -619,8 +2742,8 @@ class EdgeCaseTestCase(FitnessAPITestCase):
         
         response = self.client.get(url, {'date': 'invalid-date'})
         
-        # Should not crash, just ignore invalid date
-        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # Should not crash, the invalid date is reported instead of ignored
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
     
     def test_invalid_class_type_filter(self):
         """Test class list with invalid class type"""
@@ -630,7 +2753,7 @@ class EdgeCaseTestCase(FitnessAPITestCase):
         response = self.client.get(url, {'type': 'INVALID_TYPE'})
         
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 0)
+        self.assertEqual(len(response.data['results']), 0)
     
     def test_create_class_with_zero_slots(self):
         """Test creating class with zero total slots"""
@@ -7,16 +7,27 @@ urlpatterns = [
     path('auth/register/', views.UserCreateView.as_view(), name='user-create'),
     path('auth/login/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('auth/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('auth/preferences/', views.UserPreferenceView.as_view(), name='user-preferences'),
 
     # Classes
     path('classes/', views.ClassListView.as_view(), name='class-list'),
+    path('classes/calendar/', views.ClassCalendarView.as_view(), name='class-calendar'),
+    path('classes/availability/', views.ClassAvailabilityView.as_view(), name='class-availability'),
+    path('classes/stream/', views.ClassSlotStreamView.as_view(), name='class-stream'),
     path('classes/create/', views.ClassCreateView.as_view(), name='class-create'),
     path('classes/<int:pk>/update/', views.ClassUpdateDeleteView.as_view(), name='class-detail'),
+    path('classes/<int:pk>/cancel/', views.ClassCancelView.as_view(), name='class-cancel'),
+    path('classes/<int:pk>/waitlist/', views.ClassWaitlistView.as_view(), name='class-waitlist'),
 
     # Booking
     path('book/', views.BookingCreateView.as_view(), name='booking-create'),
+    path('book/hold/', views.BookingHoldCreateView.as_view(), name='booking-hold'),
+    path('book/batch/', views.BookingBatchCreateView.as_view(), name='booking-batch-create'),
+    path('book/tickets/<int:pk>/', views.BookingTicketView.as_view(), name='booking-ticket'),
     path('bookings/', views.BookingListView.as_view(), name='booking-list'),
+    path('bookings/export/', views.BookingExportView.as_view(), name='booking-export'),
     path('bookings/<int:pk>/cancel/', views.BookingCancelView.as_view(), name='booking-cancel'),
+    path('bookings/<int:pk>/confirm/', views.BookingConfirmView.as_view(), name='booking-confirm'),
 
     # Statistics
     path('stats/', views.StatisticsView.as_view(), name='statistics'),
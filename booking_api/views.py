@@ -1,19 +1,47 @@
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
 from django.utils import timezone
+from django.views import View
 
 from rest_framework import status, generics
+from rest_framework.exceptions import ValidationError
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAdminUser, AllowAny
 from rest_framework.response import Response
+from rest_framework.serializers import BaseSerializer, DateTimeField
 
-from .models import Classes, Booking, User
-from .serializers import UserSerializer, ClassesSerializer, BookingSerializer
+from .models import Classes, Booking, User, Waitlist, BookingTicket, SlotChange, UserPreference
+from .serializers import (
+    UserSerializer, UserPreferenceSerializer, ClassesSerializer, BookingSerializer, BatchBookingSerializer,
+    WaitlistSerializer, BookingTicketSerializer, model_columns
+)
 from .permissions import IsAdminOrOwner
+from .idempotency import idempotent
+from .pagination import KeysetPagination
+from .fast_serializers import FastSerializer, UnsupportedField
+from .renderers import CSVRenderer, NDJSONRenderer, ORJSONRenderer
+from .live import STREAM_HEADERS, open_stream, parse_class_ids
+from .response_cache import (
+    bump_schedule_version, calendar_cache_key, class_list_cache_key, class_list_cache_setting, get_cache,
+    get_schedule_version,
+)
 
-from django.db.models import Count, Q 
-from datetime import date as date_class
+from django.db.models import Case, Count, F, Max, Q, Subquery, Sum, Value, When, Window
+from django.db.models.functions import TruncDate
+from datetime import date as date_class, datetime, time as datetime_time, timedelta, timezone as dt_timezone
+from functools import partial
+from urllib.parse import urlencode
+from zoneinfo import ZoneInfo
 
+import hashlib
 import logging
+import re
 
 logger = logging.getLogger('booking_api')
 
@@ -27,29 +55,382 @@ class UserCreateView(generics.CreateAPIView):
         logger.info(f"New user registration: {serializer.validated_data['username']}")
         return super().perform_create(serializer)
 
-class ClassListView(generics.ListAPIView):
+class UserPreferenceView(generics.RetrieveUpdateAPIView):
+    """ Read and update the user's preferences [GET, PATCH /auth/preferences/] """
+    serializer_class = UserPreferenceSerializer
+
+    def get_object(self):
+        return UserPreference.objects.get_or_create(user=self.request.user)[0]
+
+class ConditionalListMixin:
+    """
+    Answer If-None-Match / If-Modified-Since on a list with 304 before anything is serialized.
+    By default the validator is one aggregate query over the filtered rows: their count plus MAX()
+    of every field in validator_fields. That reads every filtered row, so views without a response
+    cache in front override get_validators() with something cheaper.
+    """
+    validator_fields = ('updated_at',)
+
+    def validator_aggregates(self):
+        aggregates = {'count': Count('id', distinct=True)}
+        for field in self.validator_fields:
+            aggregates[field] = Max(field)
+        return aggregates
+
+    def last_modified_aggregates(self):
+        """ Extra timestamps that only move Last-Modified, not the ETag """
+        return {}
+
+    def get_validators(self):
+        """ Return (ETag, Last-Modified timestamp or None) of the filtered list """
+        extra = self.last_modified_aggregates()
+        values = self.filter_queryset(self.get_queryset()).order_by().aggregate(**self.validator_aggregates(), **extra)
+        stamps = [values[name] for name in (*self.validator_fields, *extra) if values[name]]
+        last_modified = int(max(stamps).timestamp()) if stamps else None
+        # Dates render in the client's timezone, so it is part of the representation
+        validators = sorted((name, value) for name, value in values.items() if name not in extra)
+        raw = f"{validators}|{timezone.get_current_timezone_name()}"
+        return quote_etag(hashlib.md5(raw.encode()).hexdigest()), last_modified
+
+    def conditional_response(self, response, etag, last_modified):
+        """ Return a 304 when the client copy is current, otherwise `response` (built lazily if callable) """
+        not_modified = get_conditional_response(self.request, etag=etag, last_modified=last_modified)
+        if not_modified is None:
+            response = response() if callable(response) else response
+        else:
+            response = not_modified
+        response.headers['ETag'] = etag
+        if last_modified is not None:
+            response.headers['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        etag, last_modified = self.get_validators()
+        return self.conditional_response(partial(super().list, request, *args, **kwargs), etag, last_modified)
+
+class SparseFieldsMixin:
+    """
+    ?fields=a,b renders only those fields and ?expand=rel nests a relation (SparseFieldsetMixin),
+    and the query reads only the columns those fields need.
+    """
+    def sparse_params(self):
+        params = []
+        for param in ('fields', 'expand'):
+            names = [name.strip() for name in self.request.query_params.get(param, '').split(',') if name.strip()]
+            params.append(names or None)
+        return params
+
+    def get_serializer(self, *args, **kwargs):
+        fields, expand = self.sparse_params()
+        if fields is not None or expand is not None:
+            kwargs.update(fields=fields, expand=expand)
+        return super().get_serializer(*args, **kwargs)
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        fields, expand = self.sparse_params()
+        if fields is None and expand is None:
+            return queryset
+        serializer = self.get_serializer()
+        relations = [field.source for field in serializer.fields.values() if isinstance(field, BaseSerializer)]
+        # The paginator reads the ordering columns of every row, annotations are always selected
+        ordering = set(getattr(self, 'keyset_ordering', ())) - set(queryset.query.annotations)
+        columns = model_columns(serializer) | ordering
+        queryset = queryset.select_related(None)
+        if relations:
+            queryset = queryset.select_related(*relations)
+        return queryset.only(*columns)
+
+class FastReadMixin:
+    """
+    Serve GET lists from .values() rows through FastSerializer instead of the DRF serializer,
+    falling back to DRF for layouts it does not support or when FAST_READ_SERIALIZERS is off.
+    """
+    def list(self, request, *args, **kwargs):
+        if not getattr(settings, 'FAST_READ_SERIALIZERS', True):
+            return super().list(request, *args, **kwargs)
+        try:
+            fast = FastSerializer(self.get_serializer())
+        except UnsupportedField as e:
+            logger.warning(f"Fast read path unavailable, using the DRF serializer: {e}")
+            return super().list(request, *args, **kwargs)
+
+        # The paginator reads the ordering columns of every row
+        queryset = fast.values(self.filter_queryset(self.get_queryset()), getattr(self, 'keyset_ordering', ()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(fast.to_representation(page))
+        return Response(fast.to_representation(list(queryset)))
+
+class ClassListView(SparseFieldsMixin, ConditionalListMixin, FastReadMixin, generics.ListAPIView):
     """ Return list of all the upcoming classes [GET /classes] """
     serializer_class = ClassesSerializer
     permission_classes = [AllowAny]  # Allow any user to view classes
+    pagination_class = KeysetPagination
+    # Sharded bookings only touch the shard rows
+    validator_fields = ('updated_at', 'slot_shards__updated_at')
+
+    @property
+    def keyset_ordering(self):
+        # Search results come best match first
+        if self.search_text():
+            return ('search_rank', 'id')
+        return ('date_time', 'id')
+
+    def search_text(self):
+        return self.request.query_params.get('q', '').strip()
+
+    def last_modified_aggregates(self):
+        # A class that is deleted or starts leaves the list without moving MAX(updated_at), and only the
+        # ETag sees the count drop. Deletions are in the change log, starts are class date_times.
+        last_change = SlotChange.objects.order_by('-changed_at').values('changed_at')[:1]
+        last_start = Classes.objects.filter(date_time__lte=timezone.now()).order_by('-date_time').values('date_time')[:1]
+        return {'last_change': Max(Subquery(last_change)), 'last_start': Max(Subquery(last_start))}
+
+    def list(self, request, *args, **kwargs):
+        # Serve repeated queries from the versioned response cache, any schedule change invalidates it
+        if not class_list_cache_setting('ENABLED'):
+            return super().list(request, *args, **kwargs)
+        cache = get_cache()
+        key = class_list_cache_key(request)
+        cached = cache.get(key)
+        if cached is None:
+            response = super().list(request, *args, **kwargs)
+            if response.status_code == status.HTTP_200_OK:
+                cached = {
+                    'data': response.data,
+                    'etag': response['ETag'],
+                    'last_modified': parse_http_date_safe(response.get('Last-Modified')),
+                }
+                cache.set(key, cached, class_list_cache_setting('TTL'))
+            return response
+        # A cached page answers conditional requests without touching the database
+        return self.conditional_response(lambda: Response(cached['data']), cached['etag'], cached['last_modified'])
 
     def get_queryset(self):
-        queryset = Classes.objects.filter(date_time__gt=timezone.now())
+        now = timezone.now()
+        queryset = Classes.objects.scheduled().with_availability(now).filter(date_time__gt=now)
+
+        # ?available=true only lists the classes that can still be booked, ?available=false the full ones
+        available = self.request.query_params.get('available')
+        if available in ('true', '1'):
+            queryset = queryset.available(now)
+        elif available in ('false', '0'):
+            queryset = queryset.filter(current_slots=0)
+        elif available:
+            logger.warning(f"Ignoring malformed available filter: {available}")
+
+        # ?q= matches name and instructor words by prefix (full-text index on SQLite)
+        text = self.search_text()
+        if text:
+            queryset = queryset.search(text)
 
         # Filtering :  1) Type 2) Date
         class_type = self.request.query_params.get('type')
         if class_type:
             queryset = queryset.filter(class_type=class_type)
         
-        date = self.request.query_params.get('date')
-        if isinstance(date, date_class):
-            try:
-                queryset = queryset.filter(date_time__date=date)
-            except Exception as e:
-                logger.error(f"Error filtering by date: {e}")
-                pass
-        
+        # ?date=, ?from= and ?to= are days in the caller's timezone (X-Timezone), filtered as a
+        # half-open range on date_time so the index is used (date_time__date wraps the column)
+        date = self.local_day('date')
+        if date:
+            queryset = self.until_end_of(queryset.filter(date_time__gte=self.earliest(date)), date)
+        start = self.local_day('from')
+        if start:
+            queryset = queryset.filter(date_time__gte=self.earliest(start))
+        end = self.local_day('to')
+        if end:
+            queryset = self.until_end_of(queryset, end)
         return queryset
-    
+
+    def local_day(self, param):
+        """ Local midnight starting the ?<param>=YYYY-MM-DD day, None when the param is absent """
+        value = self.request.query_params.get(param)
+        if not value:
+            return None
+        try:
+            day = date_class.fromisoformat(value)
+        except ValueError:
+            raise ValidationError({param: ["Use a date such as 2025-07-01."]})
+        return datetime.combine(day, datetime_time.min, tzinfo=ZoneInfo(timezone.get_current_timezone_name()))
+
+    @staticmethod
+    def earliest(midnight):
+        """ `midnight` as a lower bound, clamped to datetime.min when it is before it in UTC """
+        try:
+            # East of UTC, midnight of 0001-01-01 is before datetime.min once converted for the query
+            midnight.astimezone(dt_timezone.utc)
+        except OverflowError:
+            return datetime.min.replace(tzinfo=dt_timezone.utc)
+        return midnight
+
+    def until_end_of(self, queryset, midnight):
+        """ Classes before the end of the local day starting at `midnight`, unbounded for the last day of the calendar """
+        following = self.next_day(midnight)
+        if following is None:
+            return queryset
+        return queryset.filter(date_time__lt=following)
+
+    @staticmethod
+    def next_day(midnight):
+        """ The next local midnight, None past datetime.max """
+        try:
+            # Aware arithmetic is wall-clock, so this is the next local midnight even across DST changes
+            following = midnight + timedelta(days=1)
+            following.astimezone(dt_timezone.utc)
+        except OverflowError:
+            return None
+        return following
+
+class ClassCalendarView(APIView):
+    """
+    Classes of one ISO week bucketed by local day (X-Timezone) with per-day totals [GET /classes/calendar/?week=2025-W27]
+    Defaults to the current week. Rows, days and totals come from one query, and responses are cached
+    per week, timezone and schedule version like the class list.
+    """
+    permission_classes = [AllowAny]
+    week_pattern = re.compile(r'^(\d{4})-W(\d{2})$')
+    columns = ('id', 'name', 'class_type', 'instructor', 'duration_minutes', 'date_time', 'total_slots')
+
+    def get(self, request):
+        try:
+            start, end = self.week_bounds(self.week_start(request.query_params.get('week')))
+        except (ValueError, OverflowError):
+            return Response({"week": ["Use an ISO week such as 2025-W27."]}, status=status.HTTP_400_BAD_REQUEST)
+        year, number, _ = start.date().isocalendar()
+        week = f"{year}-W{number:02d}"
+        if not class_list_cache_setting('ENABLED'):
+            return Response(self.calendar(start, end, week))
+        cache = get_cache()
+        key = calendar_cache_key(week)
+        data = cache.get(key)
+        if data is None:
+            data = self.calendar(start, end, week)
+            cache.set(key, data, class_list_cache_setting('TTL'))
+        return Response(data)
+
+    def week_start(self, value):
+        """ Monday of ?week=YYYY-Www, of the current local week when absent; ValueError when malformed """
+        if not value:
+            today = timezone.localdate()
+            return today - timedelta(days=today.weekday())
+        match = self.week_pattern.match(value)
+        if not match:
+            raise ValueError(value)
+        return date_class.fromisocalendar(int(match[1]), int(match[2]), 1)
+
+    @staticmethod
+    def week_bounds(monday):
+        """ Local midnights starting `monday` and the next Monday; OverflowError for weeks at the ends of the calendar """
+        start = datetime.combine(monday, datetime_time.min, tzinfo=ZoneInfo(timezone.get_current_timezone_name()))
+        # Aware arithmetic is wall-clock, so this ends at the next local Monday even across DST changes
+        end = start + timedelta(days=7)
+        # Both are converted to UTC for the query
+        start.astimezone(dt_timezone.utc)
+        end.astimezone(dt_timezone.utc)
+        return start, end
+
+    def calendar(self, start, end, week):
+        tz = start.tzinfo
+        monday = start.date()
+        now = timezone.now()
+        day = TruncDate('date_time', tzinfo=tz)
+        # Only classes that have not started still offer their free slots
+        free = Case(When(date_time__gt=now, then=F('current_slots')), default=Value(0))
+        rows = (
+            Classes.objects.scheduled().with_current_slots()
+            .filter(date_time__gte=start, date_time__lt=end)
+            .annotate(
+                day=day,
+                day_total_slots=Window(Sum('total_slots'), partition_by=day),
+                day_available_slots=Window(Sum(free), partition_by=day),
+            )
+            .order_by('date_time', 'id')
+            .values(*self.columns, 'current_slots', 'day', 'day_total_slots', 'day_available_slots')
+        )
+
+        days = {
+            monday + timedelta(days=offset): {'total_slots': 0, 'available_slots': 0, 'classes': []}
+            for offset in range(7)
+        }
+        # Renders date_time in the current timezone like ClassesSerializer
+        date_time = DateTimeField()
+        for row in rows:
+            bucket = days[row['day']]
+            bucket['total_slots'] = row['day_total_slots']
+            bucket['available_slots'] = row['day_available_slots']
+            bucket['classes'].append({
+                **{column: row[column] for column in self.columns},
+                'date_time': date_time.to_representation(row['date_time']),
+                'available_slots': row['current_slots'],
+                'is_available': row['date_time'] > now and row['current_slots'] > 0,
+            })
+        return {
+            'week': week,
+            'timezone': tz.key,
+            'days': [{'date': date.isoformat(), **bucket} for date, bucket in days.items()],
+        }
+
+class ClassAvailabilityView(APIView):
+    """
+    Free slots of the upcoming classes as {id: available_slots} with the change sequence [GET /classes/availability]
+    ?since=<seq> returns only the classes changed after it, null for classes deleted, cancelled or started since.
+    'full' is true when the map is a complete snapshot to replace the client's copy rather than merge into it.
+    """
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        # Read the sequence before the counts: a change landing in between is sent again next time, never lost
+        seq = SlotChange.latest_seq()
+        now = timezone.now()
+        upcoming = Classes.objects.scheduled().with_current_slots().filter(date_time__gt=now)
+        since = self.since_entry()
+        if since is None:
+            # Sorted here, ORDER BY id would walk the primary key instead of the date_time index
+            classes = dict(sorted(upcoming.values_list('id', 'current_slots')))
+            return Response({'seq': seq, 'full': True, 'classes': classes})
+
+        changed = set(SlotChange.changes_after(since.id, since.changed_at).values_list('fitness_class_id', flat=True))
+        # Classes that started after the client's snapshot leave the feed without a log entry
+        changed.update(
+            Classes.objects.filter(date_time__gt=since.changed_at, date_time__lte=now).values_list('id', flat=True)
+        )
+        slots = dict(upcoming.filter(id__in=changed).values_list('id', 'current_slots'))
+        classes = {pk: slots.get(pk) for pk in sorted(changed)}
+        return Response({'seq': seq, 'full': False, 'classes': classes})
+
+    def since_entry(self):
+        """ Log entry named by ?since=, None (send a full snapshot) when absent, malformed or already pruned """
+        value = self.request.query_params.get('since')
+        if not value:
+            return None
+        try:
+            seq = int(value)
+        except ValueError:
+            logger.warning(f"Ignoring malformed since parameter: {value}")
+            return None
+        return SlotChange.objects.filter(id=seq).only('id', 'changed_at').first()
+
+class ClassSlotStreamView(View):
+    """
+    Server-Sent Events stream of free slots [GET /classes/stream/?classes=1,2,3]
+    A 'slots' event carries the current counts first, then the counts that changed (null once a class
+    is deleted or cancelled), with keepalive comments in between. fitnessAPI.asgi serves this path with
+    live.SlotStreamApp instead, which holds no thread per open stream.
+    """
+    async def get(self, request):
+        if not isinstance(request, ASGIRequest):
+            # A WSGI server would buffer the endless stream in a worker thread
+            return JsonResponse({"error": "The slot stream needs an ASGI server."}, status=501)
+        try:
+            class_ids = parse_class_ids(request.GET.get('classes', ''))
+        except ValueError as e:
+            return JsonResponse({"classes": [str(e)]}, status=400)
+        response = StreamingHttpResponse(await open_stream(class_ids))
+        for name, value in STREAM_HEADERS.items():
+            response[name] = value
+        return response
+
 class ClassCreateView(generics.CreateAPIView):
     """ Create new Class (Admin Only) [POST /admin/classes] """
     queryset = Classes.objects.all()
@@ -58,50 +439,245 @@ class ClassCreateView(generics.CreateAPIView):
     
     def perform_create(self, serializer):
         logger.info(f"Admin {self.request.user.username} creating new class: {serializer.validated_data['name']}")
-        return super().perform_create(serializer)
+        with transaction.atomic():
+            super().perform_create(serializer)
+            SlotChange.record(serializer.instance.pk)
+        bump_schedule_version()
 
-class ClassUpdateDeleteView(generics.UpdateAPIView, generics.DestroyAPIView):
+class ClassUpdateDeleteView(generics.RetrieveUpdateDestroyAPIView):
     """
-    Update Classes (Admin Only) [PUT/PATCH /admin/classes/<id>]
+    Get Class with its ETag (Admin Only) [GET /admin/classes/<id>]
+    Update Classes (Admin Only) [PUT/PATCH /admin/classes/<id>], send If-Match: <ETag> to reject stale edits
     Delete Classes (Admin Only) [DELETE /admin/classes/<id>s]
     """
-    queryset = Classes.objects.all()
+    queryset = Classes.objects.with_current_slots()
     serializer_class = ClassesSerializer
     permission_classes = [IsAdminUser]
 
-    def perform_update(self, serializer):
-        logger.info(f"Admin {self.request.user.username} updating class: {serializer.validated_data['name']}")
-        return super().perform_update(serializer)
+    @staticmethod
+    def etag(instance):
+        return quote_etag(str(instance.version))
+
+    def expected_version(self, instance):
+        """ Version named by If-Match, the current one when the header is absent or '*', None if unparsable """
+        header = self.request.headers.get('If-Match')
+        if not header:
+            return instance.version
+        etags = parse_etags(header)
+        if etags == ['*']:
+            return instance.version
+        for etag in etags:
+            try:
+                return int(etag.removeprefix('W/').strip('"'))
+            except ValueError:
+                continue
+        return None
+
+    def precondition_failed(self, instance):
+        logger.warning(f"Admin {self.request.user.username} sent a stale version for class ID {instance.pk}.")
+        return Response(
+            {"error": "The class was modified by someone else, reload it and retry."},
+            status=status.HTTP_412_PRECONDITION_FAILED,
+            headers={'ETag': self.etag(instance)}
+        )
+
+    def check_precondition(self, instance):
+        """ Response refusing the request when If-Match is malformed or stale, else None """
+        version = self.expected_version(instance)
+        if version is None:
+            return Response({"error": "If-Match must be an ETag returned for this class."}, status=status.HTTP_400_BAD_REQUEST)
+        if version != instance.version:
+            return self.precondition_failed(instance)
+        return None
+
+    def write_refused(self, pk, version, changes):
+        """ Response explaining why update_if_current wrote nothing, from the row as it is now """
+        current = Classes.objects.get(pk=pk)
+        if current.version != version:
+            return self.precondition_failed(current)
+        if current.cancelled_at:
+            return Response({"error": "This class has been cancelled and can no longer be edited."}, status=status.HTTP_409_CONFLICT)
+        if 'total_slots' in changes and current.shard_count:
+            return Response(
+                {"total_slots": ["Switch off slot sharding before changing total slots."]},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if 'total_slots' in changes and current.available_slots + changes['total_slots'] - current.total_slots < 0:
+            return Response(
+                {"total_slots": ["Total slots cannot be lower than the slots already booked."]},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return self.precondition_failed(current)
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        return Response(self.get_serializer(instance).data, headers={'ETag': self.etag(instance)})
+
+    def update(self, request, *args, **kwargs):
+        partial = kwargs.pop('partial', False)
+        instance = self.get_object()
+        if instance.cancelled_at:
+            return Response({"error": "This class has been cancelled and can no longer be edited."}, status=status.HTTP_409_CONFLICT)
+        refused = self.check_precondition(instance)
+        if refused is not None:
+            return refused
+        version = instance.version
+
+        serializer = self.get_serializer(instance, data=request.data, partial=partial)
+        serializer.is_valid(raise_exception=True)
+        # Write only the fields that changed, never the booking counters
+        changes = {
+            field: value for field, value in serializer.validated_data.items()
+            if getattr(instance, field) != value
+        }
+        if 'total_slots' in changes and instance.shard_count:
+            return Response(
+                {"total_slots": ["Switch off slot sharding before changing total slots."]},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        logger.info(f"Admin {request.user.username} updating class: {instance.name}")
+        if changes and not instance.update_if_current(version, changes):
+            return self.write_refused(instance.pk, version, changes)
+        if changes:
+            bump_schedule_version()
+
+        instance = self.get_queryset().get(pk=instance.pk)
+        return Response(self.get_serializer(instance).data, headers={'ETag': self.etag(instance)})
+
+    def destroy(self, request, *args, **kwargs):
+        instance = self.get_object()
+        refused = self.check_precondition(instance)
+        if refused is not None:
+            return refused
+        self.perform_destroy(instance)
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
     def perform_destroy(self, instance):
         logger.info(f"Admin {self.request.user.username} deleting class: {instance.name}")
-        return super().perform_destroy(instance)
+        with transaction.atomic():
+            SlotChange.record(instance.pk)
+            super().perform_destroy(instance)
+        bump_schedule_version()
     
+class ClassCancelView(APIView):
+    """
+    Call off a class and cancel all of its bookings (Admin Only) [POST /classes/<pk>/cancel]
+    """
+    permission_classes = [IsAdminUser]
+
+    def post(self, request, pk):
+        fitness_class = get_object_or_404(Classes, pk=pk)
+        result = fitness_class.cancel_all_bookings()
+        logger.info(
+            f"Admin {request.user.username} cancelled class ID {pk}, "
+            f"{len(result['user_ids'])} bookings cancelled."
+        )
+        return Response({"cancelled_bookings": len(result['user_ids']), **result}, status=status.HTTP_200_OK)
+
 class BookingCreateView(generics.CreateAPIView):
     """
     Book a class [POST /book] 
     """
     serializer_class = BookingSerializer
+
+    @idempotent
+    def post(self, request, *args, **kwargs):
+        if self.is_queued(request):
+            return self.enqueue(request)
+        return super().post(request, *args, **kwargs)
     
     def perform_create(self, serializer):
         user = self.request.user
         logger.info(f"User {user.username} is booking a class.")
         serializer.save(user=user)
 
-class BookingListView(generics.ListAPIView):
+    def is_queued(self, request):
+        # Queued intake is switched on globally or asked for per request
+        if getattr(settings, 'BOOKING_INTAKE', 'sync') == 'queued':
+            return True
+        return 'respond-async' in request.headers.get('Prefer', '')
+
+    def enqueue(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        fitness_class_id = serializer.validated_data['fitness_class_id']
+        # Cheap unlocked read to turn away obviously bad requests, the worker re-checks everything
+        if not Classes.objects.scheduled().filter(id=fitness_class_id, date_time__gt=timezone.now()).exists():
+            return Response({"error": "This class is not available for booking."}, status=status.HTTP_400_BAD_REQUEST)
+        ticket = BookingTicket.objects.create(user=request.user, fitness_class_id=fitness_class_id)
+        logger.info(f"User {request.user.username} queued booking ticket {ticket.id} for class ID {fitness_class_id}.")
+        location = reverse('booking-ticket', kwargs={'pk': ticket.pk})
+        return Response(
+            BookingTicketSerializer(ticket).data,
+            status=status.HTTP_202_ACCEPTED,
+            headers={'Location': location, **BookingTicketView.retry_headers()}
+        )
+
+class BookingHoldCreateView(generics.CreateAPIView):
     """
-    List all bookings of the user [GET /booking | /booking/?email=<email>&status=<status> (Admin Only)] 
+    Hold a slot for a few minutes before confirming it [POST /book/hold]
     """
     serializer_class = BookingSerializer
-    
-    def get_queryset(self):
+
+    @idempotent
+    def post(self, request, *args, **kwargs):
+        return super().post(request, *args, **kwargs)
+
+    def perform_create(self, serializer):
+        user = self.request.user
+        logger.info(f"User {user.username} is holding a slot.")
+        serializer.save(user=user, status='HELD')
+
+class BookingConfirmView(APIView):
+    """
+    Confirm a held booking [POST /bookings/<pk>/confirm]
+    """
+    permission_classes = [IsAdminOrOwner]
+
+    @idempotent
+    def post(self, request, pk):
+        booking = get_object_or_404(Booking, pk=pk)
+        self.check_object_permissions(request, booking)
+        if not booking.confirm():
+            logger.warning(f"Hold confirmation failed for booking ID {pk} by user {request.user.username}.")
+            return Response({"error": "Booking is not held or the hold has expired."}, status=status.HTTP_400_BAD_REQUEST)
+        logger.info(f"Booking ID {pk} confirmed by user {request.user.username}.")
+        return Response(BookingSerializer(booking).data, status=status.HTTP_200_OK)
+
+class BookingTicketView(APIView):
+    """
+    Status of a queued booking [GET /book/tickets/<pk>]
+    A pending ticket is answered at once with Retry-After, the client polls instead of holding a worker
+    """
+    @staticmethod
+    def retry_headers():
+        return {'Retry-After': str(getattr(settings, 'BOOKING_TICKET_RETRY_AFTER', 1))}
+
+    def get(self, request, pk):
+        filters = {} if request.user.is_staff else {'user': request.user}
+        ticket = get_object_or_404(BookingTicket, pk=pk, **filters)
+        headers = self.retry_headers() if ticket.status == 'PENDING' else None
+        return Response(BookingTicketSerializer(ticket).data, status=status.HTTP_200_OK, headers=headers)
+
+class BookingBatchCreateView(APIView):
+    """
+    Book several classes in one transaction [POST /book/batch]
+    """
+    def post(self, request):
+        serializer = BatchBookingSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        logger.info(f"User {request.user.username} is batch booking {len(serializer.validated_data['fitness_class_ids'])} classes.")
+        results = serializer.save(user=request.user)
+        booked = sum(1 for result in results if result['booked'])
+        response_status = status.HTTP_201_CREATED if booked else status.HTTP_400_BAD_REQUEST
+        return Response({"booked": booked, "results": results}, status=response_status)
+
+class BookingFilterMixin:
+    """ ?email= and ?status= filters of the admin booking views """
+
+    def filter_bookings(self, queryset):
         user = self.request.user
-        # Prefetch user for efficiency
-        queryset = Booking.objects.select_related('user').all()
-        # If user is not admin, filter bookings by user
-        if not user.is_staff:
-            logger.info(f"User {user.username} is listing their bookings.")
-            return queryset.filter(user=user)
         # If user is admin, allow filtering by email
         email = self.request.query_params.get('email')
         if email:
@@ -111,14 +687,88 @@ class BookingListView(generics.ListAPIView):
         status = self.request.query_params.get("status")
         if status:
             logger.info(f"Filtering bookings by status: {status}")
-            queryset = queryset.filter(status__iexact=status)
+            # Exact match on the stored upper-case value so the status indexes apply
+            queryset = queryset.filter(status=status.upper())
         return queryset
+
+class BookingListView(BookingFilterMixin, SparseFieldsMixin, ConditionalListMixin, FastReadMixin, generics.ListAPIView):
+    """
+    List all bookings of the user [GET /booking | /booking/?email=<email>&status=<status> (Admin Only)] 
+    """
+    serializer_class = BookingSerializer
+    pagination_class = KeysetPagination
+    keyset_ordering = ('booked_at', 'id')
+
+    def get_validators(self):
+        """
+        ETag from counters rather than an aggregate over the filtered bookings, which would read all
+        of them on every page. The schedule version moves on commit of every booking, cancellation,
+        hold, confirmation and class or slot change (the embedded classes included), and the newest
+        class start flips is_available of an embedded class. No Last-Modified: revalidate with If-None-Match.
+        """
+        user = self.request.user
+        last_start = (
+            Classes.objects.filter(date_time__lte=timezone.now()).order_by('-date_time')
+            .values_list('date_time', flat=True).first()
+        )
+        params = urlencode(sorted(self.request.query_params.lists()), doseq=True)
+        raw = '|'.join([
+            str(get_schedule_version()), str(last_start), str(user.pk), str(user.is_staff), params,
+            timezone.get_current_timezone_name(),
+        ])
+        return quote_etag(hashlib.md5(raw.encode()).hexdigest()), None
+    
+    def get_queryset(self):
+        user = self.request.user
+        # Prefetch user and class for efficiency
+        queryset = Booking.objects.select_related('user', 'fitness_class').all()
+        # If user is not admin, filter bookings by user
+        if not user.is_staff:
+            logger.info(f"User {user.username} is listing their bookings.")
+            return queryset.filter(user=user)
+        return self.filter_bookings(queryset)
+
+class BookingExportView(BookingFilterMixin, APIView):
+    """
+    Stream all bookings (Admin Only) [GET /bookings/export/?format=ndjson|csv&email=<email>&status=<status>]
+    Rows are read with values_list().iterator() and encoded chunk by chunk, so memory stays flat.
+    """
+    permission_classes = [IsAdminUser]
+    renderer_classes = [NDJSONRenderer, CSVRenderer]
+    columns = (
+        'id', 'user_id', 'user__username', 'user__email', 'fitness_class_id', 'fitness_class__name',
+        'fitness_class__class_type', 'fitness_class__date_time', 'status', 'booked_at', 'cancelled_at', 'expires_at',
+    )
+    chunk_size = 2000
+
+    def get(self, request):
+        renderer = request.accepted_renderer
+        rows = (
+            self.filter_bookings(Booking.objects.order_by('id'))
+            .values_list(*self.columns)
+            .iterator(chunk_size=self.chunk_size)
+        )
+        logger.info(f"Admin {request.user.username} is exporting bookings as {renderer.format}.")
+        response = StreamingHttpResponse(
+            renderer.stream(self.columns, rows),
+            content_type=f'{renderer.media_type}; charset={renderer.charset}'
+        )
+        response['Content-Disposition'] = f'attachment; filename="bookings.{renderer.format}"'
+        return response
+
+    def handle_exception(self, exc):
+        # Errors are answered as JSON whatever export format was asked for
+        self.request.accepted_renderer = ORJSONRenderer()
+        self.request.accepted_media_type = ORJSONRenderer.media_type
+        return super().handle_exception(exc)
     
 class BookingCancelView(APIView):
     """
     Cancel a booking [POST /bookings/<pk>/cancel]
     """
     permission_classes = [IsAdminOrOwner]
+
+    @idempotent
     def post(self, request, pk):
         # Get the booking object or return 404
         booking = get_object_or_404(Booking, pk=pk)
@@ -132,6 +782,25 @@ class BookingCancelView(APIView):
         logger.info(f"Booking ID {pk} cancelled successfully by user {request.user.username}.")
         return Response({"message": "Booking cancelled successfully."}, status=status.HTTP_200_OK)
     
+class ClassWaitlistView(APIView):
+    """
+    Join the waitlist of a full class [POST /classes/<pk>/waitlist]
+    Leave the waitlist [DELETE /classes/<pk>/waitlist]
+    """
+    def post(self, request, pk):
+        serializer = WaitlistSerializer(data={})
+        serializer.is_valid(raise_exception=True)
+        serializer.save(user=request.user, fitness_class_id=pk)
+        logger.info(f"User {request.user.username} joined the waitlist for class ID {pk}.")
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def delete(self, request, pk):
+        deleted, _ = Waitlist.objects.filter(user=request.user, fitness_class_id=pk).delete()
+        if not deleted:
+            return Response({"error": "You are not on the waitlist for this class."}, status=status.HTTP_404_NOT_FOUND)
+        logger.info(f"User {request.user.username} left the waitlist for class ID {pk}.")
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
 class StatisticsView(APIView):
     """
     Get statistics of classes [GET /classes/statistics]
@@ -13,4 +13,10 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fitnessAPI.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once Django is set up
+from booking_api.live import SlotStreamApp  # noqa: E402
+
+# Slot streams are served outside Django's handler, which keeps a thread per open request
+application = SlotStreamApp(django_application)
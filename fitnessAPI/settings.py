@@ -83,9 +83,27 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Take the write lock when a transaction starts instead of failing to upgrade a read lock later
+            'transaction_mode': 'IMMEDIATE',
+        },
     }
 }
 
+# Applied to every new SQLite connection by booking_api.db.configure_sqlite
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'busy_timeout': 5000,
+    'synchronous': 'NORMAL',
+}
+
+# Retries of BookingSerializer.save and Booking.cancel on "database is locked"
+SQLITE_LOCK_RETRY = {
+    'ATTEMPTS': 5,
+    'BASE_DELAY': 0.02,
+    'MAX_DELAY': 0.5,
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -130,11 +148,112 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
         'DEFAULT_AUTHENTICATION_CLASSES' : [
-            'rest_framework_simplejwt.authentication.JWTAuthentication'
+            # JWTAuthentication that also applies the user's stored timezone
+            'booking_api.authentication.TimezoneJWTAuthentication'
         ],
         'DEFAULT_PERMISSION_CLASSES' : [
             'rest_framework.permissions.IsAuthenticated'
         ],
+        # orjson when installed, stdlib json otherwise (settings_production drops the browsable API)
+        'DEFAULT_RENDERER_CLASSES' : [
+            'booking_api.renderers.ORJSONRenderer',
+            'rest_framework.renderers.BrowsableAPIRenderer',
+        ],
+        'DEFAULT_PARSER_CLASSES' : [
+            'booking_api.renderers.ORJSONParser',
+            'rest_framework.parsers.FormParser',
+            'rest_framework.parsers.MultiPartParser',
+        ],
+}
+
+# Booking engine used by BookingSerializer.save and Booking.cancel
+#   'locking'     : lock the class row with select_for_update and save it back
+#   'conditional' : claim slots with a single guarded UPDATE, duplicates rejected by the unique constraint
+BOOKING_ENGINE = 'locking'
+
+# Booking intake for POST /api/book/
+#   'sync'   : book inside the request
+#   'queued' : store a BookingTicket and answer 202, process_booking_queue grants tickets in batches
+# Clients can also ask for queued intake per request with the 'Prefer: respond-async' header.
+BOOKING_INTAKE = 'sync'
+# Seconds a client is told (Retry-After) to wait before polling a pending ticket again
+BOOKING_TICKET_RETRY_AFTER = 1
+
+# Minutes a HELD booking keeps its slot before release_expired_holds gives it back
+BOOKING_HOLD_MINUTES = 10
+
+# How a booking picks the slot shard of a sharded class ('hash' of the user id or 'random')
+SLOT_SHARD_STRATEGY = 'hash'
+
+# Idempotency-Key handling for booking and cancellation POSTs
+#   STORE       : booking_api.idempotency.DatabaseIdempotencyStore or CacheIdempotencyStore
+#   TTL         : seconds a stored response is replayed for
+#   PENDING_TTL : seconds a key stays reserved for a request that never finished
+#   CACHE_ALIAS : cache used by CacheIdempotencyStore
+IDEMPOTENCY = {
+    'STORE': 'booking_api.idempotency.DatabaseIdempotencyStore',
+    'TTL': 24 * 60 * 60,
+    'PENDING_TTL': 60,
+    'CACHE_ALIAS': 'default',
+}
+
+# Serve GET /api/classes/ and /api/bookings/ from .values() rows through
+# booking_api.fast_serializers instead of the DRF serializers (same output)
+FAST_READ_SERIALIZERS = True
+
+# ?q= class search (ClassListView, admin)
+#   'fts5'      : word prefix search on the booking_api_classes_fts index, ranked by bm25 (SQLite only)
+#   'icontains' : icontains filters on name and instructor, also used on other databases
+CLASS_SEARCH_BACKEND = 'fts5'
+
+# Server-Sent Events stream of free slots, GET /api/classes/stream/?classes=1,2 (needs an ASGI server)
+#   KEEPALIVE     : seconds between keepalive comments on an idle stream
+#   POLL_INTERVAL : seconds between reads of the SlotChange log for changes committed by other processes
+#   MAX_CLASSES   : class ids one stream may subscribe to
+SLOT_STREAM = {
+    'KEEPALIVE': 15,
+    'POLL_INTERVAL': 2,
+    'MAX_CLASSES': 100,
+}
+
+# Seconds of the SlotChange log re-read before a reader's previous read (?since= and the stream poller).
+# Log ids are allocated on insert but visible on commit, so with concurrent writers (PostgreSQL, MySQL)
+# an entry can appear below an id already read; keep this above the longest booking transaction.
+SLOT_CHANGE_REREAD_WINDOW = 10
+
+# Shared by every process on the host: web workers, release_expired_holds, process_booking_queue, ...
+# The class list cache needs that, a schedule version bumped by one process must be seen by all
+# of them. Use the database cache (or Redis / Memcached) when the workers run on several hosts.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
+    }
+}
+
+# Response cache for the public class list, invalidated by bumping a schedule version on commit
+#   ENABLED     : serve GET /api/classes/ from the cache
+#   TTL         : seconds a cached page lives (also bounds how long a class that just started is listed)
+#   CACHE_ALIAS : cache holding the pages and the schedule version, shared by every process
+#                 (a locmem cache is per process, manage.py check warns about it)
+CLASS_LIST_CACHE = {
+    'ENABLED': True,
+    'TTL': 60,
+    'CACHE_ALIAS': 'default',
+}
+
+# booking_api.middleware.TimezoneMiddleware, activating the X-Timezone header (or the user's stored timezone)
+#   CACHE_SIZE         : resolved zones kept
+#   INVALID_CACHE_SIZE : invalid names remembered, so they are not looked up again
+#   LOG_EVERY          : log one in this many invalid names
+#   CACHE_ALIAS        : cache holding the users' stored timezone names
+#   PREFERENCE_TTL     : seconds a stored timezone name is cached (saving the preference refreshes it)
+TIMEZONE_MIDDLEWARE = {
+    'CACHE_SIZE': 256,
+    'INVALID_CACHE_SIZE': 1024,
+    'LOG_EVERY': 100,
+    'CACHE_ALIAS': 'default',
+    'PREFERENCE_TTL': 300,
 }
 
 SIMPLE_JWT = {
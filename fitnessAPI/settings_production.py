@@ -0,0 +1,29 @@
+"""
+Production settings: DJANGO_SETTINGS_MODULE=fitnessAPI.settings_production
+
+JSON only (no browsable API, no form/multipart parsing), debug off, secrets and hosts from the environment.
+DJANGO_SECRET_KEY must be set, the development key in settings.py is public.
+"""
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+
+from .settings import *  # noqa: F401,F403
+from .settings import REST_FRAMEWORK
+
+DEBUG = False
+
+SECRET_KEY = os.environ.get('DJANGO_SECRET_KEY')
+if not SECRET_KEY:
+    raise ImproperlyConfigured("Set the DJANGO_SECRET_KEY environment variable for production settings.")
+ALLOWED_HOSTS = [host for host in os.environ.get('DJANGO_ALLOWED_HOSTS', '').split(',') if host]
+
+REST_FRAMEWORK = {
+    **REST_FRAMEWORK,
+    'DEFAULT_RENDERER_CLASSES': [
+        'booking_api.renderers.ORJSONRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'booking_api.renderers.ORJSONParser',
+    ],
+}